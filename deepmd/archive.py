@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+    All-time archive of the non-dominated individuals
+
+    Truncation selection keeps only pop_size individuals, so non-dominated
+    individuals that get crowded out are otherwise lost unless someone digs
+    through individuals.csv afterwards.  ParetoArchive is a probe for the
+    newly evaluated individuals that keeps every individual that isn't
+    dominated by another evaluated so far, along with where its model was
+    trained, and saves the archive with the run every time it changes.
+
+    For our two objectives, the archive is kept sorted by the first
+    objective, in which order the second objective strictly decreases, so
+    checking whether a new individual is dominated is a binary search.  Any
+    other number of objectives falls back to comparing against every member.
+
+    Both objectives are minimized, as our errors are; only full trainings that
+    weren't stopped early are archived, since the fitnesses of reduced or
+    partial trainings aren't comparable.
+
+    usage: archive.py pareto_archive.json
+"""
+import json
+import logging
+import os
+import sys
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ArchiveEntry = namedtuple('ArchiveEntry', ['fitness', 'uuid', 'model_dir',
+                                           'birth_id', 'numb_steps'])
+
+
+class ParetoArchive:
+    """ Incrementally updated archive of the non-dominated individuals """
+
+    def __init__(self, path, problem=None, resume=False):
+        """
+        :param path: of the JSON file to which the archive is saved
+        :param problem: being solved, to tell full trainings from reduced ones
+            and find where the models are; only needed to archive individuals
+        :param resume: if True, start from the archive saved at `path`, if
+            any, rather than an empty one
+        """
+        self.path = Path(path)
+        self.problem = problem
+        self.entries = []
+        # First objective of each entry, for the binary searches
+        self.keys = []
+
+        if resume and self.path.exists():
+            self.load()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __call__(self, population):
+        """ Archive the newly evaluated individuals that aren't dominated
+
+        :param population: newly evaluated individuals
+        :returns: the same population
+        """
+        changed = False
+
+        for individual in population:
+            entry = self.entry(individual)
+            if entry is not None:
+                changed |= self.insert(entry)
+
+        if changed:
+            self.save()
+
+        return population
+
+    def entry(self, individual):
+        """ :returns: ArchiveEntry for the individual, or None if it shouldn't
+            be archived """
+        numb_steps = getattr(individual, 'numb_steps', None)
+
+        if not individual.is_viable or numb_steps != self.problem.numb_steps:
+            return None
+
+        if getattr(individual, 'stop_reason', None):
+            return None
+
+        fitness = tuple(float(x) for x in np.atleast_1d(individual.fitness))
+        if not np.isfinite(fitness).all():
+            return None
+
+        # Individuals with cached fitnesses use the model they were cached from
+        model_dir = self.problem.model_dir(individual).absolute()
+
+        return ArchiveEntry(fitness, str(individual.uuid), str(model_dir),
+                            individual.birth_id, numb_steps)
+
+    def is_dominated(self, fitness):
+        """ :returns: True if some member is at least as good as `fitness` in
+            every objective """
+        if not self.entries:
+            return False
+
+        if len(fitness) == 2:
+            i = bisect_right(self.keys, fitness[0])
+            return i > 0 and self.entries[i - 1].fitness[1] <= fitness[1]
+
+        return bool((np.array([entry.fitness for entry in self.entries])
+                     <= fitness).all(axis=1).any())
+
+    def insert(self, entry):
+        """ Add an entry unless it's dominated, removing any it dominates
+
+        :param entry: ArchiveEntry to add
+        :returns: True if the entry was added
+        """
+        fitness = entry.fitness
+
+        if self.is_dominated(fitness):
+            return False
+
+        if len(fitness) == 2:
+            # Those it dominates follow it, up to the first with a better
+            # second objective.
+            start = end = bisect_left(self.keys, fitness[0])
+            while end < len(self.entries) and \
+                    self.entries[end].fitness[1] >= fitness[1]:
+                end += 1
+
+            self.entries[start:end] = [entry]
+            self.keys[start:end] = [fitness[0]]
+        else:
+            self.entries = [member for member in self.entries
+                            if not all(np.less_equal(fitness, member.fitness))]
+            self.entries.append(entry)
+            self.entries.sort()
+            self.keys = [member.fitness[0] for member in self.entries]
+
+        logger.debug(f'Archived {entry.uuid} with fitness {fitness}; '
+                     f'{len(self.entries)} non-dominated')
+
+        return True
+
+    def front(self):
+        """ :returns: list of the ArchiveEntry of every non-dominated
+            individual, in order of the first objective """
+        return list(self.entries)
+
+    def uuids(self):
+        """ :returns: UUIDs of the non-dominated individuals """
+        return [entry.uuid for entry in self.entries]
+
+    def model_dirs(self):
+        """ :returns: directories with the models of the non-dominated
+            individuals """
+        return [entry.model_dir for entry in self.entries]
+
+    def save(self):
+        """ Atomically save the archive """
+        tmp_path = self.path.with_name(f'.{self.path.name}.tmp')
+
+        with open(tmp_path, 'w') as archive_file:
+            json.dump([entry._asdict() for entry in self.entries],
+                      archive_file, indent=2)
+
+        os.replace(tmp_path, self.path)
+
+    def load(self):
+        """ Load the saved archive """
+        with open(self.path, 'r') as archive_file:
+            self.entries = [ArchiveEntry(**dict(entry,
+                                                fitness=tuple(entry['fitness'])))
+                            for entry in json.load(archive_file)]
+
+        self.keys = [entry.fitness[0] for entry in self.entries]
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        sys.exit(__doc__)
+
+    from rich.console import Console
+    from rich.table import Table
+
+    table = Table(title='Pareto front')
+    for column in ('energy', 'force', 'uuid', 'model directory'):
+        table.add_column(column)
+
+    for entry in ParetoArchive(sys.argv[1], resume=True).front():
+        table.add_row(*[f'{x:.6g}' for x in entry.fitness[:2]], entry.uuid,
+                      entry.model_dir)
+
+    Console().print(table)
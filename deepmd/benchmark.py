@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+    Benchmarks for the client-side hot paths of deepmd-tuner.py
+
+    While trainings take hours, everything the client does between them is
+    serial, so as we scale up the number of workers and the population size,
+    the client can become the bottleneck.  This times each stage of a
+    generation of run_ea() on synthetic populations of evaluated
+    DeepMDIndividuals for a range of population sizes:
+
+    - decode -- decoding every genome, as the CSV probes do
+    - rank_ordinal_sort -- LEAP's NSGA-II ranking of offspring and parents,
+      for reference
+    - rank_sort -- selection's vectorized ranking, which run_ea() uses
+    - crowding_distance_calc -- LEAP's, of the ranked offspring and parents,
+      for reference
+    - crowding_distance -- selection's vectorized one, which run_ea() uses
+    - truncation_selection -- down to the population size
+    - log_worker_location -- writing the evaluated offspring to CSV
+    - log_pop -- writing the population to CSV
+    - scatter_gather -- round-tripping the population through dask workers
+
+    Results can be saved as JSON, and compared against a saved baseline, in
+    which case the exit status is 1 if any stage got slower than the
+    baseline by more than the tolerance.
+
+    usage: benchmark.py [--sizes 100 500 1000 5000] [--repeats 3]
+                        [--save results.json] [--baseline baseline.json]
+                        [--tolerance 0.25] [--no-dask]
+"""
+import argparse
+import json
+import sys
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+from rich.console import Console
+from rich.table import Table
+
+import leap_ec.ops as ops
+from leap_ec.global_vars import context
+from leap_ec.multiobjective.ops import rank_ordinal_sort, \
+    crowding_distance_calc
+
+from problem import DeepMDProblem
+from reporting import log_pop, log_worker_location
+from representation import DeepMDRepresentation
+from selection import rank_sort, crowding_distance
+
+DESCRIPTION = __doc__
+
+# Baseline shipped with the repo, for the default arguments
+BASELINE_FILE = Path(__file__).parent / 'benchmarks' / 'baseline.json'
+
+TEMPLATE = Path(__file__).parent / 'templates' / 'deepmd_input_alcl66.json'
+
+
+def round_trip(individual):
+    """ What the workers do with individuals for the scatter/gather
+    benchmark """
+    return individual
+
+
+def synthetic_population(size, rng):
+    """ Create a population that looks like it's been evaluated
+
+    :param size: of the population
+    :param rng: numpy random generator for the fitnesses
+    :returns: list of DeepMDIndividuals
+    """
+    problem = DeepMDProblem(tempfile.gettempdir(), TEMPLATE, test=True)
+    population = DeepMDRepresentation().create_population(size,
+                                                          problem=problem)
+
+    for individual in population:
+        individual.fitness = rng.lognormal(mean=(-4.5, -1.5), sigma=0.5)
+        individual.is_viable = True
+        individual.numb_steps = problem.numb_steps
+        individual.hostname = 'benchmark'
+        individual.pid = 0
+        individual.start_eval_time = 0.0
+        individual.stop_eval_time = 0.0
+
+    return population
+
+
+def time_stage(stage, repeats):
+    """ :returns: the fastest of `repeats` runs of stage(), in seconds """
+    times = []
+
+    for _ in range(repeats):
+        start = perf_counter()
+        stage()
+        times.append(perf_counter() - start)
+
+    return min(times)
+
+
+def benchmark(size, repeats, client=None, seed=42):
+    """ Time all the stages for one population size
+
+    :param size: population size
+    :param repeats: how many times to run each stage
+    :param client: optional dask client for the scatter/gather benchmark
+    :param seed: for the synthetic populations
+    :returns: dict of stage name -> seconds
+    """
+    rng = np.random.default_rng(seed)
+    parents = synthetic_population(size, rng)
+    offspring = synthetic_population(size, rng)
+    context['leap']['generation'] = 1
+
+    results = {}
+
+    results['decode'] = time_stage(
+        lambda: [individual.decode() for individual in offspring], repeats)
+
+    # rank_ordinal_sort appends the parents to the offspring it's given
+    results['rank_ordinal_sort'] = time_stage(
+        lambda: rank_ordinal_sort(list(offspring), parents=parents), repeats)
+    results['rank_sort'] = time_stage(
+        lambda: rank_sort(offspring, parents=parents), repeats)
+    ranked = rank_sort(offspring, parents=parents)
+
+    results['crowding_distance_calc'] = time_stage(
+        lambda: crowding_distance_calc(ranked), repeats)
+    results['crowding_distance'] = time_stage(
+        lambda: crowding_distance(ranked), repeats)
+    ranked = crowding_distance(ranked)
+
+    truncation = ops.truncation_selection(size=size,
+                                          key=lambda x: (-x.rank, x.distance))
+    results['truncation_selection'] = time_stage(lambda: truncation(ranked),
+                                                 repeats)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with open(Path(tmp_dir) / 'individuals.csv', 'w') as stream:
+            probe = log_worker_location(job=0, stream=stream)
+            results['log_worker_location'] = time_stage(
+                lambda: probe(offspring), repeats)
+
+        with open(Path(tmp_dir) / 'pop.csv', 'w') as stream:
+            probe = log_pop(job=0, context=context, stream=stream)
+            results['log_pop'] = time_stage(lambda: probe(parents), repeats)
+
+    if client is not None:
+        results['scatter_gather'] = time_stage(
+            lambda: client.gather(client.map(round_trip, offspring,
+                                             pure=False)),
+            repeats)
+
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """ Find the stages that got slower than the baseline
+
+    :param results: dict of size -> dict of stage -> seconds
+    :param baseline: the same, from a previous run
+    :param tolerance: how much slower, as a fraction, is still OK
+    :returns: list of (size, stage, seconds, baseline seconds) regressions
+    """
+    regressions = []
+
+    for size, stages in results.items():
+        for stage, seconds in stages.items():
+            reference = baseline.get(size, {}).get(stage)
+            if reference is not None and seconds > reference * (1 + tolerance):
+                regressions.append((size, stage, seconds, reference))
+
+    return regressions
+
+
+def print_results(results, baseline=None):
+    """ Print a table of stage times, and ratios to the baseline if given """
+    table = Table(title='Client-side stage times (ms)')
+    table.add_column('stage')
+    for size in results:
+        table.add_column(f'n={size}', justify='right')
+
+    stages = next(iter(results.values())).keys()
+    for stage in stages:
+        row = [stage]
+        for size, times in results.items():
+            cell = f'{times[stage] * 1000:.2f}'
+            reference = (baseline or {}).get(size, {}).get(stage)
+            if reference:
+                cell += f' ({times[stage] / reference:.2f}x)'
+            row.append(cell)
+        table.add_row(*row)
+
+    Console().print(table)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=DESCRIPTION,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[100, 500, 1000, 5000],
+                        help='Population sizes to benchmark')
+    parser.add_argument('--repeats', type=int, default=3,
+                        help='Times to run each stage; the fastest counts')
+    parser.add_argument('--save', help='Save the results to this JSON file')
+    parser.add_argument('--baseline', nargs='?', const=str(BASELINE_FILE),
+                        help='Compare against this JSON file of results, by '
+                             'default the one in benchmarks/')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='How much slower than the baseline, as a '
+                             'fraction, before it counts as a regression')
+    parser.add_argument('--no-dask', action='store_true',
+                        help='Skip the dask scatter/gather benchmark')
+    args = parser.parse_args()
+
+    client = None
+    if not args.no_dask:
+        from distributed import Client, LocalCluster
+        client = Client(LocalCluster(n_workers=2, processes=True,
+                                     threads_per_worker=1))
+
+    try:
+        results = {str(size): benchmark(size, args.repeats, client)
+                   for size in args.sizes}
+    finally:
+        if client is not None:
+            client.close()
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+
+    print_results(results, baseline)
+
+    if args.save is not None:
+        with open(args.save, 'w') as save_file:
+            json.dump(results, save_file, indent=2)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+
+        for size, stage, seconds, reference in regressions:
+            print(f'REGRESSION n={size} {stage}: {seconds * 1000:.2f} ms vs '
+                  f'{reference * 1000:.2f} ms baseline')
+
+        if regressions:
+            sys.exit(1)
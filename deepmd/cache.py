@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+    Persistent fitness cache for deepmd-tuner.py
+
+    DeepMDDecoder maps wide gene ranges onto a handful of categorical values,
+    and mutated clones are often nearly identical to their parents, so we
+    frequently end up training the same model more than once.  FitnessCache
+    stores fitnesses in an SQLite database keyed on the phenome, with the
+    real-valued hyperparameters quantized to a given number of significant
+    digits, the number of training steps, and a hash of the deepmd-kit input
+    template.
+
+    The database is just a file, so it survives across jobs, and can be
+    shared between concurrent runs by pointing them at the same file.  Each
+    fitness is stored with the absolute path of the directory with the
+    model it came from, so that hits from other jobs, runs, or islands can
+    still be archived and warm-started from.
+"""
+import hashlib
+import json
+import sqlite3
+from pathlib import Path
+from time import time
+
+import numpy as np
+
+
+class FitnessCache:
+    """ SQLite cache of fitnesses keyed on quantized phenomes """
+
+    SCHEMA = """CREATE TABLE IF NOT EXISTS fitness (
+                    key TEXT PRIMARY KEY,
+                    template_hash TEXT,
+                    phenome TEXT,
+                    numb_steps INTEGER,
+                    energy_fitness REAL,
+                    force_fitness REAL,
+                    uuid TEXT,
+                    time REAL,
+                    model_dir TEXT)"""
+
+    def __init__(self, path, template, significant_digits=3, timeout=600):
+        """
+        :param path: to the SQLite database file, which is created if it
+            doesn't exist
+        :param template: path to the deepmd-kit input JSON template, which is
+            hashed so that fitnesses for different templates aren't mixed up
+        :param significant_digits: to which real-valued hyperparameters are
+            rounded for the cache key
+        :param timeout: how long, in seconds, to wait on a database locked by
+            another process
+        """
+        self.path = str(path)
+        self.significant_digits = significant_digits
+        self.timeout = timeout
+
+        with open(template, 'rb') as template_file:
+            self.template_hash = hashlib.sha256(template_file.read()).hexdigest()
+
+        self.execute(FitnessCache.SCHEMA)
+
+        try:
+            # Databases from before model directories were stored
+            self.execute('ALTER TABLE fitness ADD COLUMN model_dir TEXT')
+        except sqlite3.OperationalError:
+            # It already has them
+            pass
+
+    def execute(self, sql, parameters=()):
+        """ Execute a single SQL statement in its own transaction
+
+        We connect for every statement rather than holding on to a connection
+        so that instances can be pickled and sent to dask workers, and so that
+        we don't hold locks that other runs sharing the database may need.
+
+        :returns: the first row of the result, if any
+        """
+        connection = sqlite3.connect(self.path, timeout=self.timeout)
+        try:
+            with connection:
+                return connection.execute(sql, parameters).fetchone()
+        finally:
+            connection.close()
+
+    def quantize(self, phenome):
+        """ :returns: dict of the phenome with real values rounded to
+            self.significant_digits significant digits """
+        quantized = {}
+
+        for name, value in phenome._asdict().items():
+            if isinstance(value, float):
+                value = float(f'{value:.{self.significant_digits - 1}e}')
+            quantized[name] = value
+
+        return quantized
+
+    def key(self, phenome, numb_steps):
+        """ :returns: the cache key for the given phenome and training steps,
+            as well as the quantized phenome as JSON """
+        quantized = json.dumps(self.quantize(phenome), sort_keys=True)
+        key = hashlib.sha256(f'{self.template_hash} {numb_steps} '
+                             f'{quantized}'.encode()).hexdigest()
+        return key, quantized
+
+    def get(self, phenome, numb_steps):
+        """ Look up the fitness of a phenome
+
+        :param phenome: to be looked up
+        :param numb_steps: the phenome would be trained for
+        :returns: (fitness, uuid of the individual that was actually trained,
+            absolute path of the directory with its model, or None if it
+            wasn't stored) or None if it's not in the cache
+        """
+        key, _ = self.key(phenome, numb_steps)
+
+        row = self.execute('SELECT energy_fitness, force_fitness, uuid, '
+                           'model_dir FROM fitness WHERE key = ?', (key,))
+
+        if row is None:
+            return None
+
+        return np.array(row[:2]), row[2], row[3]
+
+    def put(self, phenome, numb_steps, fitness, uuid, model_dir):
+        """ Add a fitness to the cache
+
+        If another process already added one for the same key, that one is
+        kept.
+
+        :param phenome: that was trained
+        :param numb_steps: for which it was trained
+        :param fitness: of the trained model
+        :param uuid: of the individual that was trained
+        :param model_dir: directory with the training output and model
+        """
+        key, quantized = self.key(phenome, numb_steps)
+
+        self.execute('INSERT OR IGNORE INTO fitness (key, template_hash, '
+                     'phenome, numb_steps, energy_fitness, force_fitness, '
+                     'uuid, time, model_dir) '
+                     'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                     (key, self.template_hash, quantized, int(numb_steps),
+                      float(fitness[0]), float(fitness[1]), str(uuid), time(),
+                      str(Path(model_dir).absolute())))
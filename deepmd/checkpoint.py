@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+    Checkpointing the EA state so that runs can be resumed
+
+    Runs are limited by the batch system walltime, and everything the EA
+    knows is in memory, so a killed job would otherwise lose the entire run.
+    We periodically pickle the EA state, including the RNG states, and the
+    `--resume` option of deepmd-tuner.py uses that to continue where the run
+    stopped.
+
+    Checkpoints are written atomically by writing to a temporary file and then
+    renaming it, so a job killed while checkpointing leaves the previous
+    checkpoint intact.  We use cloudpickle, as dask does, since phenomes are
+    instances of a namedtuple that plain pickle can't find by name.
+"""
+import itertools
+import os
+import pickle
+import random
+from pathlib import Path
+
+import cloudpickle
+import numpy as np
+
+from leap_ec.distrib.individual import DistributedIndividual
+
+
+def save_checkpoint(path, **state):
+    """ Atomically save the given EA state along with the RNG states
+
+    :param path: of the checkpoint file
+    :param state: anything picklable that's needed to resume the run
+    """
+    path = Path(path)
+    tmp_path = path.with_name(path.name + '.tmp')
+
+    # Peek at the next birth ID so that resumed runs don't reuse birth IDs
+    next_birth_id = next(DistributedIndividual.birth_id)
+    DistributedIndividual.birth_id = itertools.count(next_birth_id)
+
+    state.update(python_rng=random.getstate(),
+                 numpy_rng=np.random.get_state(),
+                 next_birth_id=next_birth_id)
+
+    with open(tmp_path, 'wb') as checkpoint_file:
+        cloudpickle.dump(state, checkpoint_file)
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
+
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path, problem=None):
+    """ Load a checkpoint, and restore the RNG states and birth IDs
+
+    :param path: of the checkpoint file
+    :param problem: if given, individuals in the checkpoint are re-bound to
+        this problem instead of the one they were pickled with so that any
+        configuration changes for the resumed run take effect
+    :returns: dict of the saved EA state
+    """
+    with open(path, 'rb') as checkpoint_file:
+        state = pickle.load(checkpoint_file)
+
+    random.setstate(state['python_rng'])
+    np.random.set_state(state['numpy_rng'])
+    DistributedIndividual.birth_id = itertools.count(state['next_birth_id'])
+
+    if problem is not None:
+        for individual in state['population']:
+            individual.problem = problem
+
+    return state
@@ -11,6 +11,15 @@ from leap_ec.decoder import Decoder
 class DeepMDDecoder(Decoder):
     """ se_e2_a decoder """
 
+    SCALE_BY_WORKER_VALUES = ["linear", "sqrt", "none"]
+
+    # remove gelu since that appears to cause problems
+    # ACTIV_FUNC_VALUES = ['relu', 'relu6', 'softplus', 'sigmoid',  'tanh', 'gelu', 'gelu_tf']
+    ACTIV_FUNC_VALUES = ['relu', 'relu6', 'softplus', 'sigmoid',  'tanh']
+
+    # How far below rcut a repaired rcut_smth is put
+    RCUT_SMTH_GAP = 0.1
+
     def __init__(self):
         super().__init__()
 
@@ -34,7 +43,7 @@ class DeepMDDecoder(Decoder):
     @classmethod
     def _map_to_scale_by_worker(cls, gene):
         """ map gene value to ["linear", "sqrt", "none"] """
-        values = ["linear", "sqrt", "none"]
+        values = cls.SCALE_BY_WORKER_VALUES
         i = floor(gene) % len(values) # use % to wrap values > 2 to valid index
         return values[i]
 
@@ -43,13 +52,52 @@ class DeepMDDecoder(Decoder):
         """ map gene value to [“relu”, “relu6”, “softplus”, “sigmoid”,
             “tanh”, “gelu”, “gelu_tf”]
         """
-        # remove gelu since that appears to cause problems
-        # values = ['relu', 'relu6', 'softplus', 'sigmoid',  'tanh', 'gelu', 'gelu_tf']
-        values = ['relu', 'relu6', 'softplus', 'sigmoid',  'tanh']
+        values = cls.ACTIV_FUNC_VALUES
         i = floor(gene) % len(values) # use % to wrap values > 2 to valid index
         return values[i]
 
 
+    @classmethod
+    def violations(cls, phenome):
+        """ Check the constraints between hyperparameters
+
+        :param phenome: decoded phenome
+        :returns: list of the constraints the phenome violates
+        """
+        violations = []
+
+        if phenome.start_lr <= phenome.stop_lr:
+            violations.append(f'start_lr {phenome.start_lr} <= stop_lr '
+                              f'{phenome.stop_lr}')
+        if phenome.rcut_smth >= phenome.rcut:
+            violations.append(f'rcut_smth {phenome.rcut_smth} >= rcut '
+                              f'{phenome.rcut}')
+
+        return violations
+
+    @classmethod
+    def repair(cls, genome):
+        """ Repair a genome in place so that its phenome satisfies the
+        constraints
+
+        Reversed learning rates are swapped, which keeps both within their
+        bounds, and rcut_smth is moved just below rcut.
+
+        :param genome: gene values for an individual
+        :returns: the same genome
+        """
+        bounds = PhenotypeBounds()
+
+        if genome[0] < genome[1]:
+            genome[0], genome[1] = genome[1], genome[0]
+        elif genome[0] == genome[1]:
+            genome[0] = min(2 * genome[0], bounds.start_lr[1])
+
+        if genome[2] >= genome[3]:
+            genome[2] = max(genome[3] - cls.RCUT_SMTH_GAP, bounds.rcut_smth[0])
+
+        return genome
+
     def decode(self, genome, *args, **kwargs):
         """ decode the given individual
 
@@ -4,14 +4,16 @@
     implemented with LEAP.
 """
 import argparse
+import copy
 import logging
 import os
 import sys
 import random
 import numpy as np
+from pathlib import Path
 from time import time
 
-from toolz import pipe
+from toolz import compose, pipe
 
 from omegaconf.errors import ConfigKeyError, MissingMandatoryValue, \
     ConfigAttributeError
@@ -46,19 +48,36 @@ import leap_ec.util as util
 
 
 from leap_ec.ops import context
-from leap_ec.real_rep.ops import mutate_gaussian
 from leap_ec.global_vars import context
-from leap_ec.distrib import synchronous
-from leap_ec.multiobjective.ops import rank_ordinal_sort, \
-    crowding_distance_calc
 
 from leap_ec.distrib import asynchronous
-from leap_ec.distrib.synchronous import eval_pool
 from leap_ec.distrib.logger import WorkerLoggerPlugin
 
 from representation import DeepMDRepresentation
 from problem import DeepMDProblem
-from reporting import log_pop, log_worker_location
+from archive import ParetoArchive
+from cache import FitnessCache
+from checkpoint import save_checkpoint, load_checkpoint
+from early_stopping import MedianStoppingRule
+from engines import create_engine
+from evaluation import create_evaluator, eval_pool, eval_population
+from fidelity import SuccessiveHalving, fidelity_rank_sort
+from gpu_slots import GPUSlots
+from islands import Migration
+from launchers import create_launcher
+from lcurve import LearningCurveStore
+from phases import PhaseTrace, stamp_submitted, submitted
+from reporting import log_pop, log_worker_location, POP_COLUMNS, \
+    INDIVIDUAL_COLUMNS
+from results_sink import CSVSink, SQLiteSink
+from retention import Retention
+from selection import rank_sort, crowding_distance
+from staging import DataStaging, template_systems
+from stragglers import StragglerPolicy, speculative_eval_pool
+from steady_state import steady_state_nsga_2
+from surrogate import Surrogate
+from validation import SmokeTest, repair
+from training_output import OutputStreaming
 
 
 DESCRIPTION = """
@@ -68,6 +87,21 @@ implemented with LEAP.
 
 CLIENT_NAME = __name__
 
+# Initial standard deviations for Gaussian mutation, one per gene
+INIT_STD = [0.001,  # start_lr
+            0.0001, # stop_lr
+            0.0625, # rcut
+            0.0625, # rcut smth
+            0.0625, # scale by worker
+            0.0625, # des activ func
+            0.0625, # fitting activ func
+            ]
+
+# .85 was an original annealing step size used by Hans-Paul Schwefel, though
+# this was in the context of the 1/5 success rule, which is the one_fifth
+# engine. Handbook of EC, B1.3:2
+STD_ANNEALING = .85
+
 
 def read_config_files(config_files):
     """  Read one or more YAML files containing configuration options.
@@ -115,9 +149,20 @@ def setup_dask_client(config):
 
         logger.info(f'Using {workers} dask workers')
 
+        # How many trainings each local worker runs at once
+        threads = 1
+        if 'evaluation' in config:
+            threads = int(config.evaluation.trainings_per_worker)
+
+        resources = None
+        if 'gpu_slots' in config and config.gpu_slots.enabled:
+            # Each local worker gets a GPU slot per training
+            resources = {GPUSlots.RESOURCE: threads}
+
         cluster = LocalCluster(n_workers=workers,
                                processes=True,
-                               threads_per_worker=1,
+                               threads_per_worker=threads,
+                               resources=resources,
                                silence_logs=logger.level)
         logger.info("Cluster: %s", cluster)
         client = Client(cluster,
@@ -161,119 +206,840 @@ def wait_for_workers(config):
         logger.info(f'Not waiting on any workers, so going right in!')
 
 
-def run_ea(config, representation, problem, max_generations, context, client):
+def create_optimizer_engine(config):
+    """ Create the engine that creates offspring and adapts their mutation
+    step sizes
+
+    :param config: run-time configuration parameters
+    :return: engine; the original annealed NSGA-II if not configured
+    """
+    if 'engine' not in config:
+        return create_engine('nsga2', DeepMDRepresentation.bounds, INIT_STD,
+                             annealing=STD_ANNEALING)
+
+    engine_type = config.engine.type
+    kwargs = {}
+
+    if engine_type == 'nsga2':
+        kwargs = dict(annealing=STD_ANNEALING)
+    elif engine_type == 'one_fifth':
+        kwargs = dict(success_target=float(config.engine.success_target),
+                      damping=float(config.engine.damping))
+
+    logger.info(f'Using the {engine_type} optimizer engine')
+
+    return create_engine(engine_type, DeepMDRepresentation.bounds, INIT_STD,
+                         **kwargs)
+
+
+def create_stopping_rule(config):
+    """ Create the early stopping rule for trainings, if enabled
+
+    :param config: run-time configuration parameters
+    :return: MedianStoppingRule or None if early stopping is disabled
+    """
+    if 'early_stopping' not in config or not config.early_stopping.enabled:
+        return None
+
+    es_config = config.early_stopping
+
+    logger.info(f'Early stopping trainings after {es_config.grace_steps} '
+                f'steps')
+
+    return MedianStoppingRule(
+        Path(config.run_dir) / es_config.thresholds_file,
+        grace_steps=int(es_config.grace_steps),
+        min_curves=int(es_config.min_curves),
+        quantile=float(es_config.quantile),
+        step_resolution=int(es_config.step_resolution),
+        poll_interval=int(es_config.poll_interval))
+
+
+def create_straggler_policy(config):
+    """ Create the policy for killing straggling trainings, if enabled
+
+    :param config: run-time configuration parameters
+    :return: StragglerPolicy or None if trainings only have the fixed timeout
+    """
+    if 'stragglers' not in config or not config.stragglers.enabled:
+        return None
+
+    st_config = config.stragglers
+
+    logger.info(f'Killing trainings that take over {st_config.slack}x the '
+                f'{st_config.quantile} quantile of completed trainings')
+
+    return StragglerPolicy(
+        Path(config.run_dir) / st_config.deadlines_file,
+        timeout=int(config.ea.training_timeout) * 60,
+        min_samples=int(st_config.min_samples),
+        quantile=float(st_config.quantile),
+        slack=float(st_config.slack),
+        stall_timeout=int(st_config.stall_timeout) * 60,
+        poll_interval=int(st_config.poll_interval),
+        kill_grace=int(st_config.kill_grace),
+        speculate=bool(st_config.speculate),
+        speculate_fraction=float(st_config.speculate_fraction))
+
+
+def create_fitness_cache(config):
+    """ Create the persistent fitness cache, if enabled
+
+    :param config: run-time configuration parameters
+    :return: FitnessCache or None if the cache is disabled
+    """
+    if 'fitness_cache' not in config or not config.fitness_cache.enabled:
+        return None
+
+    logger.info(f'Using fitness cache {config.fitness_cache.path}')
+
+    return FitnessCache(
+        config.fitness_cache.path,
+        config.input_template,
+        significant_digits=int(config.fitness_cache.significant_digits),
+        timeout=int(config.fitness_cache.timeout))
+
+
+def create_gpu_slots(config):
+    """ Create the GPU slots for packing trainings onto nodes, if enabled
+
+    :param config: run-time configuration parameters
+    :return: GPUSlots or None if every training gets whole nodes via jsrun
+    """
+    if 'gpu_slots' not in config or not config.gpu_slots.enabled:
+        return None
+
+    logger.info(f'Packing {config.gpu_slots.trainings_per_gpu} trainings per '
+                f'GPU onto {config.gpu_slots.gpus_per_node} GPUs per node')
+
+    return GPUSlots(gpus_per_node=int(config.gpu_slots.gpus_per_node),
+                    trainings_per_gpu=int(config.gpu_slots.trainings_per_gpu),
+                    lock_dir=config.gpu_slots.lock_dir,
+                    bind_map=config.gpu_slots.bind_map)
+
+
+def create_trainer_launcher(config):
+    """ Create the launcher for trainings
+
+    :param config: run-time configuration parameters
+    :return: Launcher; jsrun if not configured
+    """
+    if 'launcher' not in config:
+        return create_launcher('jsrun')
+
+    launcher_type = config.launcher.type
+    kwargs = {}
+
+    if launcher_type in ('srun', 'mpirun'):
+        kwargs = dict(ntasks=int(config.launcher.ntasks),
+                      extra_args=list(config.launcher.extra_args))
+    elif launcher_type == 'fake':
+        kwargs = dict(seconds_per_step=float(config.launcher.seconds_per_step))
+    elif launcher_type == 'warm':
+        kwargs = dict(trainer=config.launcher.warm.trainer,
+                      socket_dir=config.launcher.warm.socket_dir,
+                      idle_timeout=float(config.launcher.warm.idle_timeout),
+                      seconds_per_step=float(config.launcher.seconds_per_step))
+
+    if 'gpu_slots' in config and config.gpu_slots.enabled and \
+            launcher_type not in ('local', 'fake', 'warm'):
+        raise ValueError(f'GPU slots need a launcher that runs dp on the '
+                         f'worker\'s node, not {launcher_type}')
+
+    logger.info(f'Launching trainings with {launcher_type}')
+
+    return create_launcher(launcher_type, **kwargs)
+
+
+def create_data_staging(config):
+    """ Create the node-local staging of the systems, if enabled
+
+    :param config: run-time configuration parameters
+    :return: DataStaging or None if trainings read the systems in place
+    """
+    if 'data_staging' not in config or not config.data_staging.enabled:
+        return None
+
+    if 'launcher' not in config or \
+            config.launcher.type not in ('local', 'fake', 'warm'):
+        logger.warning('Trainings may not run on the workers\' nodes, so '
+                       'staging the systems there may not help')
+
+    systems = template_systems(config.input_template)
+    logger.info(f'Staging {len(systems)} systems to '
+                f'{config.data_staging.local_dir}')
+
+    return DataStaging(config.data_staging.local_dir, systems,
+                       cleanup=config.data_staging.cleanup)
+
+
+def create_output_streaming(config):
+    """ Set up streaming of training output to files, if enabled
+
+    :param config: run-time configuration parameters
+    :return: OutputStreaming or None if training output is kept in memory
+    """
+    if 'training_output' not in config or not config.training_output.stream:
+        return None
+
+    return OutputStreaming(
+        max_bytes=int(config.training_output.max_bytes),
+        backup_count=int(config.training_output.backup_count),
+        tail_lines=int(config.training_output.tail_lines))
+
+
+def create_learning_curve_store(config):
+    """ Create the run-wide store of learning curves, if enabled
+
+    :param config: run-time configuration parameters
+    :return: LearningCurveStore or None if learning curves are only kept in
+        the UUID directories
+    """
+    if 'learning_curve_store' not in config or \
+            not config.learning_curve_store.enabled:
+        return None
+
+    logger.info(f'Storing learning curves in '
+                f'{config.learning_curve_store.directory}')
+
+    return LearningCurveStore(config.learning_curve_store.directory)
+
+
+def create_pareto_archive(config, problem, resume):
+    """ Create the all-time Pareto archive, if enabled
+
+    :param config: run-time configuration parameters
+    :param problem: being solved
+    :param resume: True if we're resuming a run, in which case we carry on
+        with the saved archive
+    :return: ParetoArchive or None if there's no archive
+    """
+    if 'pareto_archive' not in config or not config.pareto_archive.enabled:
+        return None
+
+    logger.info(f'Archiving the Pareto front in {config.pareto_archive.file}')
+
+    return ParetoArchive(config.pareto_archive.file, problem, resume=resume)
+
+
+def warm_start_enabled(config):
+    """ :return: True if offspring are to be warm-started from their
+        parent's model """
+    if 'warm_start' not in config or not config.warm_start.enabled:
+        return False
+
+    logger.info(f'Warm-starting offspring whose cutoff radii are within '
+                f'{config.warm_start.tolerance} of their parent\'s')
+
+    return True
+
+
+def retention_fanout(config):
+    """ :return: how many hex digits of a hash of their UUIDs individuals'
+        training directories are fanned out by, if retention is enabled """
+    if 'retention' not in config or not config.retention.enabled:
+        return 0
+
+    return int(config.retention.fanout)
+
+
+def create_worker_evaluator(config):
+    """ Create the function for the workers to evaluate individuals with
+
+    :param config: run-time configuration parameters
+    :return: LEAP's evaluate(), or evaluation.evaluate_async() for the
+        asyncio evaluator
+    """
+    if 'evaluation' not in config:
+        return create_evaluator()
+
+    logger.info(f'Evaluating with the {config.evaluation.evaluator} '
+                f'evaluator')
+
+    return create_evaluator(config.evaluation.evaluator)
+
+
+def create_retention(config, problem, archive, resume):
+    """ Create the retention of training directories, if enabled
+
+    :param config: run-time configuration parameters
+    :param problem: being solved
+    :param archive: ParetoArchive whose members' directories are kept, or
+        None
+    :param resume: True if we're resuming a run, in which case we carry on
+        with the directories still to be compacted
+    :return: Retention or None if all the directories are kept
+    """
+    if 'retention' not in config or not config.retention.enabled:
+        return None
+
+    logger.info(f'Compacting training directories into '
+                f'{config.retention.directory}')
+
+    return Retention(config.retention.directory,
+                     config.retention.state_file, problem, archive,
+                     grace=int(config.retention.grace),
+                     keep_checkpoints=config.retention.keep_checkpoints,
+                     resume=resume)
+
+
+def create_migration(config, problem, island, shared_run_dir):
+    """ Create the migration between islands, if enabled
+
+    :param config: run-time configuration parameters
+    :param problem: being solved by this island
+    :param island: number of this island
+    :param shared_run_dir: run directory shared by all the islands
+    :return: Migration or None if this is the only population
+    """
+    if 'islands' not in config or not config.islands.enabled:
+        return None
+
+    logger.info(f'Running island {island} of {config.islands.count}, '
+                f'migrating every {config.islands.interval} generations on a '
+                f'{config.islands.topology} topology')
+
+    return Migration(Path(shared_run_dir) / config.islands.directory,
+                     island,
+                     int(config.islands.count),
+                     problem,
+                     topology=config.islands.topology,
+                     interval=int(config.islands.interval),
+                     migrants=int(config.islands.migrants))
+
+
+def create_phase_trace(config, resume):
+    """ Create the export of the phases of evaluations, if enabled
+
+    :param config: run-time configuration parameters
+    :param resume: True if we're resuming a run, in which case we append to
+        the existing trace and metrics
+    :return: PhaseTrace or None if phases aren't exported
+    """
+    if 'phase_timing' not in config or not config.phase_timing.enabled:
+        return None
+
+    logger.info(f'Tracing the phases of evaluations to '
+                f'{config.phase_timing.trace_file}')
+
+    return PhaseTrace(config.phase_timing.trace_file,
+                      config.phase_timing.metrics_file, resume=resume)
+
+
+def create_surrogate(config, problem, results):
+    """ Create the surrogate for prescreening offspring, if enabled
+
+    :param config: run-time configuration parameters
+    :param problem: being solved
+    :param results: sink to which evaluated individuals are written
+    :return: Surrogate or None if prescreening is disabled
+    """
+    if 'surrogate' not in config or not config.surrogate.enabled:
+        return None
+
+    logger.info(f'Prescreening {config.surrogate.oversampling}x oversampled '
+                f'offspring with a surrogate')
+
+    return Surrogate(results,
+                     problem.numb_steps,
+                     oversampling=int(config.surrogate.oversampling),
+                     min_training=int(config.surrogate.min_training),
+                     max_training=int(config.surrogate.max_training),
+                     kappa=float(config.surrogate.kappa))
+
+
+def create_smoke_test(config, client):
+    """ Create the smoke test of offspring before training, if enabled
+
+    :param config: run-time configuration parameters
+    :param client: dask client through which to run the smoke tests
+    :return: SmokeTest or None if offspring go straight to training
+    """
+    if 'smoke_test' not in config or not config.smoke_test.enabled:
+        return None
+
+    logger.info(f'Smoke testing offspring for {config.smoke_test.numb_steps} '
+                f'steps before training')
+
+    return SmokeTest(client,
+                     numb_steps=int(config.smoke_test.numb_steps),
+                     timeout=int(config.smoke_test.timeout))
+
+
+def validation(smoke_test, surrogate, size):
+    """ Pipeline operators for repairing and smoke testing offspring
+
+    :param smoke_test: SmokeTest, or None if we're not smoke testing
+    :param surrogate: Surrogate, or None if we're not prescreening, in which
+        case we smoke test the whole oversampled pool
+    :param size: number of offspring that should be evaluated
+    :return: list of pipeline operators to splice in after mutation
+    """
+    if smoke_test is None:
+        return [repair]
+
+    if surrogate is not None:
+        size *= surrogate.oversampling
+
+    return [repair, smoke_test.screen(size)]
+
+
+def prescreening(surrogate, size):
+    """ Pipeline operators for prescreening offspring with a surrogate
+
+    :param surrogate: Surrogate, or None if we're not prescreening
+    :param size: number of offspring that should be evaluated
+    :return: list of pipeline operators to splice in after mutation
+    """
+    if surrogate is None:
+        return []
+
+    return [ops.pool(size=surrogate.oversampling * size),
+            surrogate.prescreen(size)]
+
+
+def evaluated_probes(problem, evaluated_probe, archive=None,
+                     phase_trace=None, retention=None, surrogate=None):
+    """ All the probes for newly evaluated individuals
+
+    :param problem: being solved, which may need to record evaluated
+        individuals
+    :param evaluated_probe: for writing the evaluated individuals to CSV
+    :param archive: optional ParetoArchive to add them to
+    :param phase_trace: optional PhaseTrace to export their phases to
+    :param retention: optional Retention to record their directories
+    :param surrogate: optional Surrogate to add them to the training data of
+    :return: list of probes to be run in order
+    """
+    probes = [evaluated_probe]
+
+    if phase_trace is not None:
+        probes.append(phase_trace)
+
+    if archive is not None:
+        probes.append(archive)
+
+    if retention is not None:
+        probes.append(retention)
+
+    if surrogate is not None:
+        probes.append(surrogate)
+
+    if problem.stopping_rule is not None:
+        probes.append(problem.stopping_rule)
+
+    if problem.stragglers is not None:
+        probes.append(problem.stragglers)
+
+    return probes
+
+
+def open_probe_stream(file_name, resume):
+    """ Open a stream for a CSV probe
+
+    When resuming a run, we append to any existing CSV file rather than
+    overwriting it.
+
+    :param file_name: of the CSV file
+    :param resume: True if we're resuming a run
+    :return: the open stream, and whether a header should be written
+    """
+    if not resume:
+        return open(file_name, 'w'), True
+
+    header = not Path(file_name).exists() or Path(file_name).stat().st_size == 0
+
+    return open(file_name, 'a'), header
+
+
+def open_results_sink(config, table, csv_file, columns, resume):
+    """ Open the sink for a reporting probe
+
+    :param config: run-time configuration parameters
+    :param table: name of the SQLite table for the rows
+    :param csv_file: name of the CSV file for the rows
+    :param columns: of the rows
+    :param resume: True if we're resuming a run, in which case we append to
+        any existing rows
+    :return: ResultsSink
+    """
+    if 'results' not in config:
+        # Write every batch of rows straight away, like we used to
+        stream, header = open_probe_stream(csv_file, resume)
+        return CSVSink(stream, columns, header=header, flush_rows=1)
+
+    flush_policy = dict(flush_interval=float(config.results.flush_interval),
+                        flush_rows=int(config.results.flush_rows))
+
+    if config.results.backend == 'sqlite':
+        return SQLiteSink(config.results.database, table, columns,
+                          resume=resume, **flush_policy)
+    elif config.results.backend == 'csv':
+        stream, header = open_probe_stream(csv_file, resume)
+        return CSVSink(stream, columns, header=header, **flush_policy)
+
+    raise ValueError(f'Unknown results backend {config.results.backend}; '
+                     f'should be csv or sqlite')
+
+
+def save_ea_checkpoint(config, problem, context, population, results=(),
+                       **state):
+    """ Checkpoint the EA state, if checkpointing is enabled
+
+    :param config: run-time configuration parameters
+    :param problem: being solved, whose early stopping state is also saved
+    :param context: from which we save the mutation step sizes and LEAP state
+    :param population: current population
+    :param results: sinks to flush first, so that the results written so far
+        match the checkpoint
+    :param state: any additional EA state needed to resume
+    """
+    if 'checkpoint' not in config or not config.checkpoint.enabled:
+        return
+
+    for sink in results:
+        sink.flush()
+
+    stopping_curves = None
+    if problem.stopping_rule is not None:
+        stopping_curves = problem.stopping_rule.curves
+
+    straggler_runtimes = None
+    if problem.stragglers is not None:
+        straggler_runtimes = problem.stragglers.runtimes
+
+    save_checkpoint(config.checkpoint.file,
+                    mode=config.ea.get('mode', 'generational'),
+                    engine=config.get('engine', {}).get('type', 'nsga2'),
+                    population=population,
+                    std=context['std'],
+                    leap_context=copy.deepcopy(context['leap']),
+                    stopping_curves=stopping_curves,
+                    straggler_runtimes=straggler_runtimes,
+                    **state)
+
+    logger.debug(f'Saved checkpoint to {config.checkpoint.file}')
+
+
+def restore_ea_state(state, problem, context):
+    """ Restore the EA state saved by save_ea_checkpoint()
+
+    :param state: as loaded from the checkpoint
+    :param problem: being solved, whose early stopping state is restored
+    :param context: to which we restore the mutation step sizes and LEAP state
+    """
+    context['std'] = state['std']
+    context['leap'].update(state['leap_context'])
+
+    if problem.stopping_rule is not None and state['stopping_curves']:
+        problem.stopping_rule.curves = state['stopping_curves']
+        problem.stopping_rule.publish()
+
+    # Checkpoints from before straggler handling don't have runtimes
+    if problem.stragglers is not None and \
+            state.get('straggler_runtimes'):
+        problem.stragglers.runtimes = state['straggler_runtimes']
+        problem.stragglers.publish()
+
+
+def run_ea(config, representation, problem, engine, max_generations, context,
+           client, resume_state=None, migration=None):
     """ Run the EA to optimize and train a deepmd model
 
-        This uses NSGA-II to optimize for minimizing the energy and forces
-        for a given deepmd model.
+        This uses NSGA-II survival selection to optimize for minimizing the
+        energy and forces for a given deepmd model, with offspring created by
+        the given optimizer engine.
 
         :param config: the run-time configuration parameters
         :param representation: for each individual
         :param problem: for which we are trying to optimize
+        :param engine: optimizer engine from engines.py
         :param max_generations: how many generations to run to?
         :param context: global context object to get current generation
         :param client: to an active Dask client
+        :param resume_state: optional EA state loaded from a checkpoint from
+            which to resume the run
+        :param migration: optional Migration with other islands
         :returns: Last generation of solutions (deepmd networks)
     """
-    # Initialize a population of pop_size individuals of the same type as
-    # individual_cls
-    parents = representation.create_population(int(config.ea.pop_size),
-                                               problem=problem)
+    resume = resume_state is not None
+    evaluator = create_worker_evaluator(config)
 
-    logger.debug(f'Creating initial random population')
+    if not resume:
+        # Initialize a population of pop_size individuals of the same type as
+        # individual_cls
+        parents = representation.create_population(int(config.ea.pop_size),
+                                                   problem=problem)
 
-    # Set up a generation counter that records the current generation to
-    # context
-    generation_counter = util.inc_generation(context=context)
+        logger.debug(f'Creating initial random population')
 
-    logger.debug(f'About to evaluate initial random population')
+        # Set up a generation counter that records the current generation to
+        # context
+        generation_counter = util.inc_generation(context=context)
 
-    # Scatter the initial parents to dask workers for evaluation
-    parents = synchronous.eval_population(parents, client=client)
+        logger.debug(f'About to evaluate initial random population')
+
+        # Scatter the initial parents to dask workers for evaluation
+        parents = eval_population(submitted(parents), client, evaluator)
+
+        logger.debug(f'Finished evaluating initial random population')
+    else:
+        parents = resume_state['population']
+        generation_counter = util.inc_generation(
+            start_generation=resume_state['generation'], context=context)
 
-    logger.debug(f'Finished evaluating initial random population')
+        logger.info(f'Resuming from generation '
+                    f'{generation_counter.generation()}')
 
     # Reporting setup
     # For taking snapshots of the population
-    pop_probe_stream = open(config.ea.pop_csv_file, 'w')
+    pop_sink = open_results_sink(config, 'pop', config.ea.pop_csv_file,
+                                 POP_COLUMNS, resume)
     pop_probe = log_pop(job=config.job_id,
                         context=context,
-                        stream=pop_probe_stream)
+                        sink=pop_sink)
 
     # For taking snapshots of the offspring including initial population; i.e.,
     # *everyone* and not just the best
-    evaluated_probe_stream = open(config.ea.ind_csv_file, 'w')
+    evaluated_sink = open_results_sink(config, 'individuals',
+                                       config.ea.ind_csv_file,
+                                       INDIVIDUAL_COLUMNS, resume)
     evaluated_probe = log_worker_location(
         job=config.job_id,
-        stream=evaluated_probe_stream)
-
-    pop_probe(parents) # report on generation zero
-    evaluated_probe(parents)
-
-    context['std'] = np.array([0.001,  # start_lr
-                               0.0001, # stop_lr
-                               0.0625, # rcut
-                               0.0625, # rcut smth
-                               0.0625, # scale by worker
-                               0.0625, # des activ func
-                               0.0625, # fitting activ func
-                               ])
+        sink=evaluated_sink)
+
+    archive = create_pareto_archive(config, problem, resume)
+    retention = create_retention(config, problem, archive, resume)
+    surrogate = create_surrogate(config, problem, evaluated_sink)
+    probes = evaluated_probes(problem, evaluated_probe, archive,
+                              create_phase_trace(config, resume), retention,
+                              surrogate)
+
+    if not resume:
+        pop_probe(parents) # report on generation zero
+        pipe(parents, *probes)
+
+    successive_halving = None
+    if 'fidelity' in config and config.fidelity.enabled:
+        # Successive halving of offspring with increasing training steps,
+        # with the full training steps being the last rung.
+        budgets = list(config.fidelity.budgets) + [problem.numb_steps]
+        logger.info(f'Using successive halving with budgets {budgets}')
+
+        successive_halving = SuccessiveHalving(client, budgets,
+                                               eta=int(config.fidelity.eta),
+                                               evaluated_probes=probes,
+                                               evaluator=evaluator)
+
+    smoke_test = create_smoke_test(config, client)
+
+    if not resume:
+        context['std'] = np.array(INIT_STD)
+
+        # The initial population is the most expensive generation to lose
+        save_ea_checkpoint(config, problem, context, parents,
+                           results=(pop_sink, evaluated_sink),
+                           generation=generation_counter.generation())
+    else:
+        restore_ea_state(resume_state, problem, context)
 
     try:
         while generation_counter.generation() < max_generations:
-            # Force flushing on Summit to see files
-            pop_probe_stream.flush()
-            evaluated_probe_stream.flush()
-
             generation_counter()  # Increment to the next generation
 
+            if successive_halving is not None:
+                evaluation = [ops.pool(size=len(parents)),
+                              successive_halving]
+                # Rank individuals against those with the same training
+                # steps, but prefer those trained for more steps.
+                survival = [fidelity_rank_sort(parents=parents),
+                            ops.truncation_selection(
+                                size=len(parents),
+                                key=lambda x: (x.numb_steps or 0,
+                                               -x.rank,
+                                               x.distance))]
+            else:
+                if problem.stragglers is not None and \
+                        problem.stragglers.speculate:
+                    pool = speculative_eval_pool(
+                        client=client, size=len(parents),
+                        stragglers=problem.stragglers, evaluator=evaluator)
+                else:
+                    pool = eval_pool(client=client, size=len(parents),
+                                     evaluator=evaluator)
+                evaluation = [pool, *probes]
+                survival = [rank_sort(parents=parents),
+                            crowding_distance,
+                            ops.truncation_selection(size=len(parents),
+                                                     key=lambda x: (-x.rank,
+                                                                    x.distance))]
+
             offspring = pipe(parents,
                              # pipeline for user defined selection, cloning,
                              # mutation, and maybe crossover
-                             ops.random_selection,
-                             ops.clone,
-                             mutate_gaussian(
-                                 std=context['std'],
-                                 expected_num_mutations='isotropic', # zap all genes
-                                 hard_bounds=DeepMDRepresentation.bounds),
-                             eval_pool(client=client, size=len(parents)),
-                             evaluated_probe,
-                             rank_ordinal_sort(parents=parents),
-                             crowding_distance_calc,
-                             ops.truncation_selection(size=len(parents),
-                                                      key=lambda x: (-x.rank,
-                                                                     x.distance)),
-                             pop_probe
-                             )
-
-            parents = offspring  # Make offspring new parents for next generation
+                             *engine.variation(),
+                             *validation(smoke_test, surrogate, len(parents)),
+                             *prescreening(surrogate, len(parents)),
+                             stamp_submitted,
+                             *evaluation)
+
+            survivors = pipe(offspring, *survival)
+            engine.update(offspring, survivors)
+
+            if migration is not None:
+                survivors = migration(survivors,
+                                      generation_counter.generation())
+
+            pop_probe(survivors)
+
+            if retention is not None:
+                retention.compact(survivors)
+
+            parents = survivors  # Make offspring new parents for next generation
 
             print(f'Finished generation '
                         f'{generation_counter.generation()!s}')
             logger.info(f'Finished generation '
                         f'{generation_counter.generation()!s}')
 
+            engine.generation()
+
+            save_ea_checkpoint(config, problem, context, parents,
+                               results=(pop_sink, evaluated_sink),
+                               generation=generation_counter.generation())
 
-            # .85 was an original annealing step size used by Hans-Paul
-            # Schwefel, though this was in the context of the 1/5 success
-            # rule, which we've not implemented here. Handbook of EC, B1.3:2
-            context['std'] *= .85
-            logger.info(f"New stds: {context['std']}")
             sys.stdout.flush()
             sys.stderr.flush()
     finally:
-        # evaluated_probe_stream.close()
-        pop_probe_stream.close()
+        evaluated_sink.close()
+        pop_sink.close()
+
+        if retention is not None:
+            retention.close()
 
     return parents
 
 
+def run_steady_state_ea(config, representation, problem, engine, context,
+                        client, resume_state=None):
+    """ Run an asynchronous steady-state EA to optimize and train a deepmd
+        model
+
+        Unlike run_ea(), there is no generational barrier; each worker is
+        given a new offspring to evaluate as soon as it finishes with its
+        current one.  The engine still adapts the mutation step sizes, but
+        every pop_size births instead of every generation.
+
+        :param config: the run-time configuration parameters
+        :param representation: for each individual
+        :param problem: for which we are trying to optimize
+        :param engine: optimizer engine from engines.py
+        :param context: global context object to get current generation
+        :param client: to an active Dask client
+        :param resume_state: optional EA state loaded from a checkpoint from
+            which to resume the run
+        :returns: final population of solutions (deepmd networks)
+    """
+    resume = resume_state is not None
+    pop_size = int(config.ea.pop_size)
+
+    if 'max_births' in config.ea:
+        max_births = int(config.ea.max_births)
+    else:
+        # Same evaluation budget as the generational EA
+        max_births = int(config.ea.max_generations) * pop_size
+
+    logger.info(f'Running steady-state EA with a budget of {max_births} '
+                f'births')
+
+    pop_sink = open_results_sink(config, 'pop', config.ea.pop_csv_file,
+                                 POP_COLUMNS, resume)
+    pop_probe = log_pop(job=config.job_id,
+                        context=context,
+                        sink=pop_sink)
+
+    evaluated_sink = open_results_sink(config, 'individuals',
+                                       config.ea.ind_csv_file,
+                                       INDIVIDUAL_COLUMNS, resume)
+    evaluated_probe = log_worker_location(
+        job=config.job_id,
+        sink=evaluated_sink)
+
+    archive = create_pareto_archive(config, problem, resume)
+    retention = create_retention(config, problem, archive, resume)
+    surrogate = create_surrogate(config, problem, evaluated_sink)
+    probes = evaluated_probes(problem, evaluated_probe, archive,
+                              create_phase_trace(config, resume), retention,
+                              surrogate)
+
+    if not resume:
+        context['std'] = np.array(INIT_STD)
+    else:
+        restore_ea_state(resume_state, problem, context)
+        logger.info(f"Resuming after {resume_state['births']} births")
+
+    def checkpoint(pop, **state):
+        """ Checkpoint the steady-state EA """
+        save_ea_checkpoint(config, problem, context, pop,
+                           results=(pop_sink, evaluated_sink), **state)
+
+    checkpoint_interval = pop_size
+    if 'checkpoint' in config and 'interval' in config.checkpoint:
+        checkpoint_interval = int(config.checkpoint.interval)
+
+    def end_generation(generation):
+        """ Adapt the mutation step sizes every virtual generation """
+        logger.info(f'Finished virtual generation {generation!s}')
+        engine.generation()
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+    if retention is not None:
+        # Compact the training directories every virtual generation
+        pop_probe = compose(retention.compact, pop_probe)
+
+    offspring_pipeline = [*engine.variation(),
+                          *validation(create_smoke_test(config, client),
+                                      surrogate, 1),
+                          *prescreening(surrogate, 1),
+                          ops.pool(size=1)]
+
+    try:
+        pop = steady_state_nsga_2(client,
+                                  max_births=max_births,
+                                  init_pop_size=int(config.ea.init_pop_size),
+                                  pop_size=pop_size,
+                                  representation=representation,
+                                  problem=problem,
+                                  offspring_pipeline=offspring_pipeline,
+                                  evaluated_probe=lambda population: pipe(
+                                      population, *probes),
+                                  pop_probe=pop_probe,
+                                  insertion_callback=engine.update,
+                                  generation_callback=end_generation,
+                                  checkpoint_callback=checkpoint,
+                                  checkpoint_interval=checkpoint_interval,
+                                  resume_state=resume_state,
+                                  evaluator=create_worker_evaluator(config),
+                                  context=context)
+    finally:
+        evaluated_sink.close()
+        pop_sink.close()
+
+        if retention is not None:
+            retention.close()
+
+    return pop
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description=DESCRIPTION)
     parser.add_argument('config_files', nargs='+',
                         help='One or more YAML config files')
+    parser.add_argument('--resume', metavar='CHECKPOINT',
+                        help='Resume a run from the given checkpoint file')
+    parser.add_argument('--island', metavar='N', type=int,
+                        help='Which island this is, if islands are enabled')
 
     args = parser.parse_args()
 
@@ -289,9 +1055,23 @@ if __name__ == '__main__':
     if 'test' in config and config.test:
         test_mode = True
 
+    islands = 'islands' in config and config.islands.enabled
+    if islands != (args.island is not None):
+        raise ValueError('--island must be given if and only if islands are '
+                         'enabled')
+
+    shared_run_dir = config.run_dir
+    if islands:
+        # Everything in the run directory, including anything interpolated
+        # from it in the config, is per island.
+        config.run_dir = str(Path(shared_run_dir) / f'island_{args.island}')
+        Path(config.run_dir).mkdir(parents=True, exist_ok=True)
+
     if 'seed' in config.ea:
-        logger.info(f'Setting seed to {config.ea.seed}.')
-        random.seed(int(config.ea.seed))
+        # Islands with the same seed would start out identical
+        seed = int(config.ea.seed) + (args.island or 0)
+        logger.info(f'Setting seed to {seed}.')
+        random.seed(seed)
 
     # Ensure all output files and dask droppings are created in the run_dir by
     # setting our working directory there first thing.
@@ -300,22 +1080,96 @@ if __name__ == '__main__':
     client = setup_dask_client(config)
     client.register_worker_plugin(WorkerLoggerPlugin(verbose=True))
 
+    data_staging = create_data_staging(config)
+    if data_staging is not None:
+        client.register_worker_plugin(data_staging)
+
     # Wait for a certain number of dask workers to spin up before proceeding
     wait_for_workers(config)
 
     logger.info(f'Starting with {get_num_workers(client)} dask workers')
 
+    warm_start = warm_start_enabled(config)
+    warm_start_tolerance = float(config.warm_start.tolerance) \
+        if warm_start else None
+
+    problem = DeepMDProblem(config.run_dir,
+                            config.input_template,
+                            timeout=config.ea.training_timeout,
+                            verbose=config.verbose,
+                            test=test_mode,
+                            stopping_rule=create_stopping_rule(config),
+                            numb_steps=int(config.ea.numb_steps),
+                            fitness_cache=create_fitness_cache(config),
+                            warm_start=warm_start,
+                            warm_start_tolerance=warm_start_tolerance,
+                            gpu_slots=create_gpu_slots(config),
+                            output_streaming=create_output_streaming(config),
+                            launcher=create_trainer_launcher(config),
+                            learning_curve_store=create_learning_curve_store(
+                                config),
+                            data_staging=data_staging,
+                            stragglers=create_straggler_policy(config),
+                            fanout=retention_fanout(config))
+
     # Use NSGA-II to optimize deepmd models for minimizing energies and forces
-    final_pop = run_ea(config,
-                       DeepMDRepresentation(),
-                       DeepMDProblem(config.run_dir,
-                                     config.input_template,
-                                     timeout=config.ea.training_timeout,
-                                     verbose=config.verbose,
-                                     test=test_mode),
-                       config.ea.max_generations,
-                       context,
-                       client)
+    mode = config.ea.get('mode', 'generational')
+    logger.info(f'Using {mode} EA mode')
+
+    resume_state = None
+    if args.resume is not None:
+        logger.info(f'Resuming from checkpoint {args.resume}')
+        resume_state = load_checkpoint(args.resume, problem)
+
+        if resume_state['mode'] != mode:
+            raise ValueError(f"Cannot resume a {resume_state['mode']} run "
+                             f"in {mode} mode")
+
+    engine = create_optimizer_engine(config)
+
+    # Checkpoints from before engines were all nsga2
+    if resume_state is not None and \
+            resume_state.get('engine', 'nsga2') != engine.name:
+        raise ValueError(f"Cannot resume a "
+                         f"{resume_state.get('engine', 'nsga2')} run with "
+                         f"the {engine.name} engine")
+
+    # Trainings should only be scheduled on workers with a free GPU slot
+    annotations = {}
+    if problem.gpu_slots is not None:
+        annotations['resources'] = problem.gpu_slots.resources()
+
+    with dask.annotate(**annotations):
+        if mode == 'steady_state':
+            if 'fidelity' in config and config.fidelity.enabled:
+                raise ValueError('Successive halving is only supported by the '
+                                 'generational EA')
+
+            if islands:
+                raise ValueError('Islands are only supported by the '
+                                 'generational EA')
+
+            final_pop = run_steady_state_ea(config,
+                                            DeepMDRepresentation(),
+                                            problem,
+                                            engine,
+                                            context,
+                                            client,
+                                            resume_state=resume_state)
+        elif mode == 'generational':
+            final_pop = run_ea(config,
+                               DeepMDRepresentation(),
+                               problem,
+                               engine,
+                               config.ea.max_generations,
+                               context,
+                               client,
+                               resume_state=resume_state,
+                               migration=create_migration(config, problem,
+                                                          args.island,
+                                                          shared_run_dir))
+        else:
+            raise ValueError(f'Unknown EA mode: {mode}')
 
     logger.info(f'Finished with {get_num_workers(client)} dask workers')
 
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+    Early termination of hopeless deepmd-kit trainings
+
+    Most trainings of bad hyperparameter configurations are obviously bad
+    long before they finish.  While `dp` runs, DeepMDProblem can tail its
+    lcurve.out and compare the partial learning curve against the curves of
+    already evaluated individuals at the same training step; if it's clearly
+    dominated, the training is killed.
+
+    The client records the learning curves of evaluated individuals and
+    publishes per-step thresholds to a small JSON file in the run directory,
+    which the workers read at the start of each evaluation.  This way the
+    workers don't need to walk the UUID directories of other individuals, and
+    the thresholds stay current even though each individual carries its own
+    copy of the problem.
+"""
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+
+class MedianStoppingRule:
+    """ Stop a training if its partial learning curve is dominated by that of
+    a typical already completed training
+
+    At a given step, a training is stopped if both its best energy and best
+    force validation RMSEs so far are worse than the `quantile` of the best
+    RMSEs so far of the completed trainings at the same step.  With the
+    default quantile of 0.5 this is the median stopping rule from:
+
+    - Golovin, Daniel, et al. "Google Vizier: A service for black-box
+      optimization." Proceedings of the 23rd ACM SIGKDD international
+      conference on knowledge discovery and data mining. 2017.
+
+    generalized to two objectives by requiring Pareto dominance.
+
+    Since the learning rate schedule depends on the total number of training
+    steps, trainings are only compared against those with the same number
+    of steps.
+
+    Instances act as a pipeline probe on the client to record the learning
+    curves of evaluated individuals, and are checked by DeepMDProblem on the
+    workers.
+    """
+
+    def __init__(self, thresholds_file, grace_steps=5000, min_curves=5,
+                 quantile=0.5, step_resolution=1000, poll_interval=60):
+        """
+        :param thresholds_file: where the client publishes the thresholds for
+            the workers; should be on a filesystem shared by both
+        :param grace_steps: never stop a training before this many steps
+        :param min_curves: minimum number of completed learning curves needed
+            at a step before we compare against that step
+        :param quantile: of the completed curves a training has to beat in
+            at least one objective
+        :param step_resolution: only compare at multiples of this many steps
+        :param poll_interval: how often, in seconds, to check lcurve.out
+        """
+        self.thresholds_file = Path(thresholds_file)
+        self.grace_steps = grace_steps
+        self.min_curves = min_curves
+        self.quantile = quantile
+        self.step_resolution = step_resolution
+        self.poll_interval = poll_interval
+
+        # Only kept on the client; (numb_steps, step) -> list of (best e,
+        # best f)
+        self.curves = {}
+
+    def __getstate__(self):
+        # Workers only need the published thresholds, so don't ship all the
+        # recorded curves with every individual.
+        state = self.__dict__.copy()
+        state['curves'] = {}
+        return state
+
+    def record(self, individual):
+        """ Record the learning curve of a fully trained individual
+
+        :param individual: evaluated individual
+        """
+        curve = getattr(individual, 'learning_curve', None)
+
+        if curve is None or getattr(individual, 'stop_reason', None) or \
+                getattr(individual, 'init_model', None):
+            # Early stopped curves are biased towards bad trainings, and
+            # warm-started ones towards good trainings, so we only compare
+            # against complete trainings from scratch.
+            return
+
+        best_e = np.minimum.accumulate(curve[:, 1])
+        best_f = np.minimum.accumulate(curve[:, 2])
+
+        for step, e, f in zip(curve[:, 0], best_e, best_f):
+            if step > 0 and step % self.step_resolution == 0:
+                self.curves.setdefault((int(individual.numb_steps), int(step)),
+                                       []).append((e, f))
+
+    def thresholds(self):
+        """ :returns: dict of numb_steps -> dict of step -> (energy
+            threshold, force threshold) for those steps with enough recorded
+            curves """
+        thresholds = {}
+
+        for (numb_steps, step), values in self.curves.items():
+            if len(values) >= self.min_curves:
+                thresholds.setdefault(numb_steps, {})[step] = \
+                    tuple(np.quantile(np.array(values), self.quantile, axis=0))
+
+        return thresholds
+
+    def publish(self):
+        """ Atomically write the current thresholds for the workers """
+        tmp_file = self.thresholds_file.with_suffix('.tmp')
+
+        with open(tmp_file, 'w') as out:
+            json.dump({str(numb_steps): {str(step): threshold
+                                         for step, threshold in steps.items()}
+                       for numb_steps, steps in self.thresholds().items()},
+                      out)
+
+        os.replace(tmp_file, self.thresholds_file)
+
+    def __call__(self, population):
+        """ Pipeline probe for recording newly evaluated individuals
+
+        :param population: newly evaluated individuals
+        :returns: the same population
+        """
+        for individual in population:
+            self.record(individual)
+
+        self.publish()
+
+        return population
+
+    def load(self, numb_steps):
+        """ Read the thresholds published by the client
+
+        :param numb_steps: total number of steps of the training to be checked
+        :returns: dict of step -> (energy threshold, force threshold)
+        """
+        if not self.thresholds_file.exists():
+            return {}
+
+        with open(self.thresholds_file, 'r') as thresholds_file:
+            thresholds = json.load(thresholds_file)
+
+        return {int(step): tuple(threshold)
+                for step, threshold
+                in thresholds.get(str(int(numb_steps)), {}).items()}
+
+    def check(self, tail, thresholds):
+        """ Should the training being tailed be stopped?
+
+        :param tail: LCurveTail for the training's lcurve.out
+        :param thresholds: as returned by load()
+        :returns: the reason for stopping, or None if it should continue
+        """
+        best = tail.best()
+
+        if best is None:
+            return None
+
+        step, best_e, best_f = best
+
+        if step < self.grace_steps:
+            return None
+
+        # Compare against the latest step for which we have thresholds
+        steps = [s for s in thresholds if s <= step]
+
+        if not steps:
+            return None
+
+        ref_step = max(steps)
+        threshold_e, threshold_f = thresholds[ref_step]
+
+        if best_e > threshold_e and best_f > threshold_f:
+            return f'stopped at step {int(step)}: best rmse_e_val ' \
+                   f'{best_e:g} > {threshold_e:g} and best rmse_f_val ' \
+                   f'{best_f:g} > {threshold_f:g}, the {self.quantile:g} ' \
+                   f'quantile of completed trainings at step {ref_step}'
+
+        return None
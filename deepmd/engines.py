@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+"""
+    Optimizer engines: how offspring are created, and how their mutation step
+    sizes adapt
+
+    Mutation used to be Gaussian with a hand-tuned vector of standard
+    deviations that was multiplied by STD_ANNEALING every generation, however
+    well or badly the search was going.  An engine pairs the operators that
+    create offspring with a rule for adapting the step sizes from how the
+    offspring fared in survival selection, which is NSGA-II's for all of them:
+
+    - nsga2 -- the original annealed step sizes, shared by all offspring
+    - one_fifth -- Rechenberg's 1/5 success rule on the shared step sizes,
+      where an offspring is a success if it survives selection
+    - self_adaptive -- each individual carries its own per-gene step sizes,
+      which are mutated log-normally before its genome is, as in Schwefel's
+      self-adaptive evolution strategies
+    - mo_cma_es -- each individual carries a step size and a covariance
+      matrix, adapted from its own and its offspring's successes as in the
+      MO-CMA-ES:
+
+      C. Igel, N. Hansen and S. Roth, "Covariance Matrix Adaptation for
+      Multi-objective Optimization," in Evolutionary Computation, vol. 15,
+      no. 1, pp. 1-28, 2007, doi: 10.1162/evco.2007.15.1.1.
+
+      As survival is by crowding distance rather than contributing
+      hypervolume, this is that paper's c-MO-CMA-ES variant.
+
+    Per-individual strategy parameters are kept in DeepMDIndividual.strategy,
+    which clones inherit and checkpoints save along with the population.
+
+    Engines are compared by the hypervolume of the Pareto front of their full
+    trainings per GPU-hour spent on all trainings; running this module on the
+    results of several runs prints that comparison.  Hypervolumes are of the
+    log10 errors, bounded by a reference point just beyond the worst errors
+    on any of the fronts, so they're comparable across the runs given.
+
+    usage: engines.py [--gpus-per-training N] results [results ...]
+
+    where each results is an individuals CSV file or a results SQLite
+    database.
+"""
+import argparse
+import csv
+import logging
+import sqlite3
+import sys
+from pathlib import Path
+
+import numpy as np
+
+from leap_ec import ops
+from leap_ec.global_vars import context
+from leap_ec.real_rep.ops import mutate_gaussian
+
+logger = logging.getLogger(__name__)
+
+
+class NSGA2Engine:
+    """ Gaussian mutation with step sizes annealed every generation """
+
+    name = 'nsga2'
+
+    def __init__(self, bounds, init_std, annealing=0.85, context=context):
+        """
+        :param bounds: (low, high) of each gene
+        :param init_std: initial mutation standard deviation of each gene
+        :param annealing: factor by which the step sizes are multiplied every
+            generation
+        :param context: whose `std` holds the shared step sizes, which are
+            checkpointed with it
+        """
+        self.bounds = np.array(bounds, dtype=float)
+        self.init_std = np.array(init_std, dtype=float)
+        self.annealing = annealing
+        self.context = context
+
+    def variation(self):
+        """ :returns: list of pipeline operators that create unevaluated
+            offspring from the parents """
+        return [ops.random_selection,
+                ops.clone,
+                mutate_gaussian(std=self.context['std'],
+                                expected_num_mutations='isotropic',
+                                hard_bounds=self.bounds)]
+
+    def update(self, offspring, population):
+        """ Adapt the step sizes to how the offspring fared
+
+        :param offspring: newly evaluated offspring
+        :param population: that survived selection from among the offspring
+            and their parents
+        """
+        pass
+
+    def generation(self):
+        """ Adapt the step sizes at the end of a (virtual) generation """
+        self.context['std'] *= self.annealing
+        logger.info(f"New stds: {self.context['std']}")
+
+
+class OneFifthEngine(NSGA2Engine):
+    """ Gaussian mutation with shared step sizes adapted by the 1/5 success
+    rule """
+
+    name = 'one_fifth'
+
+    def __init__(self, bounds, init_std, success_target=0.2, damping=1.0,
+                 context=context):
+        """
+        :param success_target: success rate of the offspring at which the
+            step sizes are left as they are
+        :param damping: larger values adapt the step sizes more slowly
+        """
+        super().__init__(bounds, init_std, context=context)
+        self.success_target = success_target
+        self.damping = damping
+
+        # Counted over the (virtual) generation
+        self.successes = 0
+        self.trials = 0
+
+    def update(self, offspring, population):
+        survivors = {individual.uuid for individual in population}
+
+        self.trials += len(offspring)
+        self.successes += sum(individual.is_viable and
+                              individual.uuid in survivors
+                              for individual in offspring)
+
+    def generation(self):
+        if self.trials == 0:
+            return
+
+        rate = self.successes / self.trials
+        self.context['std'] *= np.exp((rate - self.success_target) /
+                                      (self.damping *
+                                       (1 - self.success_target)))
+        self.successes = self.trials = 0
+
+        logger.info(f"Success rate {rate:.2f}; new stds: "
+                    f"{self.context['std']}")
+
+
+class SelfAdaptiveEngine(NSGA2Engine):
+    """ Gaussian mutation with self-adaptive per-gene step sizes """
+
+    name = 'self_adaptive'
+
+    def __init__(self, bounds, init_std, context=context):
+        super().__init__(bounds, init_std, context=context)
+        n = len(self.init_std)
+
+        # Schwefel's learning rates for the common and per-gene factors
+        self.tau_common = 1 / np.sqrt(2 * n)
+        self.tau = 1 / np.sqrt(2 * np.sqrt(n))
+
+        # Of the last surviving population, for logging
+        self.population = []
+
+    def variation(self):
+        low, high = self.bounds.T
+
+        @ops.iteriter_op
+        def mutate(next_individual):
+            for individual in next_individual:
+                std = individual.strategy
+                if std is None:
+                    std = self.init_std
+
+                n = len(std)
+                std = std * np.exp(self.tau_common * np.random.normal() +
+                                   self.tau * np.random.normal(size=n))
+                # Steps wider than the bounds would only ever be clipped
+                std = np.minimum(std, high - low)
+
+                individual.strategy = std
+                individual.genome = np.clip(
+                    individual.genome + std * np.random.normal(size=n),
+                    low, high)
+
+                yield individual
+
+        return [ops.random_selection, ops.clone, mutate]
+
+    def update(self, offspring, population):
+        self.population = population
+
+    def generation(self):
+        strategies = [individual.strategy for individual in self.population
+                      if individual.strategy is not None]
+
+        if strategies:
+            logger.info(f'Median stds: {np.median(strategies, axis=0)}')
+
+
+class MOCMAESEngine(NSGA2Engine):
+    """ Mutation with per-individual covariance matrices adapted as in the
+    MO-CMA-ES
+
+    Each individual's strategy is a dict of its step size `sigma`, covariance
+    matrix `C`, evolution path `pc`, and smoothed success rate `psucc`, along
+    with the `parent_uuid`, `parent_genome`, and `parent_sigma` it was created
+    from, if it's an offspring.  The covariance matrices start out as the
+    squares of the initial step sizes, which are on the scale of each gene.
+    """
+
+    name = 'mo_cma_es'
+
+    def __init__(self, bounds, init_std, context=context):
+        super().__init__(bounds, init_std, context=context)
+        n = len(self.init_std)
+
+        # The default strategy parameters from Igel et al.
+        self.d = 1 + n / 2
+        self.p_target = 1 / (5 + 1 / 2)
+        self.c_p = self.p_target / (2 + self.p_target)
+        self.c_c = 2 / (n + 2)
+        self.c_cov = 2 / (n ** 2 + 6)
+        self.p_thresh = 0.44
+
+        self.population = []
+
+    def initial_strategy(self):
+        """ :returns: the strategy of an individual without one """
+        return dict(sigma=1.0,
+                    C=np.diag(self.init_std ** 2),
+                    pc=np.zeros(len(self.init_std)),
+                    psucc=self.p_target)
+
+    def variation(self):
+        low, high = self.bounds.T
+
+        @ops.iteriter_op
+        def reproduce(next_parent):
+            for parent in next_parent:
+                if parent.strategy is None:
+                    parent.strategy = self.initial_strategy()
+
+                child = parent.clone()
+                strategy = child.strategy
+                step = np.linalg.cholesky(strategy['C']) @ \
+                    np.random.normal(size=len(parent.genome))
+
+                child.genome = np.clip(parent.genome +
+                                       strategy['sigma'] * step, low, high)
+                strategy.update(parent_uuid=parent.uuid,
+                                parent_genome=np.array(parent.genome),
+                                parent_sigma=strategy['sigma'])
+
+                yield child
+
+        return [ops.random_selection, reproduce]
+
+    def update_step_size(self, strategy, success):
+        """ Update a strategy's step size given whether an offspring
+        survived """
+        strategy['psucc'] = (1 - self.c_p) * strategy['psucc'] + \
+            self.c_p * success
+        strategy['sigma'] *= np.exp((strategy['psucc'] - self.p_target) /
+                                    (self.d * (1 - self.p_target)))
+
+    def update_covariance(self, strategy, step):
+        """ Update an offspring's covariance matrix given the step from its
+        parent, in units of the parent's step size """
+        c_c, c_cov = self.c_c, self.c_cov
+
+        if strategy['psucc'] < self.p_thresh:
+            strategy['pc'] = (1 - c_c) * strategy['pc'] + \
+                np.sqrt(c_c * (2 - c_c)) * step
+            strategy['C'] = (1 - c_cov) * strategy['C'] + \
+                c_cov * np.outer(strategy['pc'], strategy['pc'])
+        else:
+            strategy['pc'] = (1 - c_c) * strategy['pc']
+            strategy['C'] = (1 - c_cov) * strategy['C'] + \
+                c_cov * (np.outer(strategy['pc'], strategy['pc']) +
+                         c_c * (2 - c_c) * strategy['C'])
+
+    def update(self, offspring, population):
+        survivors = {individual.uuid: individual for individual in population}
+
+        for child in offspring:
+            strategy = child.strategy
+            if strategy is None or 'parent_uuid' not in strategy:
+                continue
+
+            success = child.is_viable and child.uuid in survivors
+
+            # Repair may have moved the offspring, so the step is taken from
+            # where it actually ended up.
+            self.update_step_size(strategy, success)
+            self.update_covariance(strategy,
+                                   (np.asarray(child.genome) -
+                                    strategy['parent_genome']) /
+                                   strategy['parent_sigma'])
+
+            # Parents that didn't survive have no use for an update
+            parent = survivors.get(strategy['parent_uuid'])
+            if parent is not None and parent.strategy is not None:
+                self.update_step_size(parent.strategy, success)
+
+        self.population = population
+
+    def generation(self):
+        sigmas = [individual.strategy['sigma']
+                  for individual in self.population
+                  if individual.strategy is not None]
+
+        if sigmas:
+            logger.info(f'Median sigma: {np.median(sigmas):.4g}')
+
+
+ENGINES = {engine.name: engine for engine in (NSGA2Engine, OneFifthEngine,
+                                              SelfAdaptiveEngine,
+                                              MOCMAESEngine)}
+
+
+def create_engine(name, bounds, init_std, **kwargs):
+    """ Create an optimizer engine by name
+
+    :param name: one of ENGINES
+    :param bounds: (low, high) of each gene
+    :param init_std: initial mutation standard deviation of each gene
+    :param kwargs: any options specific to the engine
+    :returns: the engine
+    """
+    if name not in ENGINES:
+        raise ValueError(f'Unknown optimizer engine {name}; should be one of '
+                         f'{", ".join(ENGINES)}')
+
+    return ENGINES[name](bounds, init_std, **kwargs)
+
+
+def read_results(path):
+    """ :returns: list of the rows of evaluated individuals, as dicts, from
+        an individuals CSV file or results SQLite database """
+    if Path(path).suffix == '.csv':
+        with open(path, 'r', newline='') as csv_file:
+            return list(csv.DictReader(csv_file))
+
+    connection = sqlite3.connect(path)
+    connection.row_factory = sqlite3.Row
+    try:
+        return [dict(row) for row in
+                connection.execute('SELECT * FROM individuals ORDER BY rowid')]
+    finally:
+        connection.close()
+
+
+def run_summary(rows, gpus_per_training=1):
+    """ Summarize a run for comparing engines
+
+    :param rows: of the run's evaluated individuals
+    :param gpus_per_training: GPUs used by each training
+    :returns: the GPU-hours spent on all trainings, and the log10 errors of
+        the viable full trainings
+    """
+    gpu_hours = 0.0
+    points, full_steps = [], 0
+
+    for row in rows:
+        try:
+            gpu_hours += (float(row['stop_eval_time']) -
+                          float(row['start_eval_time'])) * \
+                gpus_per_training / 3600
+            fitness = (float(row['energy_fitness']),
+                       float(row['force_fitness']))
+            numb_steps = int(row['numb_steps'])
+        except (KeyError, TypeError, ValueError):
+            continue
+
+        if str(row.get('is_viable')) not in ('True', '1') or \
+                row.get('stop_reason') or \
+                not np.all(np.isfinite(fitness)) or min(fitness) <= 0:
+            continue
+
+        full_steps = max(full_steps, numb_steps)
+        points.append((numb_steps, *np.log10(fitness)))
+
+    points = np.array([point[1:] for point in points
+                       if point[0] == full_steps]).reshape(-1, 2)
+
+    return gpu_hours, points
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Compare optimizer engines by hypervolume per GPU-hour')
+    parser.add_argument('results', nargs='+',
+                        help='Individuals CSV files or results databases')
+    parser.add_argument('--gpus-per-training', type=float, default=1,
+                        help='GPUs used by each training')
+    args = parser.parse_args()
+
+    from rich.console import Console
+    from rich.table import Table
+
+    from surrogate import hypervolume_2d, non_dominated
+
+    summaries = [run_summary(read_results(path), args.gpus_per_training)
+                 for path in args.results]
+    fronts = [non_dominated(points) for _, points in summaries
+              if len(points)]
+
+    if not fronts:
+        sys.exit('No viable full trainings in the results')
+
+    everything = np.vstack(fronts)
+    nadir, ideal = everything.max(axis=0), everything.min(axis=0)
+    reference = nadir + 0.1 * np.maximum(nadir - ideal, 1e-3)
+
+    table = Table(title='Hypervolume of log10 errors per GPU-hour')
+    for column in ('results', 'full trainings', 'GPU-hours', 'hypervolume',
+                   'per GPU-hour'):
+        table.add_column(column)
+
+    for path, (gpu_hours, points) in zip(args.results, summaries):
+        volume = hypervolume_2d(points, reference) if len(points) else 0.0
+        table.add_row(path, str(len(points)), f'{gpu_hours:.2f}',
+                      f'{volume:.4g}',
+                      f'{volume / gpu_hours:.4g}' if gpu_hours else '-')
+
+    Console().print(table)
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+    How the dask workers evaluate individuals
+
+    DeepMDProblem.evaluate() used to change the working directory of the
+    worker process, so workers had to be started with `--nthreads 1` and ran
+    one training at a time.  Now that it doesn't, a worker runs as many
+    evaluations at once as it has threads, or `trainings_per_worker` for
+    local workers, with either evaluator:
+
+    - threads -- LEAP's evaluate(), which runs each evaluation in one of the
+      worker's threads, blocked on its `dp` subprocess
+    - asyncio -- evaluate_async(), which runs each evaluation as a coroutine
+      on the worker's event loop; writing input.json and reading the results
+      are handed to threads, but the trainings themselves are waited on
+      with asyncio, so one worker can drive many of them while overlapping
+      their staging, launching and result parsing
+
+    Either way, dask only gives a worker as many evaluations as it has
+    threads.  Each evaluation claims the lowest free slot of its worker
+    process and records it in the individual's `slot`, so that reports can
+    tell apart the evaluations a worker process runs at once.  The functions
+    here stand in for LEAP's eval_population() and eval_pool(), which always
+    use LEAP's evaluate().
+"""
+import os
+import platform
+import threading
+import time
+from contextlib import contextmanager
+from functools import partial
+
+import distributed
+from toolz import curry
+
+from leap_ec import ops
+from leap_ec.global_vars import context
+from leap_ec.distrib.evaluate import evaluate
+
+EVALUATORS = ('threads', 'asyncio')
+
+# Evaluation slots of this worker process that are in use
+_slots_lock = threading.Lock()
+_busy_slots = set()
+
+
+@contextmanager
+def evaluation_slot():
+    """ Claim the lowest free evaluation slot of this worker process for
+    the context
+
+    :returns: the slot number, from 0 to the number of evaluations running
+        at once - 1
+    """
+    with _slots_lock:
+        slot = min(set(range(len(_busy_slots) + 1)) - _busy_slots)
+        _busy_slots.add(slot)
+
+    try:
+        yield slot
+    finally:
+        with _slots_lock:
+            _busy_slots.discard(slot)
+
+
+def evaluate_threads(individual, context=context):
+    """ Evaluate an individual in one of the worker's threads with LEAP's
+    evaluate(), recording the evaluation slot it used
+
+    :param individual: to be evaluated
+    :param context: for storing count of non-viable individuals
+    :return: evaluated individual
+    """
+    with evaluation_slot() as slot:
+        individual = evaluate(individual, context=context)
+
+    individual.slot = slot
+
+    return individual
+
+
+async def evaluate_async(individual, context=context):
+    """ Evaluate an individual on the worker's event loop
+
+    This is leap_ec.distrib.evaluate.evaluate() for coroutines: it sets the
+    same start_eval_time, stop_eval_time, hostname and pid, and counts
+    non-viable individuals in the same way.
+
+    :param individual: to be evaluated
+    :param context: for storing count of non-viable individuals
+    :return: evaluated individual
+    """
+    worker = distributed.get_worker()
+
+    with evaluation_slot() as slot:
+        individual.start_eval_time = time.time()
+
+        await individual.evaluate_async()
+
+    individual.slot = slot
+
+    if not individual.is_viable:
+        context['leap']['distrib']['non_viable'] += 1
+
+        if hasattr(worker, 'logger'):
+            worker.logger.warning(f'Worker {worker.id}: '
+                                  f'{individual.exception!s} raised for '
+                                  f'{individual!s}')
+
+    individual.stop_eval_time = time.time()
+    individual.hostname = platform.node()
+    individual.pid = os.getpid()
+
+    if hasattr(worker, 'logger'):
+        worker.logger.debug(f'Worker {worker.id} evaluated {individual!s} in '
+                            f'{individual.stop_eval_time - individual.start_eval_time} '
+                            f'seconds')
+
+    return individual
+
+
+def create_evaluator(name='threads', context=context):
+    """ :returns: the function for the workers to evaluate individuals with,
+        one of EVALUATORS """
+    if name == 'threads':
+        return partial(evaluate_threads, context=context)
+    elif name == 'asyncio':
+        # dask recognizes partials of coroutine functions, but not curries
+        return partial(evaluate_async, context=context)
+
+    raise ValueError(f'Unknown evaluator {name}; should be one of '
+                     f'{", ".join(EVALUATORS)}')
+
+
+def eval_population(population, client, evaluator):
+    """ Concurrently evaluate all the individuals in the given population
+
+    :param population: to be evaluated
+    :param client: dask client
+    :param evaluator: from create_evaluator()
+    :return: evaluated population
+    """
+    return client.gather(client.map(evaluator, population, pure=False))
+
+
+def as_completed(population, client, evaluator):
+    """ Start evaluating the individuals in the given population
+
+    :param population: to be evaluated
+    :param client: dask client
+    :param evaluator: from create_evaluator()
+    :return: distributed.as_completed iterator of their futures, to which
+        more can be added
+    """
+    return distributed.as_completed(client.map(evaluator, population,
+                                               pure=False))
+
+
+@curry
+@ops.iterlist_op
+def eval_pool(next_individual, client, size, evaluator):
+    """ Concurrently evaluate `size` individuals
+
+    :param next_individual: iterator/generator for individual provider
+    :param client: dask client through which we submit individuals to be
+        evaluated
+    :param size: how many individuals to evaluate simultaneously
+    :param evaluator: from create_evaluator()
+    :return: the pool of evaluated individuals
+    """
+    return eval_population([next(next_individual) for _ in range(size)],
+                           client, evaluator)
+
+
+def total_threads(client):
+    """ :returns: how many evaluations the workers can run at once """
+    return sum(worker['nthreads']
+               for worker in client.scheduler_info()['workers'].values())
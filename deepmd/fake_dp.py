@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+    Fake `dp train` for testing deepmd-tuner.py without deepmd-kit or GPUs
+
+    Reads the input.json that DeepMDProblem wrote, and writes a lcurve.out
+    with the same columns that deepmd-kit does, at the same `disp_freq`, as
+    well as model checkpoints every `save_freq` steps and progress messages
+    on stdout.  The RMSEs follow an exponential learning curve towards a
+    floor that depends on the hyperparameters, with a trade-off between
+    energy and force errors, and the time per step grows with the cutoff
+    radius.  Very large learning rates with ReLU descriptors diverge to NaN
+    like real trainings sometimes do.
+
+    usage: fake_dp.py [--seconds-per-step S] train [--skip-neighbor-stat]
+                      [--init-model CHECKPOINT] input.json
+"""
+import argparse
+import json
+import sys
+from math import exp, log10
+from pathlib import Path
+from time import sleep
+
+import numpy as np
+
+# Penalties, in log10 RMSE, for activation functions and learning rate
+# scaling relative to the best ones
+ACTIV_FUNC_PENALTY = {'tanh': 0.0, 'softplus': 0.03, 'relu6': 0.05,
+                      'sigmoid': 0.08, 'relu': 0.1}
+SCALE_BY_WORKER_PENALTY = {'linear': 0.0, 'sqrt': 0.01, 'none': 0.02}
+
+# Steps over which the error decays by 1/e at a learning rate of 1e-3
+DECAY_STEPS = 5000
+
+
+def error_floors(params):
+    """ :returns: the log10 energy and force RMSEs the training converges to
+    """
+    descriptor = params['model']['descriptor']
+    fitting_net = params['model']['fitting_net']
+    learning_rate = params['learning_rate']
+
+    start_lr = log10(learning_rate['start_lr'])
+    stop_lr = log10(learning_rate['stop_lr'])
+    rcut = descriptor['rcut']
+    smoothing = descriptor['rcut_smth'] / rcut
+
+    common = 0.15 * (start_lr + 3) ** 2 + \
+             0.05 * (stop_lr + 6) ** 2 + \
+             0.5 * (smoothing - 0.5) ** 2 + \
+             ACTIV_FUNC_PENALTY.get(descriptor['activation_function'], 0.1) + \
+             ACTIV_FUNC_PENALTY.get(fitting_net['activation_function'], 0.1) + \
+             SCALE_BY_WORKER_PENALTY.get(learning_rate['scale_by_worker'], 0)
+
+    # Energies like longer cutoffs, forces shorter ones
+    energy = -2.5 + common + 0.03 * (rcut - 10) ** 2
+    force = -1.2 + common + 0.03 * (rcut - 8) ** 2
+
+    return energy, force
+
+
+def train(params, seconds_per_step, init_model=None):
+    """ Write lcurve.out and checkpoints as `dp train` would """
+    training = params['training']
+    learning_rate = params['learning_rate']
+    numb_steps = training['numb_steps']
+    disp_freq = training['disp_freq']
+    save_freq = training['save_freq']
+    start_lr = learning_rate['start_lr']
+    stop_lr = learning_rate['stop_lr']
+    rcut = params['model']['descriptor']['rcut']
+
+    rng = np.random.default_rng(training['seed'] % 2 ** 32)
+    energy_floor, force_floor = (10 ** (floor + rng.normal(scale=0.05))
+                                 for floor in error_floors(params))
+
+    # Warm-started trainings start much closer to their floor
+    excess = 2.0 if init_model is not None else 30.0
+    rate = min(max(start_lr / 1e-3, 0.05), 5.0)
+    diverges = start_lr > 8e-3 and \
+        params['model']['descriptor']['activation_function'] == 'relu'
+
+    step_time = seconds_per_step * (rcut / 9) ** 3
+
+    # What deepmd-kit says before training, which phases.py looks for
+    print('DEEPMD INFO    fake deepmd-kit', flush=True)
+    print('DEEPMD INFO    built lr', flush=True)
+    print(f'DEEPMD INFO    start training at lr {start_lr:.2e}', flush=True)
+
+    with open(training['disp_file'], 'w') as lcurve:
+        lcurve.write('#  step      rmse_val    rmse_trn    rmse_e_val  '
+                     'rmse_e_trn    rmse_f_val  rmse_f_trn         lr\n')
+
+        for step in range(0, numb_steps + 1, disp_freq):
+            if step > 0:
+                sleep(disp_freq * step_time)
+
+            decay = 1 + excess * exp(-rate * step / DECAY_STEPS)
+            lr = start_lr * (stop_lr / start_lr) ** \
+                (min(step // learning_rate['decay_steps'] *
+                     learning_rate['decay_steps'], numb_steps) / numb_steps)
+
+            if diverges and step >= 1000:
+                errors = [np.nan] * 6
+            else:
+                e_val, e_trn, f_val, f_trn = \
+                    rng.normal(1, 0.02, size=4) * \
+                    (energy_floor * decay, energy_floor * decay * 0.9,
+                     force_floor * decay, force_floor * decay * 0.9)
+                errors = [f_val * 1.1, f_trn * 1.1, e_val, e_trn,
+                          f_val, f_trn]
+
+            lcurve.write(f'{step:7d}' +
+                         ''.join(f'{error:12.2e}' for error in errors) +
+                         f'{lr:10.1e}\n')
+            lcurve.flush()
+
+            print(f'DEEPMD INFO    batch {step:7d} training time '
+                  f'{disp_freq * step_time:.2f} s, testing time 0.00 s',
+                  flush=True)
+
+            if step > 0 and (step % save_freq == 0 or step == numb_steps):
+                save_checkpoint(training['save_ckpt'], step)
+
+    print('DEEPMD INFO    finished training', flush=True)
+
+
+def save_checkpoint(save_ckpt, step):
+    """ Write stand-ins for the files of a TensorFlow checkpoint """
+    for suffix in ('.index', '.meta', '.data-00000-of-00001'):
+        Path(save_ckpt + suffix).write_text(f'fake checkpoint at step {step}\n')
+
+    Path('checkpoint').write_text(f'model_checkpoint_path: "{save_ckpt}"\n')
+    print(f'DEEPMD INFO    saved checkpoint {save_ckpt}', flush=True)
+
+
+def main(argv=None):
+    """ Run the fake `dp`
+
+    :param argv: command line arguments, without the program name; defaults
+        to sys.argv[1:]
+    """
+    parser = argparse.ArgumentParser(description='Fake dp for testing')
+    parser.add_argument('--seconds-per-step', type=float, default=1e-4,
+                        help='How long a training step takes at rcut 9')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    train_parser = subparsers.add_parser('train')
+    train_parser.add_argument('--skip-neighbor-stat', action='store_true')
+    train_parser.add_argument('--init-model', default=None)
+    train_parser.add_argument('input_json')
+
+    args = parser.parse_args(argv)
+
+    with open(args.input_json, 'r') as input_json:
+        params = json.load(input_json)
+
+    if args.init_model is not None and \
+            not Path(args.init_model + '.index').exists():
+        print(f'DEEPMD ERROR   no checkpoint {args.init_model}',
+              file=sys.stderr, flush=True)
+        sys.exit(1)
+
+    train(params, args.seconds_per_step, args.init_model)
+
+
+if __name__ == '__main__':
+    main()
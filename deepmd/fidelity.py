@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+    Multi-fidelity evaluation of offspring via successive halving
+
+    Training every offspring for the full number of steps is expensive, and
+    most of them turn out to be not worth it.  Instead, we train all the
+    offspring for a small number of steps, and only promote the best fraction
+    of them to successively larger step budgets, or "rungs."
+
+    - Jamieson, Kevin, and Ameet Talwalkar. "Non-stochastic best arm
+      identification and hyperparameter optimization." Artificial intelligence
+      and statistics. PMLR, 2016.
+
+    Evaluated individuals have `numb_steps` set to the number of steps they
+    were trained for, which is used to rank individuals only against others
+    trained for the same number of steps.
+"""
+import logging
+from math import ceil
+
+import toolz
+from toolz import curry
+
+
+from evaluation import create_evaluator, eval_population
+from phases import submitted
+from selection import rank_sort, crowding_distance
+
+logger = logging.getLogger(__name__)
+
+
+def nsga_2_sort(population):
+    """ Rank and crowding distance sort the given population
+
+    :param population: evaluated individuals
+    :returns: population sorted from best to worst
+    """
+    population = crowding_distance(rank_sort(population))
+    return sorted(population, key=lambda x: (x.rank, -x.distance))
+
+
+@curry
+def fidelity_rank_sort(population, parents):
+    """ NSGA-II rank and crowding distance calculation within fidelities
+
+    This is a stand-in for rank_sort(parents=parents) followed by
+    crowding_distance for populations with individuals trained for
+    different numbers of steps.  Individuals are only ranked against those
+    trained for the same number of steps, and so this should be followed by
+    truncation selection with a key that prefers more steps first; e.g.,
+
+        key=lambda x: (x.numb_steps or 0, -x.rank, x.distance)
+
+    where `numb_steps` is None for individuals that couldn't be decoded.
+
+    :param population: offspring
+    :param parents: to also be ranked
+    :returns: offspring and parents with ranks and distances
+    """
+    population = population + parents
+
+    for numb_steps, group in toolz.groupby(lambda x: x.numb_steps,
+                                           population).items():
+        crowding_distance(rank_sort(group))
+
+    return population
+
+
+class SuccessiveHalving:
+    """ Pipeline operator that evaluates offspring with successive halving
+
+    All the offspring are first trained for budgets[0] steps, then the best
+    1/eta of them by NSGA-II rank and crowding distance are trained again for
+    budgets[1] steps, and so on until the last budget, which should be the
+    full number of training steps.
+    """
+
+    def __init__(self, client, budgets, eta=3, evaluated_probes=(),
+                 evaluator=None):
+        """
+        :param client: dask client through which we evaluate individuals
+        :param budgets: increasing numbers of training steps for each rung
+        :param eta: only the best 1/eta of each rung is promoted
+        :param evaluated_probes: functions that accept a list of newly
+            evaluated individuals, called after each rung
+        :param evaluator: for the workers to evaluate individuals with, from
+            evaluation.create_evaluator(); defaults to the threads one
+        """
+        self.client = client
+        self.budgets = sorted(int(budget) for budget in budgets)
+        self.eta = eta
+        self.evaluated_probes = evaluated_probes
+        self.evaluator = evaluator if evaluator is not None \
+            else create_evaluator()
+
+    def __call__(self, offspring):
+        """ Evaluate the given offspring at increasing fidelities
+
+        :param offspring: unevaluated individuals
+        :returns: all the offspring, each evaluated at the largest budget it
+            was promoted to
+        """
+        results = []
+        candidates = list(offspring)
+
+        for rung, budget in enumerate(self.budgets):
+            for individual in candidates:
+                individual.fidelity = budget
+
+            logger.info(f'Evaluating {len(candidates)} offspring for '
+                        f'{budget} steps')
+
+            evaluated = eval_population(submitted(candidates), self.client,
+                                        self.evaluator)
+            toolz.pipe(evaluated, *self.evaluated_probes)
+
+            if rung == len(self.budgets) - 1:
+                results.extend(evaluated)
+                break
+
+            ranked = nsga_2_sort(evaluated)
+            num_promoted = ceil(len(ranked) / self.eta)
+
+            results.extend(ranked[num_promoted:])
+
+            # Promoted individuals start over with a fresh training, which
+            # may not be a cache hit or warm start as the last one was
+            candidates = []
+            for individual in ranked[:num_promoted]:
+                individual.learning_curve = None
+                individual.stop_reason = None
+                individual.cached_uuid = None
+                individual.init_model = None
+                individual.exception = None
+                individual.phases = []
+                candidates.append(individual)
+
+        return results
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+    Packing several single-GPU trainings onto each node
+
+    By default, every evaluation is a `jsrun` that takes all six GPUs of a
+    Summit node, which is a waste for small se_e2_a models that don't scale
+    across GPUs.  Instead, dask workers can run on the compute nodes, one per
+    GPU slot, and each training is then pinned to the GPU of a free slot on
+    its worker's node, with CPU and memory binding done by scripts/bind.sh
+    using the same maps as for jsrun, such as scripts/summit_map.sh.
+
+    With MPS (`#BSUB -alloc_flags "gpumps"`), more than one training can
+    share a GPU, in which case the slots are spread over the GPUs round-robin.
+
+    Slots are claimed with an exclusive lock on a node-local file for the
+    duration of the training, so trainings on the same node never share a
+    slot regardless of how the dask workers on the node were started, or how
+    many trainings each of them runs at once.
+"""
+import asyncio
+import fcntl
+import os
+from contextlib import asynccontextmanager, contextmanager
+from pathlib import Path
+from time import sleep
+
+# Where bind.sh lives
+SCRIPTS_DIR = Path(__file__).parent / 'scripts'
+
+
+class GPUSlots:
+    """ Node-local GPU slots for trainings """
+
+    # dask worker resource for a slot; workers should be started with
+    # `--resources GPU_SLOT=1`
+    RESOURCE = 'GPU_SLOT'
+
+    def __init__(self, gpus_per_node=6, trainings_per_gpu=1, lock_dir='/tmp',
+                 bind_map=None, poll_interval=5):
+        """
+        :param gpus_per_node: number of GPUs on each node
+        :param trainings_per_gpu: how many trainings can share a GPU; more
+            than one requires MPS
+        :param lock_dir: node-local directory for the slot lock files
+        :param bind_map: optional bind.sh affinity map file, such as
+            scripts/summit_map.sh; if not given, trainings are only pinned to
+            their GPU
+        :param poll_interval: how long, in seconds, to wait before trying
+            again if all slots are taken
+        """
+        self.gpus_per_node = gpus_per_node
+        self.trainings_per_gpu = trainings_per_gpu
+        self.lock_dir = Path(lock_dir)
+        self.bind_map = bind_map
+        self.poll_interval = poll_interval
+
+    @property
+    def num_slots(self):
+        return self.gpus_per_node * self.trainings_per_gpu
+
+    def gpu(self, slot):
+        """ :returns: the GPU for the given slot """
+        return slot % self.gpus_per_node
+
+    def claim(self):
+        """ Try to claim a free slot on this node
+
+        :returns: the slot and its locked lock file, or None if all the slots
+            are taken
+        """
+        user = os.environ.get('USER', 'deepmd')
+
+        for slot in range(self.num_slots):
+            lock_file = open(self.lock_dir /
+                             f'deepmd_gpu_slot_{user}_{slot}.lock', 'w')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                continue
+
+            return slot, lock_file
+
+        return None
+
+    @staticmethod
+    def release(lock_file):
+        """ Free a slot claimed by claim() """
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
+
+    @contextmanager
+    def acquire(self):
+        """ Claim a free slot on this node for as long as the context lasts
+
+        :returns: the GPU of the claimed slot
+        """
+        while (claimed := self.claim()) is None:
+            sleep(self.poll_interval)
+
+        slot, lock_file = claimed
+        try:
+            yield self.gpu(slot)
+        finally:
+            self.release(lock_file)
+
+    @asynccontextmanager
+    async def acquire_async(self):
+        """ acquire(), but waiting for a free slot with asyncio """
+        while (claimed := self.claim()) is None:
+            await asyncio.sleep(self.poll_interval)
+
+        slot, lock_file = claimed
+        try:
+            yield self.gpu(slot)
+        finally:
+            self.release(lock_file)
+
+    def pinning(self, gpu):
+        """ Command prefix that pins a process to the given GPU
+
+        bind.sh binds by local rank, which we set to the GPU so that its maps
+        give the cores and memory nearest the GPU.
+
+        :param gpu: as returned by acquire()
+        :returns: list of command arguments
+        """
+        command = ['env', f'CUDA_VISIBLE_DEVICES={gpu}', f'LOCAL_RANK={gpu}',
+                   'OMP_NUM_THREADS=1']
+
+        if self.bind_map is not None:
+            command += [str(SCRIPTS_DIR / 'bind.sh'),
+                        f'--cpu={self.bind_map}', f'--mem={self.bind_map}',
+                        '--']
+
+        return command
+
+    def resources(self):
+        """ :returns: dask resources each evaluation needs """
+        return {GPUSlots.RESOURCE: 1}
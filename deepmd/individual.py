@@ -3,6 +3,8 @@
     DistributedIndividual subclass to allow for using UUIDs to create sub-
     directories to save output for the given individual
 """
+import copy
+
 import numpy as np
 from leap_ec.distrib.individual import DistributedIndividual
 
@@ -14,11 +16,71 @@ class DeepMDIndividual(DistributedIndividual):
     def __init__(self, genome, decoder=None, problem=None):
         super().__init__(genome, decoder, problem)
         self.fitness = (None, None) # After eval: (rmse_e_val, rmse_f_val)
+        self.learning_curve = None # After eval: step, rmse_e_val, rmse_f_val
+        self.stop_reason = None # Set if training was stopped early
+        self.fidelity = None # Training steps, if not the problem's default
+        self.numb_steps = None # After eval: steps actually trained for
+        self.cached_uuid = None # Set if fitness was from the fitness cache
+        self.cached_model_dir = None # Directory of the model it was cached from
+        self.parent_uuid = None # Set by clone() if the parent was trained
+        self.parent_numb_steps = None # Steps the parent was trained for
+        self.parent_attempt = 0 # Attempt whose training the parent kept
+        self.parent_model_dir = None # Directory of the parent's model
+        self.parent_phenome = None # Phenome the parent was trained with
+        self.init_model = None # Set if training was warm-started from this
+        self.attempt = 0 # Set for speculative re-executions
+        self.strategy = None # Mutation strategy parameters of adaptive engines
+        self.submit_time = None # When the client submitted it for evaluation
+        self.phases = [] # After eval: (name, start, stop) of each phase
+        self.slot = None # After eval: evaluation slot of its worker process
+
+    def clone(self):
+        """ Clone, but without the evaluation results of the parent
+
+        If the parent was successfully trained, the clone remembers where and
+        with what hyperparameters so that its training can be warm-started
+        from the parent's model checkpoint.
+        """
+        cloned = super().clone()
+        cloned.learning_curve = None
+        cloned.stop_reason = None
+        cloned.fidelity = None
+        cloned.numb_steps = None
+        cloned.cached_uuid = None
+        cloned.cached_model_dir = None
+        cloned.init_model = None
+        cloned.attempt = 0
+        cloned.submit_time = None
+        cloned.phases = []
+        cloned.slot = None
+        # Offspring start out with their parent's strategy parameters
+        cloned.strategy = copy.deepcopy(self.strategy)
+
+        if self.is_viable and self.numb_steps is not None:
+            # If the parent's fitness came from the cache, its model is in
+            # the directory of the individual that was actually trained.
+            cloned.parent_uuid = self.cached_uuid or self.uuid
+            cloned.parent_numb_steps = self.numb_steps
+            # A speculative re-execution that won was trained in its own
+            # directory
+            cloned.parent_attempt = 0 if self.cached_uuid else self.attempt
+            # which may be in another run for a cached fitness
+            cloned.parent_model_dir = str(self.problem.model_dir(self))
+            cloned.parent_phenome = self.decode()
+        else:
+            cloned.parent_uuid = None
+            cloned.parent_numb_steps = None
+            cloned.parent_attempt = 0
+            cloned.parent_model_dir = None
+            cloned.parent_phenome = None
+
+        return cloned
 
     def evaluate_imp(self):
         """ We override Individual.evaluate_imp() to pass in the UUID
         """
-        return self.problem.evaluate(self.decode(), uuid=self.uuid)
+        return self.problem.evaluate(self.decode(), uuid=self.uuid,
+                                     individual=self)
 
     def evaluate(self):
         """ determine this individual's fitness
@@ -44,6 +106,23 @@ class DeepMDIndividual(DistributedIndividual):
         # newly evaluated fitness.
         return self.fitness
 
+    async def evaluate_async(self):
+        """ evaluate(), but as a coroutine that awaits
+        DeepMDProblem.evaluate_async()
+
+        :return: the calculated fitness
+        """
+        try:
+            self.fitness = await self.problem.evaluate_async(
+                self.decode(), uuid=self.uuid, individual=self)
+            self.is_viable = True
+        except Exception as e:
+            self.fitness = np.array((DeepMDProblem.BAD_FITNESS, DeepMDProblem.BAD_FITNESS))
+            self.exception = e
+            self.is_viable = False
+
+        return self.fitness
+
     def __str__(self):
         phenome = self.decode()
         if hasattr(self, 'exception'):
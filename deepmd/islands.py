@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+    Island model: independent subpopulations that exchange migrants
+
+    One client with one scheduler and one NSGA-II population centralizes the
+    scheduling, the client-side sorting, and the generational barrier, which
+    limits how many nodes a run can use.  In the island model, a run is
+    instead several deepmd-tuner.py processes started with `--island N`, each
+    with its own scheduler, workers, population, and `island_N` subdirectory
+    of the run directory.  The islands never wait on one another:
+
+    - Every `interval` generations, each island publishes up to `migrants`
+      of its non-dominated individuals, the least crowded first, by
+      atomically replacing its file in the shared migration directory.
+    - At the same time, it takes in whatever its neighbours in the topology
+      have most recently published that it hasn't seen yet, and NSGA-II
+      survival selection then trims the population back to size.
+
+    The topologies are `ring`, where island N takes migrants from island
+    N - 1, `complete`, where every island takes them from all the others, and
+    `random`, where each island takes them from one other island picked anew
+    every time.
+
+    Migrants' training directories are symlinked into the receiving island's
+    run directory, so their offspring can still be warm-started from them.
+    Which publications have been seen isn't checkpointed; a resumed island
+    may take in the latest ones again, but migrants it already has are
+    skipped.
+"""
+import copy
+import logging
+import os
+import random
+from pathlib import Path
+
+import cloudpickle
+from toolz import pipe
+
+from leap_ec import ops
+
+from selection import rank_sort, crowding_distance
+
+logger = logging.getLogger(__name__)
+
+TOPOLOGIES = ('ring', 'complete', 'random')
+
+
+class Migration:
+    """ Exchanges migrants between this island and its neighbours """
+
+    def __init__(self, directory, island, count, problem, topology='ring',
+                 interval=5, migrants=2):
+        """
+        :param directory: shared by all the islands, to which they publish
+            their migrants
+        :param island: number of this island, from 0 to `count` - 1
+        :param count: of islands
+        :param problem: being solved by this island, to which immigrants are
+            re-bound
+        :param topology: one of TOPOLOGIES
+        :param interval: how many generations between migrations
+        :param migrants: most individuals published per migration
+        """
+        if topology not in TOPOLOGIES:
+            raise ValueError(f'Unknown island topology {topology}; should be '
+                             f'one of {", ".join(TOPOLOGIES)}')
+
+        if not 0 <= island < count:
+            raise ValueError(f'Island {island} is not one of the {count} '
+                             f'islands')
+
+        self.directory = Path(directory)
+        self.island = island
+        self.count = count
+        self.problem = problem
+        self.topology = topology
+        self.interval = interval
+        self.migrants = migrants
+
+        # Island -> generation of its latest publication we took in
+        self.seen = {}
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def path(self, island):
+        """ :returns: the file to which `island` publishes its migrants """
+        return self.directory / f'island_{island}.pkl'
+
+    def neighbours(self):
+        """ :returns: the islands this one takes in migrants from """
+        others = [island for island in range(self.count)
+                  if island != self.island]
+
+        if not others:
+            return []
+        elif self.topology == 'ring':
+            return [(self.island - 1) % self.count]
+        elif self.topology == 'random':
+            return [random.choice(others)]
+
+        return others
+
+    def emigrants(self, population):
+        """ :returns: the non-dominated, fully trained individuals of the
+            ranked population to publish, the least crowded first """
+        candidates = [individual for individual in population
+                      if individual.is_viable and individual.rank == 1 and
+                      individual.numb_steps == self.problem.numb_steps]
+
+        return sorted(candidates, key=lambda x: -x.distance)[:self.migrants]
+
+    def publish(self, population, generation):
+        """ Atomically replace this island's published migrants
+
+        :param population: ranked population to pick migrants from
+        :param generation: current generation
+        """
+        migrants = []
+
+        for individual in self.emigrants(population):
+            # The receiving island has its own problem
+            migrant = copy.copy(individual)
+            migrant.problem = None
+            migrants.append(migrant)
+
+        path = self.path(self.island)
+        tmp_path = path.with_name(f'.{path.name}.tmp')
+
+        with open(tmp_path, 'wb') as migrants_file:
+            cloudpickle.dump(dict(generation=generation,
+                                  run_dir=str(self.problem.run_dir),
+                                  migrants=migrants), migrants_file)
+
+        os.replace(tmp_path, path)
+
+        logger.info(f'Island {self.island} published {len(migrants)} '
+                    f'migrants')
+
+    def receive(self):
+        """ Take in the latest unseen migrants of the neighbours
+
+        :returns: list of the immigrants
+        """
+        immigrants = []
+
+        for island in self.neighbours():
+            try:
+                with open(self.path(island), 'rb') as migrants_file:
+                    published = cloudpickle.load(migrants_file)
+            except FileNotFoundError:
+                # It hasn't migrated yet
+                continue
+
+            if published['generation'] <= self.seen.get(island, -1):
+                continue
+
+            self.seen[island] = published['generation']
+
+            for migrant in published['migrants']:
+                migrant.problem = self.problem
+                self.link(migrant, published['run_dir'])
+                immigrants.append(migrant)
+
+            logger.info(f"Island {self.island} took in "
+                        f"{len(published['migrants'])} migrants from island "
+                        f"{island}'s generation {published['generation']}")
+
+        return immigrants
+
+    def link(self, migrant, run_dir):
+        """ Symlink a migrant's training directory into this island's run
+        directory, where warm starts look for its model """
+        if getattr(migrant, 'cached_model_dir', None):
+            # Its model is wherever its fitness was cached from, which
+            # doesn't depend on the island
+            return
+
+        uuid = migrant.cached_uuid or migrant.uuid
+        attempt = 0 if migrant.cached_uuid else migrant.attempt
+        source = Path(run_dir) / \
+            self.problem.subdir_name(uuid, migrant.numb_steps, attempt)
+        link = Path(self.problem.run_dir) / \
+            self.problem.subdir_name(uuid, migrant.numb_steps, attempt)
+
+        if source.exists() and not link.exists():
+            link.parent.mkdir(parents=True, exist_ok=True)
+            link.symlink_to(source.absolute(), target_is_directory=True)
+
+    def __call__(self, population, generation):
+        """ Migrate, if it's time to
+
+        :param population: that survived selection this generation
+        :param generation: current generation
+        :returns: the population with any immigrants, trimmed back to size by
+            NSGA-II survival selection
+        """
+        if generation % self.interval != 0:
+            return population
+
+        self.publish(population, generation)
+
+        uuids = {individual.uuid for individual in population}
+        immigrants = [immigrant for immigrant in self.receive()
+                      if immigrant.uuid not in uuids]
+
+        if not immigrants:
+            return population
+
+        return pipe(population + immigrants,
+                    rank_sort,
+                    crowding_distance,
+                    ops.truncation_selection(size=len(population),
+                                             key=lambda x: (-x.rank,
+                                                            x.distance)))
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+    How trainings are launched
+
+    DeepMDProblem builds the `dp train` command for an individual, and a
+    launcher wraps it in whatever is needed to run it somewhere:
+
+    - JsrunLauncher -- a whole Summit node per training; the default
+    - SrunLauncher and MpirunLauncher -- for Slurm and generic MPI clusters
+    - Launcher -- plain `dp` on the worker's own node, such as with GPU slots
+    - FakeLauncher -- fake_dp.py instead of `dp`, which writes a realistic
+      lcurve.out without needing deepmd-kit or a GPU, so that the EA, the I/O
+      and the scheduling can be exercised end-to-end on a laptop or CI box
+    - WarmLauncher -- `dp` or fake_dp.py in a warm trainer process on the
+      worker's node, which already has the trainer imported and the
+      training data loaded; see warm_trainer.py
+"""
+import sys
+from pathlib import Path
+
+# The stand-in for `dp`
+FAKE_DP = Path(__file__).parent / 'fake_dp.py'
+
+# The client for warm trainer processes
+WARM_TRAINER = Path(__file__).parent / 'warm_trainer.py'
+
+
+class Launcher:
+    """ Run `dp` directly on the worker's node """
+
+    def command(self, dp_command):
+        """
+        :param dp_command: list of `dp` command arguments, starting with `dp`
+        :returns: list of command arguments that launch it
+        """
+        return list(dp_command)
+
+
+class JsrunLauncher(Launcher):
+    """ Run `dp` on a whole Summit node with jsrun """
+
+    COMMAND_STR = ['jsrun', '--smpiargs="-gpu"',
+                   '-e', 'individual', '--stdio_stdout=worker_out.%j.%h.%p',
+                   '--stdio_stderr=worker_error.%j.%h.%p',
+                   '-n', '1',
+                   '-a', '6',
+                   '-c', '40',
+                   '-g', '6',
+                   '-b', 'none', '${BIND}',
+                   '--latency_priority', 'gpu-cpu',
+                   'env', 'OMP_NUM_THREADS=1', # 'TF_NUM_INTRAOP_THREADS=1',
+                   # 'TF_NUM_INTEROP_THREADS=7',
+                   'CUDA_VISIBLE_DEVICES=0,1,2,3,4,5']
+
+    def command(self, dp_command):
+        return JsrunLauncher.COMMAND_STR + list(dp_command)
+
+
+class SrunLauncher(Launcher):
+    """ Run `dp` with Slurm's srun, one GPU per rank """
+
+    def __init__(self, ntasks=1, extra_args=()):
+        """
+        :param ntasks: number of ranks
+        :param extra_args: any other srun arguments
+        """
+        self.ntasks = ntasks
+        self.extra_args = list(extra_args)
+
+    def command(self, dp_command):
+        return ['srun', f'--ntasks={self.ntasks}', '--gpus-per-task=1',
+                *self.extra_args] + list(dp_command)
+
+
+class MpirunLauncher(Launcher):
+    """ Run `dp` with mpirun """
+
+    def __init__(self, ntasks=1, extra_args=()):
+        """
+        :param ntasks: number of ranks
+        :param extra_args: any other mpirun arguments
+        """
+        self.ntasks = ntasks
+        self.extra_args = list(extra_args)
+
+    def command(self, dp_command):
+        return ['mpirun', '-np', str(self.ntasks),
+                *self.extra_args] + list(dp_command)
+
+
+class FakeLauncher(Launcher):
+    """ Run fake_dp.py in place of `dp` """
+
+    def __init__(self, seconds_per_step=1e-4):
+        """
+        :param seconds_per_step: how long each fake training step takes for
+            a model with rcut 9; larger cutoffs take longer
+        """
+        self.seconds_per_step = seconds_per_step
+
+    def command(self, dp_command):
+        return [sys.executable, str(FAKE_DP),
+                f'--seconds-per-step={self.seconds_per_step}'] + \
+               list(dp_command[1:])
+
+
+class WarmLauncher(Launcher):
+    """ Run `dp` in a warm trainer process on the worker's node """
+
+    def __init__(self, trainer='dp', socket_dir='/tmp', idle_timeout=3600,
+                 seconds_per_step=1e-4):
+        """
+        :param trainer: `dp`, or `fake` for fake_dp.py
+        :param socket_dir: node-local directory for the trainer processes'
+            sockets and logs
+        :param idle_timeout: how long, in seconds, trainer processes wait for
+            another training before exiting
+        :param seconds_per_step: for the fake trainer; see FakeLauncher
+        """
+        self.trainer = trainer
+        self.socket_dir = socket_dir
+        self.idle_timeout = idle_timeout
+        self.seconds_per_step = seconds_per_step
+
+    def command(self, dp_command):
+        command = [sys.executable, str(WARM_TRAINER), 'run',
+                   f'--trainer={self.trainer}',
+                   f'--socket-dir={self.socket_dir}',
+                   f'--idle-timeout={self.idle_timeout}', '--']
+
+        if self.trainer == 'fake':
+            command.append(f'--seconds-per-step={self.seconds_per_step}')
+
+        return command + list(dp_command[1:])
+
+
+LAUNCHERS = {'jsrun': JsrunLauncher,
+             'srun': SrunLauncher,
+             'mpirun': MpirunLauncher,
+             'local': Launcher,
+             'fake': FakeLauncher,
+             'warm': WarmLauncher}
+
+
+def create_launcher(name, **kwargs):
+    """
+    :param name: of the launcher; one of LAUNCHERS
+    :param kwargs: for the launcher's constructor
+    :returns: the launcher
+    """
+    if name not in LAUNCHERS:
+        raise ValueError(f'Unknown launcher {name}; should be one of '
+                         f'{", ".join(LAUNCHERS)}')
+
+    return LAUNCHERS[name](**kwargs)
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+    Reading deepmd-kit's lcurve.out, and storing learning curves
+
+    np.genfromtxt(names=True) is slow, and reads the whole file even though
+    the fitness is just the last row.  Instead, we have:
+
+    - read_last_row() -- seeks to the end of the file for the final values
+    - read_lcurve() -- parses the whole file in one go
+    - LCurveTail -- incrementally parses rows as they're appended, for
+      monitoring trainings while they run
+
+    The header is the first line, and starts with a '#'; e.g.,
+
+    #  step      rmse_val    rmse_trn    rmse_e_val  rmse_e_trn    rmse_f_val  rmse_f_trn         lr
+
+    LearningCurveStore keeps the full learning curves of all the trainings of
+    a run in one directory of npz files, one per UUID, so that analyses
+    don't have to walk thousands of UUID directories on GPFS.
+"""
+import os
+from pathlib import Path
+
+import numpy as np
+
+
+def read_header(lcurve):
+    """ :returns: the column names from the first line of lcurve.out, open in
+        text or binary mode, or None if it hasn't been written yet """
+    lcurve.seek(0)
+    line = lcurve.readline()
+    if isinstance(line, bytes):
+        line = line.decode()
+
+    if not line.startswith('#') or not line.endswith('\n'):
+        return None
+
+    return line.lstrip('#').split()
+
+
+def read_last_row(path, chunk_size=4096):
+    """ Read only the last complete row of lcurve.out
+
+    :param path: to lcurve.out
+    :param chunk_size: how many bytes to read at a time from the end
+    :returns: dict of column name -> value, or None if there are no rows
+    """
+    with open(path, 'rb') as lcurve:
+        header = read_header(lcurve)
+        if header is None:
+            return None
+
+        lcurve.seek(0, os.SEEK_END)
+        end = lcurve.tell()
+        position = end
+        tail = b''
+
+        while position > 0:
+            position = max(0, position - chunk_size)
+            lcurve.seek(position)
+            tail = lcurve.read(end - position)
+
+            # Ignore a partially written last line; we need a newline before
+            # and after the last row to be sure we have all of it.
+            lines = tail[:tail.rfind(b'\n') + 1].splitlines()
+            complete = lines if position == 0 else lines[1:]
+            rows = [line for line in complete
+                    if line.strip() and not line.startswith(b'#')]
+
+            if rows:
+                return dict(zip(header, (float(x) for x in rows[-1].split())))
+
+    return None
+
+
+def read_lcurve(path):
+    """ Read all the complete rows of lcurve.out
+
+    This is a drop-in replacement for np.genfromtxt(path, names=True).
+
+    :param path: to lcurve.out
+    :returns: structured array with a field per column
+    """
+    with open(path, 'r') as lcurve:
+        header = read_header(lcurve)
+        if header is None:
+            return np.recarray((0,), dtype=[])
+        text = lcurve.read()
+
+    # Ignore a partially written last line, and any comments
+    text = text[:text.rfind('\n') + 1]
+    if '#' in text:
+        text = '\n'.join(line for line in text.splitlines()
+                         if not line.startswith('#'))
+
+    values = np.array(text.split(), dtype=float)
+    values = values[:len(values) // len(header) * len(header)]
+
+    return np.core.records.fromarrays(values.reshape(-1, len(header)).T,
+                                      names=header)
+
+
+class LCurveTail:
+    """ Incrementally read the rows appended to a deepmd-kit lcurve.out """
+
+    def __init__(self, path):
+        """
+        :param path: to lcurve.out, which may not exist yet
+        """
+        self.path = Path(path)
+        self.offset = 0
+        self.names = None
+        self.rows = []
+
+    def read(self):
+        """ Read any rows that were appended since the last read
+
+        Partially written lines are left for the next read.
+
+        :returns: list of newly read rows, each a dict keyed by column name
+        """
+        if not self.path.exists():
+            return []
+
+        with open(self.path, 'r') as lcurve:
+            lcurve.seek(self.offset)
+            chunk = lcurve.read()
+
+        # Only consume complete lines
+        end = chunk.rfind('\n') + 1
+        self.offset += len(chunk[:end].encode())
+
+        new_rows = []
+        for line in chunk[:end].splitlines():
+            if line.startswith('#'):
+                if self.names is None:
+                    self.names = line.lstrip('#').split()
+                continue
+            if not line.strip() or self.names is None:
+                continue
+            row = dict(zip(self.names, (float(x) for x in line.split())))
+            new_rows.append(row)
+
+        self.rows.extend(new_rows)
+
+        return new_rows
+
+    def last(self):
+        """ :returns: the last row read, or None if there isn't one """
+        return self.rows[-1] if self.rows else None
+
+    def best(self):
+        """ :returns: (step, best rmse_e_val, best rmse_f_val) read so far,
+            or None if nothing has been read """
+        if not self.rows:
+            return None
+
+        return (self.rows[-1]['step'],
+                min(row['rmse_e_val'] for row in self.rows),
+                min(row['rmse_f_val'] for row in self.rows))
+
+    def columns(self):
+        """ :returns: dict of column name -> array of the rows read so far """
+        return {name: np.array([row[name] for row in self.rows])
+                for name in self.names or []}
+
+
+def learning_curve(data):
+    """ Extract the validation learning curve from lcurve.out data
+
+    :param data: structured array as read by read_lcurve() or a list of rows
+        as read by LCurveTail
+    :returns: (n, 3) array of step, rmse_e_val, rmse_f_val
+    """
+    if isinstance(data, list):
+        return np.array([(row['step'], row['rmse_e_val'], row['rmse_f_val'])
+                         for row in data])
+
+    return np.column_stack((data['step'], data['rmse_e_val'],
+                            data['rmse_f_val']))
+
+
+class LearningCurveStore:
+    """ Run-wide store of full learning curves
+
+    Each training's curve is written by the worker as `<uuid>.npz` in the
+    store directory, with an array per lcurve.out column, so that writers
+    never contend, and load() gathers them all into one set of columns.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: directory for the store, which should be on a
+            filesystem shared by the workers; it's created if need be
+        """
+        self.path = Path(path)
+
+    def put(self, name, columns):
+        """ Atomically store one learning curve
+
+        :param name: of the partition, usually the UUID sub-directory name
+        :param columns: dict of column name -> array, or a structured array
+            as read by read_lcurve()
+        """
+        if isinstance(columns, np.ndarray):
+            columns = {field: columns[field]
+                       for field in columns.dtype.names or ()}
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.path / f'.{name}.npz'
+
+        with open(tmp_file, 'wb') as out:
+            np.savez(out, **columns)
+
+        os.replace(tmp_file, self.path / f'{name}.npz')
+
+    def get(self, name):
+        """ :returns: dict of column name -> array for the given partition """
+        with np.load(self.path / f'{name}.npz') as data:
+            return dict(data)
+
+    def load(self):
+        """ Gather all the stored learning curves
+
+        :returns: dict of column name -> array over all the curves, with an
+            extra `name` column of the partition names
+        """
+        names, columns = [], {}
+
+        for partition in sorted(self.path.glob('[!.]*.npz')):
+            with np.load(partition) as data:
+                length = len(data[data.files[0]]) if data.files else 0
+                names.extend([partition.stem] * length)
+                for column in data.files:
+                    columns.setdefault(column, []).append(data[column])
+
+        result = {column: np.concatenate(arrays)
+                  for column, arrays in columns.items()}
+        result['name'] = np.array(names)
+
+        return result
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+    Timing the phases of evaluations
+
+    Individuals used to only record start_eval_time and stop_eval_time, so
+    there was no telling how much of an evaluation was overhead.  Now each
+    evaluation records named phases as (name, start, stop) wall-clock times
+    in DeepMDIndividual.phases:
+
+    - queued -- from the client submitting it to a worker starting on it,
+      which includes waiting for a free worker, and dask serializing it and
+      shipping it to the worker
+    - cache_lookup -- looking up its fitness in the fitness cache
+    - input_json -- creating its directory and rendering input.json
+    - gpu_slot -- waiting for a free GPU slot
+    - launch -- from starting the launcher, such as jsrun, to the training's
+      first output
+    - tensorflow_startup -- from there to deepmd-kit's first message
+    - data_loading -- from there to deepmd-kit building the learning rate,
+      which follows loading the systems
+    - graph_building -- from there to the first training step
+    - training -- from there to the training exiting
+    - teardown -- draining the training's output after it exited
+    - results -- reading its fitness from lcurve.out
+    - gathered -- from the worker finishing to the client receiving the
+      result, which includes waiting on the rest of the generation
+
+    The phases between launch and training are told apart by the first line
+    of the training's output containing each of TRAINING_MARKERS, so phases
+    whose markers never show up are merged into the previous one.
+
+    PhaseTrace is a probe for newly evaluated individuals on the client that
+    appends their phases to a Chrome trace-event JSON file, for
+    chrome://tracing or https://ui.perfetto.dev, with a track per evaluation
+    slot of each worker process, grouped by node, since a worker process may
+    run several evaluations at once.  The file is a JSON array that's never closed,
+    which trace viewers accept, so it can be appended to as the run goes.
+    It also rewrites an OpenMetrics text file with the total time spent in
+    each phase, and how many evaluations went through it, per node and per
+    generation.
+"""
+import json
+import logging
+import os
+import re
+from contextlib import contextmanager
+from pathlib import Path
+from time import time
+
+from leap_ec import ops
+from leap_ec.global_vars import context
+
+logger = logging.getLogger(__name__)
+
+# The phase that starts with the first line of the training's output
+# containing the text, in order
+TRAINING_MARKERS = (('tensorflow_startup', ''),
+                    ('data_loading', 'DEEPMD'),
+                    ('graph_building', 'built lr'),
+                    ('training', 'start training'))
+
+METRIC_LINE = re.compile(r'^deepmd_phase_(seconds|evaluations)_total'
+                         r'\{phase="(.*)",node="(.*)",generation="(\d+)"\} '
+                         r'(\S+)$')
+
+
+def record(individual, name, start, stop):
+    """ Record a phase of the individual's evaluation, if there is one """
+    if individual is not None:
+        individual.phases.append((name, start, stop))
+
+
+@contextmanager
+def phase(individual, name):
+    """ Record the context as a phase of the individual's evaluation """
+    start = time()
+    try:
+        yield
+    finally:
+        record(individual, name, start, time())
+
+
+def record_training(individual, launched, marks, exited):
+    """ Record the phases of a training from the marks in its output
+
+    :param individual: being trained, or None
+    :param launched: time() when the launcher was started
+    :param marks: phase name -> time() of the first line of output with its
+        marker, as collected by TrainingOutput
+    :param exited: time() when the training exited
+    """
+    boundaries = sorted([(launched, 'launch')] +
+                        [(marks[name], name) for name, _ in TRAINING_MARKERS
+                         if name in marks])
+
+    for (start, name), (stop, _) in zip(boundaries,
+                                        boundaries[1:] + [(exited, None)]):
+        record(individual, name, start, stop)
+
+
+def submitted(individuals):
+    """ Stamp individuals as submitted for evaluation now
+
+    :param individuals: about to be submitted
+    :returns: the same individuals
+    """
+    now = time()
+
+    for individual in individuals:
+        individual.submit_time = now
+        individual.phases = []
+
+    return individuals
+
+
+@ops.iteriter_op
+def stamp_submitted(next_individual):
+    """ Pipeline operator that stamps individuals as they're pulled into the
+    evaluation pool """
+    for individual in next_individual:
+        yield submitted([individual])[0]
+
+
+class PhaseTrace:
+    """ Export the phases of evaluations as a trace and as metrics """
+
+    def __init__(self, trace_file, metrics_file, resume=False,
+                 context=context):
+        """
+        :param trace_file: Chrome trace-event JSON file to append to
+        :param metrics_file: OpenMetrics text file to rewrite
+        :param resume: if True, carry on with the existing files, if any,
+            rather than starting them over
+        :param context: for the current generation
+        """
+        self.trace_file = Path(trace_file)
+        self.metrics_file = Path(metrics_file)
+        self.context = context
+
+        # (phase, node, generation) -> [seconds, evaluations]
+        self.totals = {}
+        # Node -> trace process ID
+        self.nodes = {}
+        # (trace process ID, worker pid, slot) -> trace thread ID
+        self.tracks = {}
+
+        if resume and self.metrics_file.exists():
+            self.load()
+
+        if resume and self.trace_file.exists():
+            self.load_nodes()
+        else:
+            self.trace_file.write_text('[\n')
+
+    def phases(self, individual, received):
+        """ :returns: all the phases of the individual's evaluation, including
+            those seen from the client """
+        phases = []
+        submit_time = getattr(individual, 'submit_time', None)
+
+        if submit_time is not None:
+            phases.append(('queued', submit_time,
+                           individual.start_eval_time))
+
+        phases.extend(getattr(individual, 'phases', []))
+        phases.append(('gathered', individual.stop_eval_time, received))
+
+        return phases
+
+    def node(self, hostname):
+        """ :returns: trace process ID of the node, and any metadata event
+            naming it """
+        if hostname in self.nodes:
+            return self.nodes[hostname], []
+
+        pid = self.nodes[hostname] = len(self.nodes) + 1
+
+        return pid, [dict(name='process_name', ph='M', pid=pid,
+                          args=dict(name=hostname))]
+
+    def track(self, node, individual):
+        """ :returns: trace thread ID of the evaluation slot of the worker
+            process that evaluated the individual on the node, and any
+            metadata event naming it """
+        worker = getattr(individual, 'pid', 0)
+        slot = getattr(individual, 'slot', None)
+        key = (node, worker, slot)
+
+        if key in self.tracks:
+            return self.tracks[key], []
+
+        tid = self.tracks[key] = len(self.tracks) + 1
+        name = f'worker {worker}' + (f' slot {slot}' if slot is not None
+                                     else '')
+
+        return tid, [dict(name='thread_name', ph='M', pid=node, tid=tid,
+                          args=dict(name=name, worker=worker, slot=slot))]
+
+    def __call__(self, population):
+        """ Export the phases of newly evaluated individuals
+
+        :param population: newly evaluated individuals
+        :returns: the same population
+        """
+        received = time()
+        generation = self.context['leap'].get('generation', 0)
+        events = []
+
+        for individual in population:
+            if getattr(individual, 'start_eval_time', None) is None:
+                continue
+
+            hostname = getattr(individual, 'hostname', 'unknown')
+            pid, metadata = self.node(hostname)
+            events.extend(metadata)
+            tid, metadata = self.track(pid, individual)
+            events.extend(metadata)
+
+            for name, start, stop in self.phases(individual, received):
+                events.append(dict(name=name, cat='evaluation', ph='X',
+                                   ts=start * 1e6,
+                                   dur=max(stop - start, 0) * 1e6,
+                                   pid=pid, tid=tid,
+                                   args=dict(uuid=str(individual.uuid),
+                                             birth_id=individual.birth_id,
+                                             generation=generation)))
+
+                totals = self.totals.setdefault((name, hostname, generation),
+                                                [0.0, 0])
+                totals[0] += max(stop - start, 0)
+                totals[1] += 1
+
+        if events:
+            with open(self.trace_file, 'a') as trace:
+                trace.writelines(json.dumps(event) + ',\n'
+                                 for event in events)
+
+            self.save()
+
+        return population
+
+    def save(self):
+        """ Atomically rewrite the metrics """
+        lines = ['# TYPE deepmd_phase_seconds counter',
+                 '# UNIT deepmd_phase_seconds seconds',
+                 '# HELP deepmd_phase_seconds Time spent in each phase of '
+                 'evaluations.']
+        lines.extend(f'deepmd_phase_seconds_total{self.labels(key)} '
+                     f'{seconds!r}'
+                     for key, (seconds, _) in sorted(self.totals.items()))
+        lines.extend(['# TYPE deepmd_phase_evaluations counter',
+                      '# HELP deepmd_phase_evaluations Evaluations that '
+                      'went through each phase.'])
+        lines.extend(f'deepmd_phase_evaluations_total{self.labels(key)} '
+                     f'{evaluations}'
+                     for key, (_, evaluations) in sorted(self.totals.items()))
+        lines.append('# EOF')
+
+        tmp_file = self.metrics_file.with_name(f'.{self.metrics_file.name}.tmp')
+        tmp_file.write_text('\n'.join(lines) + '\n')
+        os.replace(tmp_file, self.metrics_file)
+
+    @staticmethod
+    def labels(key):
+        """ :returns: the OpenMetrics labels of a (phase, node, generation)
+        """
+        name, hostname, generation = key
+        return f'{{phase="{name}",node="{hostname}",generation="{generation}"}}'
+
+    def load_nodes(self):
+        """ Carry on with the nodes and tracks named in the trace """
+        with open(self.trace_file, 'r') as trace:
+            for line in trace:
+                if '"process_name"' in line:
+                    event = json.loads(line.rstrip().rstrip(','))
+                    self.nodes[event['args']['name']] = event['pid']
+                elif '"thread_name"' in line:
+                    event = json.loads(line.rstrip().rstrip(','))
+                    self.tracks[(event['pid'], event['args']['worker'],
+                                 event['args']['slot'])] = event['tid']
+
+    def load(self):
+        """ Carry on with the totals in the metrics file """
+        with open(self.metrics_file, 'r') as metrics:
+            for line in metrics:
+                match = METRIC_LINE.match(line.strip())
+                if match is None:
+                    continue
+
+                metric, name, hostname, generation, value = match.groups()
+                totals = self.totals.setdefault(
+                    (name, hostname, int(generation)), [0.0, 0])
+
+                if metric == 'seconds':
+                    totals[0] = float(value)
+                else:
+                    totals[1] = int(value)
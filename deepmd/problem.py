@@ -11,14 +11,21 @@
     that these two can potentially greatly diverge as we get a deeper
     understanding on how their software works.
 """
+import asyncio
+import hashlib
+import json
 import os
 import random
+import shutil
+import signal
 import subprocess
 
 import sys
 from pathlib import Path
 from string import Template
+from types import SimpleNamespace
 from subprocess import CalledProcessError
+from time import sleep, time
 
 import numpy as np
 from numpy import nan, isnan
@@ -33,9 +40,132 @@ install()
 
 from distributed import get_worker
 
+from phases import TRAINING_MARKERS, phase, record, record_training
+
 # from leap_ec.problem import ScalarProblem
 from leap_ec.multiobjective.problems import MultiObjectiveProblem
 
+from decoder import DeepMDDecoder
+from launchers import JsrunLauncher
+from lcurve import LCurveTail, learning_curve, read_lcurve, read_last_row
+from training_output import TrainingOutput
+
+# How long, in seconds, a stopped training has to exit before it's SIGKILLed
+KILL_GRACE = 10
+
+
+def signal_group(pgid, signum):
+    """ Send a signal to a process group
+
+    :returns: False if there's nothing left in the group
+    """
+    try:
+        os.killpg(pgid, signum)
+    except ProcessLookupError:
+        return False
+
+    return True
+
+
+class TrainingWatch:
+    """ Checks on a running training for DeepMDProblem: whether its stopping
+    rule says it's hopeless, whether it's straggling, and whether it has run
+    out of time """
+
+    def __init__(self, problem, individual, cwd, timeout=None):
+        """
+        :param problem: training it
+        :param individual: being trained, or None
+        :param cwd: directory in which it's training
+        :param timeout: how long, in minutes, to allow the training, if not
+            the problem's timeout
+        """
+        self.problem = problem
+        self.individual = individual
+        self.cwd = Path(cwd)
+        self.timeout = int(problem.timeout if timeout is None
+                           else timeout) * 60
+        self.monitored = problem.stopping_rule is not None and \
+            individual is not None
+        self.reason = self.straggling = None
+
+        if self.monitored:
+            self.thresholds = problem.stopping_rule.load(individual.numb_steps)
+            get_worker().logger.debug(f'Early stopping thresholds for '
+                                      f'{len(self.thresholds)} steps')
+            self.tail = LCurveTail(self.cwd / 'lcurve.out')
+
+        self.started = time()
+        self.deadline = self.started + self.timeout
+
+        if problem.stragglers is not None:
+            self.straggler_deadline = problem.stragglers.load(
+                individual.numb_steps if individual is not None
+                else problem.numb_steps)
+
+    def wait(self):
+        """ :returns: how long, in seconds, to wait for the training to exit
+            before checking on it """
+        wait = max(self.deadline - time(), 0)
+        if self.monitored:
+            wait = min(wait, self.problem.stopping_rule.poll_interval)
+        if self.problem.stragglers is not None:
+            wait = min(wait, self.problem.stragglers.poll_interval)
+
+        return wait
+
+    def check(self):
+        """ :returns: True if the training should be stopped """
+        if self.monitored:
+            self.tail.read()
+            self.reason = self.problem.stopping_rule.check(self.tail,
+                                                           self.thresholds)
+
+        if self.reason is None and self.problem.stragglers is not None:
+            self.straggling = self.problem.stragglers.check(
+                self.cwd, self.started, self.straggler_deadline)
+
+        return self.reason is not None or self.straggling is not None or \
+            time() >= self.deadline
+
+    def kill_grace(self):
+        """ :returns: how long, in seconds, the stopped training has to exit
+            after SIGTERM before it's SIGKILLed """
+        if self.straggling is not None:
+            return self.problem.stragglers.kill_grace
+
+        return KILL_GRACE
+
+    def stop(self, command, output):
+        """ Account for the stopped training
+
+        :param command: of the training
+        :param output: TrainingOutput of the training
+        :raises TimeoutError: if it was straggling
+        :raises subprocess.TimeoutExpired: if it ran out of time
+        """
+        worker = get_worker()
+
+        if self.straggling is not None:
+            worker.logger.warning(f'Killed training: {self.straggling}')
+            raise TimeoutError(f'Killed training: {self.straggling}')
+
+        if self.reason is None:
+            raise subprocess.TimeoutExpired(command, self.timeout,
+                                            output.stdout, output.stderr)
+
+        worker.logger.info(f'Early stopping {self.individual.uuid}: '
+                           f'{self.reason}')
+        self.individual.stop_reason = self.reason
+
+    def finish(self):
+        """ Catch anything written to lcurve.out since the last check """
+        if self.monitored:
+            self.tail.read()
+            if self.tail.rows:
+                self.individual.learning_curve = learning_curve(self.tail.rows)
+
+
 class DeepMDProblem(MultiObjectiveProblem):
     """
         deepmd-kit hyperparameter tuning for the water example
@@ -43,21 +173,15 @@ class DeepMDProblem(MultiObjectiveProblem):
 
     BAD_FITNESS = np.iinfo(np.int32).max # how we flag bad fitness values
 
-    COMMAND_STR = ['jsrun', '--smpiargs="-gpu"',
-                   '-e', 'individual', '--stdio_stdout=worker_out.%j.%h.%p',
-                   '--stdio_stderr=worker_error.%j.%h.%p',
-                   '-n', '1',
-                   '-a', '6',
-                   '-c', '40',
-                   '-g', '6',
-                   '-b', 'none', '${BIND}',
-                   '--latency_priority', 'gpu-cpu',
-                   'env', 'OMP_NUM_THREADS=1', # 'TF_NUM_INTRAOP_THREADS=1',
-                   # 'TF_NUM_INTEROP_THREADS=7',
-                   'CUDA_VISIBLE_DEVICES=0,1,2,3,4,5',
-                   'dp', 'train', '--skip-neighbor-stat', 'input.json']
-
-    def __init__(self, run_dir, template, timeout=None, verbose=True, test=False):
+    # How we train; launchers wrap this to run it somewhere
+    DP_COMMAND_STR = ['dp', 'train', '--skip-neighbor-stat', 'input.json']
+
+    def __init__(self, run_dir, template, timeout=None, verbose=True, test=False,
+                 stopping_rule=None, numb_steps=40000, fitness_cache=None,
+                 warm_start=False, warm_start_tolerance=0.1, gpu_slots=None,
+                 output_streaming=None, launcher=None,
+                 learning_curve_store=None, data_staging=None,
+                 stragglers=None, fanout=0):
         """
         :param run_dir: top-level directory in which the main process/script is
             running
@@ -67,6 +191,38 @@ class DeepMDProblem(MultiObjectiveProblem):
         :param verbose: boolean for chatty run-time behavior during eval
         :param test: if true, don't actually invoke dp, but return random fitnesses to test
             the overall EA process
+        :param stopping_rule: optional early_stopping.MedianStoppingRule; if
+            given, lcurve.out is monitored while training and hopeless
+            trainings are stopped early
+        :param numb_steps: number of training steps for a full evaluation;
+            individuals with a `fidelity` are trained for that many steps
+            instead
+        :param fitness_cache: optional cache.FitnessCache that is checked
+            before training, and updated with the fitnesses of new trainings
+        :param warm_start: if true, offspring are trained starting from their
+            parent's model checkpoint when their architectures are compatible
+        :param warm_start_tolerance: maximum relative change in rcut and
+            rcut_smth from the parent's for which we still warm-start
+        :param gpu_slots: optional gpu_slots.GPUSlots; if given, trainings
+            are pinned to a free GPU slot on the worker's node, so the
+            launcher should run `dp` locally
+        :param output_streaming: optional training_output.OutputStreaming;
+            if given, the output of trainings is streamed to rotating files
+            instead of being held in memory and logged in full
+        :param launcher: launchers.Launcher that wraps the `dp train`
+            command; defaults to a whole node per training with jsrun
+        :param learning_curve_store: optional lcurve.LearningCurveStore to
+            which the full learning curve of every training is added
+        :param data_staging: optional staging.DataStaging; if given, the
+            trainings read the training and validation systems from copies
+            on their worker's node
+        :param stragglers: optional stragglers.StragglerPolicy; if given,
+            trainings are killed once they run past the deadline learned from
+            completed trainings or stop making progress
+        :param fanout: if more than 0, individuals are trained in
+            subdirectories of the run directory named after the first
+            `fanout` hex digits of a hash of their UUIDs, so that no one
+            directory has too many entries
         """
         # This is a _minimization_ problem in that we're minimizing the
         # error loss.
@@ -77,16 +233,113 @@ class DeepMDProblem(MultiObjectiveProblem):
         self.timeout = timeout
         self.verbose = verbose
         self.test = test
+        self.stopping_rule = stopping_rule
+        self.numb_steps = numb_steps
+        self.fitness_cache = fitness_cache
+        self.warm_start = warm_start
+        self.warm_start_tolerance = warm_start_tolerance
+        self.gpu_slots = gpu_slots
+        self.output_streaming = output_streaming
+        self.launcher = launcher if launcher is not None else JsrunLauncher()
+        self.learning_curve_store = learning_curve_store
+        self.data_staging = data_staging
+        self.stragglers = stragglers
+        self.fanout = fanout
 
     def check_phenome(self, phenome):
         """ Semantic checking for phenome.
+
+        Offspring are repaired on the client, so this is just a safeguard.
         """
-        assert phenome.start_lr > phenome.stop_lr
-        assert phenome.rcut_smth < phenome.rcut
+        violations = DeepMDDecoder.violations(phenome)
+        assert not violations, '; '.join(violations)
+
+    def subdir_name(self, uuid, numb_steps, attempt=0):
+        """ Name of the sub-directory in which an individual is trained
+
+        This is just the UUID for full trainings, which are what the
+        individual CSV output is usually cross-referenced against.  Reduced
+        fidelity trainings of the same individual get the number of steps
+        tacked on so that they can be told apart, as do speculative
+        re-executions the attempt number.  With a fanout, it's within the
+        subdirectory for the UUID.
+        """
+        name = str(uuid)
+
+        if numb_steps != self.numb_steps:
+            name += f'_{numb_steps}'
+
+        if attempt:
+            name += f'_attempt{attempt}'
 
-    def create_input_json(self, phenome):
+        if self.fanout:
+            digest = hashlib.md5(str(uuid).encode()).hexdigest()
+            name = str(Path(digest[:self.fanout]) / name)
+
+        return name
+
+    def model_dir(self, individual):
+        """ :returns: the directory with the model of an evaluated
+            individual: for a cached fitness, the one it was cached from,
+            which may be in another run, else the one it was trained in """
+        cached_model_dir = getattr(individual, 'cached_model_dir', None)
+        if cached_model_dir:
+            return Path(cached_model_dir)
+
+        # Caches from before model directories were stored only know the
+        # UUID, in this run
+        cached_uuid = getattr(individual, 'cached_uuid', None)
+
+        return Path(self.run_dir) / self.subdir_name(
+            cached_uuid or individual.uuid, individual.numb_steps,
+            0 if cached_uuid else getattr(individual, 'attempt', 0))
+
+    def warm_start_model(self, phenome, individual):
+        """ Find the parent's model checkpoint to warm-start training from
+
+        The activation functions have to be the same as the parent's for its
+        weights to make sense, and the cutoff radii close to the parent's for
+        the descriptor to be comparable.  Everything else we evolve only
+        affects the learning rate schedule.
+
+        :param phenome: of the individual to be trained
+        :param individual: to be trained, which knows its parent
+        :returns: path to the parent's model checkpoint, or None if training
+            should start from scratch
+        """
+        if not self.warm_start or individual is None or \
+                individual.parent_uuid is None:
+            return None
+
+        parent = individual.parent_phenome
+
+        if phenome.desc_activ_func != parent.desc_activ_func or \
+                phenome.fitting_activ_func != parent.fitting_activ_func:
+            return None
+
+        for gene in ('rcut', 'rcut_smth'):
+            if abs(getattr(phenome, gene) - getattr(parent, gene)) > \
+                    self.warm_start_tolerance * getattr(parent, gene):
+                return None
+
+        parent_model_dir = getattr(individual, 'parent_model_dir', None)
+        if parent_model_dir is None:
+            return None
+
+        checkpoint = Path(parent_model_dir) / 'model.ckpt'
+
+        # The parent may have been killed before it saved a checkpoint
+        if not checkpoint.with_name('model.ckpt.index').exists():
+            return None
+
+        return checkpoint
+
+    def create_input_json(self, phenome, numb_steps=None):
         """ Create input.json based on phenome.
         Intended to be overriden by subclasses """
+        if numb_steps is None:
+            numb_steps = self.numb_steps
+
         with open(self.template, 'r') as template_file:
             template = Template(template_file.read())
             out_str = template.substitute(
@@ -97,10 +350,260 @@ class DeepMDProblem(MultiObjectiveProblem):
                 scale_by_worker=phenome.scale_by_worker,
                 desc_activ_func=phenome.desc_activ_func,
                 fitting_activ_func=phenome.fitting_activ_func,
+                numb_steps=numb_steps,
                 seed=random.randrange(sys.maxsize))
+
+        if self.data_staging is not None:
+            params = self.data_staging.localize(json.loads(out_str))
+            out_str = json.dumps(params, indent=2)
+
         return out_str
 
-    def evaluate(self, phenome, uuid):
+    def training_output(self, process, cwd):
+        """ :returns: TrainingOutput draining the process's stdout and stderr,
+            streaming them to files in `cwd` if we're streaming """
+        if self.output_streaming is not None:
+            return self.output_streaming(process, markers=TRAINING_MARKERS,
+                                         directory=cwd)
+
+        return TrainingOutput(process, markers=TRAINING_MARKERS)
+
+    def run_training(self, command, individual, timeout=None, cwd='.'):
+        """ Run the training command in the given directory
+
+        If we have a stopping rule, lcurve.out is tailed while training, and
+        the training is stopped early if the rule says it's hopeless.  If we
+        have a straggler policy, the training is killed if it runs past the
+        policy's deadline or stops making progress.
+
+        :param command: list of command arguments
+        :param individual: being trained, or None; if the training is stopped
+            early, its `stop_reason` is set
+        :param timeout: how long, in minutes, to allow the training, if not
+            the problem's timeout
+        :param cwd: directory in which to train
+        :returns: subprocess.CompletedProcess for the training, with as much
+            of stdout and stderr as we kept in memory
+        """
+        command = ' '.join(command)
+        launched = time()
+
+        # Start a new session so that we can kill the whole process group
+        # spawned by the shell.
+        process = subprocess.Popen(command, shell=True, cwd=cwd,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE,
+                                   text=True, errors='replace',
+                                   start_new_session=True)
+
+        output = self.training_output(process, cwd)
+        watch = TrainingWatch(self, individual, cwd, timeout)
+
+        while True:
+            try:
+                process.wait(timeout=watch.wait())
+                self.join_output(output, individual, launched)
+                break
+            except subprocess.TimeoutExpired:
+                pass
+
+            if watch.check():
+                self.kill(process, watch.kill_grace())
+                self.join_output(output, individual, launched)
+                watch.stop(command, output)
+                break
+
+        watch.finish()
+
+        return subprocess.CompletedProcess(command, process.returncode,
+                                           output.stdout, output.stderr)
+
+    async def run_training_async(self, command, individual, timeout=None,
+                                 cwd='.'):
+        """ Run the training command in the given directory as
+        run_training() does, but waiting on it with asyncio so that other
+        evaluations on the worker can go on meanwhile
+
+        The output is still drained by TrainingOutput's threads, through
+        pipes of our own, and the checks that read files are run in a thread
+        so that a slow filesystem doesn't hold up the event loop.
+        """
+        command = ' '.join(command)
+        launched = time()
+
+        stdout_read, stdout_write = os.pipe()
+        stderr_read, stderr_write = os.pipe()
+
+        try:
+            process = await asyncio.create_subprocess_shell(
+                command, cwd=cwd, stdout=stdout_write, stderr=stderr_write,
+                start_new_session=True)
+        except BaseException:
+            os.close(stdout_read)
+            os.close(stderr_read)
+            raise
+        finally:
+            os.close(stdout_write)
+            os.close(stderr_write)
+
+        streams = SimpleNamespace(stdout=open(stdout_read, errors='replace'),
+                                  stderr=open(stderr_read, errors='replace'))
+        output = self.training_output(streams, cwd)
+        watch = await asyncio.to_thread(TrainingWatch, self, individual, cwd,
+                                        timeout)
+
+        while True:
+            try:
+                await asyncio.wait_for(process.wait(), watch.wait())
+                await asyncio.to_thread(self.join_output, output, individual,
+                                        launched)
+                break
+            except asyncio.TimeoutError:
+                pass
+
+            if await asyncio.to_thread(watch.check):
+                await self.kill_async(process, watch.kill_grace())
+                await asyncio.to_thread(self.join_output, output, individual,
+                                        launched)
+                watch.stop(command, output)
+                break
+
+        await asyncio.to_thread(watch.finish)
+
+        return subprocess.CompletedProcess(command, process.returncode,
+                                           output.stdout, output.stderr)
+
+    @staticmethod
+    def kill(process, grace=KILL_GRACE):
+        """ Terminate the training's process group, and SIGKILL what's left
+        of it after `grace` seconds
+
+        A wedged `dp` or launcher may ignore SIGTERM, and whatever the shell
+        started may outlive it and keep its output pipes open, so we wait on
+        the whole group rather than on the process.
+        """
+        if signal_group(process.pid, signal.SIGTERM):
+            deadline = time() + grace
+            while process.poll() is None or \
+                    signal_group(process.pid, 0):
+                if time() > deadline:
+                    get_worker().logger.warning(
+                        f'Training did not exit within {grace} seconds of '
+                        f'SIGTERM; killing it')
+                    signal_group(process.pid, signal.SIGKILL)
+                    break
+                sleep(0.1)
+
+        process.wait()
+
+    @staticmethod
+    async def kill_async(process, grace=KILL_GRACE):
+        """ kill(), for a process from asyncio """
+        if signal_group(process.pid, signal.SIGTERM):
+            deadline = time() + grace
+            while process.returncode is None or \
+                    signal_group(process.pid, 0):
+                if time() > deadline:
+                    get_worker().logger.warning(
+                        f'Training did not exit within {grace} seconds of '
+                        f'SIGTERM; killing it')
+                    signal_group(process.pid, signal.SIGKILL)
+                    break
+                await asyncio.sleep(0.1)
+
+        await process.wait()
+
+    @staticmethod
+    def join_output(output, individual, launched):
+        """ Wait for the exited training's output to be drained, and record
+        the phases of the training """
+        exited = time()
+        output.join()
+
+        record_training(individual, launched, output.marks, exited)
+        record(individual, 'teardown', exited, time())
+
+    def launch(self, command, uuid, individual=None, timeout=None, cwd='.'):
+        """ Run the training command through the launcher, pinned to a free
+        GPU slot if we have them
+
+        :param command: `dp train` command arguments
+        :param uuid: of the individual being trained
+        :param individual: as for run_training()
+        :param timeout: as for run_training()
+        :param cwd: as for run_training()
+        :returns: subprocess.CompletedProcess from run_training()
+        """
+        if self.gpu_slots is not None:
+            waiting = time()
+            with self.gpu_slots.acquire() as gpu:
+                record(individual, 'gpu_slot', waiting, time())
+                get_worker().logger.info(f'Training {uuid} on GPU {gpu}')
+                return self.run_training(self.gpu_slots.pinning(gpu) +
+                                         self.launcher.command(command),
+                                         individual, timeout, cwd)
+
+        return self.run_training(self.launcher.command(command), individual,
+                                 timeout, cwd)
+
+    async def launch_async(self, command, uuid, individual=None, timeout=None,
+                           cwd='.'):
+        """ launch(), but with run_training_async() """
+        if self.gpu_slots is not None:
+            waiting = time()
+            async with self.gpu_slots.acquire_async() as gpu:
+                record(individual, 'gpu_slot', waiting, time())
+                get_worker().logger.info(f'Training {uuid} on GPU {gpu}')
+                return await self.run_training_async(
+                    self.gpu_slots.pinning(gpu) +
+                    self.launcher.command(command), individual, timeout, cwd)
+
+        return await self.run_training_async(self.launcher.command(command),
+                                             individual, timeout, cwd)
+
+    def smoke_test(self, phenome, uuid, numb_steps=10, timeout=10):
+        """ Train for just a few steps to check that `dp` doesn't crash with
+        the phenome's configuration
+
+        The training is in a `<uuid>_smoke` sub-directory, which is deleted
+        if the training succeeds.
+
+        :param phenome: to be checked
+        :param uuid: of the individual
+        :param numb_steps: how many steps to train for
+        :param timeout: how long, in minutes, to allow the training
+        :returns: None if it trained, else why it didn't
+        """
+        if self.test:
+            return None
+
+        worker = get_worker()
+        subdir = Path(self.run_dir) / f'{uuid}_smoke'
+        subdir.mkdir(parents=True, exist_ok=True)
+
+        try:
+            with open(subdir / 'input.json', 'w') as input_json:
+                input_json.write(self.create_input_json(phenome, numb_steps))
+
+            completed_process = self.launch(DeepMDProblem.DP_COMMAND_STR,
+                                            uuid, timeout=timeout, cwd=subdir)
+        except Exception as e:
+            return f'{type(e).__name__}: {e!s}'
+
+        if completed_process.returncode != 0:
+            stderr = completed_process.stderr.strip().splitlines()
+            return f'dp exited with {completed_process.returncode}: ' \
+                   f'{stderr[-1] if stderr else ""}'
+
+        if not (subdir / 'lcurve.out').exists():
+            return 'dp wrote no lcurve.out'
+
+        worker.logger.debug(f'Smoke test of {uuid} passed')
+        shutil.rmtree(subdir, ignore_errors=True)
+
+        return None
+
+    def evaluate(self, phenome, uuid, individual=None):
         """
         Evaluate the given individual's phenome by running deepmd-kit with those
         parameters substituted in a corresponding input.json file.  The uuid is
@@ -116,30 +619,91 @@ class DeepMDProblem(MultiObjectiveProblem):
         invoke `dp` and then after it's done, we read and slurp in the
         curve output file and return the
 
+        Nothing here changes the working directory, so several evaluations
+        can run at once in the threads of a worker.
+
         :param phenome: [learning rate]
         :param uuid: UUID bound the individual
+        :param individual: optional individual being evaluated, on which we
+            record the number of training steps, the learning curve and why
+            training was stopped early, if it was; if it has a `fidelity`, it
+            is trained for that many steps
         :return: force rmse for last batch training value
         """
+        fitness, subdir, command = self.prepare(phenome, uuid, individual)
+
+        if fitness is not None:
+            return fitness
+
+        worker = get_worker()
+        worker.logger.info(f'About to run for UUID {uuid}')
+        completed_process = self.launch(command, uuid, individual, cwd=subdir)
+        worker.logger.info(f'Finished run for UUID {uuid}')
+
+        return self.collect(phenome, uuid, individual, subdir,
+                            completed_process)
+
+    async def evaluate_async(self, phenome, uuid, individual=None):
+        """ Evaluate as evaluate() does, but as a coroutine on the worker's
+        event loop, so that one worker can drive several trainings without
+        a thread blocked on each
+
+        Writing input.json and reading the results are done in a thread, and
+        the training is waited on with asyncio.
+        """
+        fitness, subdir, command = await asyncio.to_thread(
+            self.prepare, phenome, uuid, individual)
+
+        if fitness is not None:
+            return fitness
+
+        worker = get_worker()
+        worker.logger.info(f'About to run for UUID {uuid}')
+        completed_process = await self.launch_async(command, uuid, individual,
+                                                    cwd=subdir)
+        worker.logger.info(f'Finished run for UUID {uuid}')
+
+        return await asyncio.to_thread(self.collect, phenome, uuid,
+                                       individual, subdir, completed_process)
+
+    def training_steps(self, individual):
+        """ :returns: how many steps the individual is trained for """
+        if individual is not None and individual.fidelity is not None:
+            return individual.fidelity
+
+        return self.numb_steps
+
+    def prepare(self, phenome, uuid, individual=None):
+        """ Get ready to train an individual: check its phenome, look up its
+        fitness in the cache, and write its input.json
+
+        :param phenome: as for evaluate()
+        :param uuid: as for evaluate()
+        :param individual: as for evaluate()
+        :returns: the fitness if there's no need to train, else None, the
+            directory in which to train, and the `dp train` command
+        """
         if phenome is None:
             # More than likely a decoder error occurred
             raise ValueError('phenome was none likely due to decoder error')
 
+        numb_steps = self.training_steps(individual)
+        if individual is not None:
+            individual.numb_steps = numb_steps
+            # Whatever an earlier evaluation of it, such as a lower rung of
+            # successive halving, left behind doesn't apply to this one
+            individual.cached_uuid = None
+            individual.cached_model_dir = None
+            individual.init_model = None
+
         if self.test:
             # Return two random fitnesses so that we can exercise the overall EA process to shake out bugs
-            return np.random.uniform(size=(2,))
-
-        fitness = np.array((DeepMDProblem.BAD_FITNESS, DeepMDProblem.BAD_FITNESS))
+            return np.random.uniform(size=(2,)), None, None
 
         worker = get_worker()
         worker.logger.info(f'Starting evaluate() for {uuid} with '
                            f'genome {phenome!s}')
 
-        # First change to the top-level run-dir to ensure that we're in
-        # the correct starting directory location.  If we didn't do this
-        # there's a chance that all the UUID subdirs would be nested within
-        # one another.
-        os.chdir(self.run_dir)
-
         # The starting learning rate should always be higher than the stopping;
         # if this throws an exception, then this individual is flagged by LEAP
         # as being invalid. This just means the individual still exists, but
@@ -149,50 +713,93 @@ class DeepMDProblem(MultiObjectiveProblem):
         worker.logger.debug('Before check phenome')
         self.check_phenome(phenome)
 
+        # Don't bother training if we already know the fitness of a
+        # practically identical phenome.
+        if self.fitness_cache is not None:
+            with phase(individual, 'cache_lookup'):
+                cached = self.fitness_cache.get(phenome, numb_steps)
+
+            if cached is not None:
+                fitness, cached_uuid, cached_model_dir = cached
+                worker.logger.info(f'Using cached fitness {fitness!s} of '
+                                   f'{cached_uuid} for {uuid}')
+                if individual is not None:
+                    individual.cached_uuid = cached_uuid
+                    individual.cached_model_dir = cached_model_dir
+                return fitness, None, None
+
         # Create subdir in which we'll write all output; the name will
         # be the UUID for this individual so that we can later cross-
         # reference the EA CSV output that has records of all individuals
         # with their respective output directories.  We should *NEVER* write
         # to an existing UUID; doing so indicates a possible error, hence
-        # exist_ok=False.
-        cwd = Path('.').absolute()
-        new_subdir = cwd / str(uuid)
-        new_subdir.mkdir(parents=True, exist_ok=False)
+        # exist_ok=False.  It's absolute, so that neither we nor `dp` depend
+        # on the working directory of the worker.
+        subdir = Path(self.run_dir).absolute() / self.subdir_name(
+            uuid, numb_steps, getattr(individual, 'attempt', 0))
 
-        # Now change into that directory so that everything we do is
-        # written there.
-        os.chdir(new_subdir)
+        with phase(individual, 'input_json'):
+            subdir.mkdir(parents=True, exist_ok=False)
 
-        worker.logger.debug(f'Now in cwd: {os.getcwd()}')
+            # Read and update the JSON input template with the hyperparameter
+            # values associated with this individual.
+            out_str = self.create_input_json(phenome, numb_steps)
 
-        # Read and update the JSON input template with the hyperparameter
-        # values associated with this individual.
-        out_str = self.create_input_json(phenome)
+            with open(subdir / 'input.json', 'w') as input_json:
+                input_json.write(out_str)
 
-        with open('input.json', 'w') as input_json:
-            input_json.write(out_str)
-
-        worker.logger.debug('Wrote input.json')
+        worker.logger.debug(f'Wrote input.json in {subdir}')
 
         # Then shell out and run `dp` pointing it to the input JSON file
         # we generated from the template.
-        worker.logger.info(f'About to run for UUID {uuid}')
-        completed_process = subprocess.run(' '.join(DeepMDProblem.COMMAND_STR),
-                                           shell=True,
-                                           capture_output=True,
-                                           # convert to seconds
-                                           timeout=int(self.timeout) * 60,
-                                           check=False)
-        worker.logger.info(f'Finished run for UUID {uuid}')
+        command = DeepMDProblem.DP_COMMAND_STR
+
+        init_model = self.warm_start_model(phenome, individual)
+        if init_model is not None:
+            worker.logger.info(f'Warm-starting {uuid} from {init_model}')
+            individual.init_model = str(init_model)
+            command = command[:-1] + ['--init-model', str(init_model),
+                                      command[-1]]
+
+        return None, subdir, command
+
+    def collect(self, phenome, uuid, individual, subdir, completed_process):
+        """ Read the fitness of a finished training
+
+        :param phenome: as for evaluate()
+        :param uuid: as for evaluate()
+        :param individual: as for evaluate()
+        :param subdir: in which it was trained
+        :param completed_process: subprocess.CompletedProcess of the training
+        :returns: the fitness
+        """
+        worker = get_worker()
+        numb_steps = self.training_steps(individual)
+        lcurve_file = subdir / 'lcurve.out'
+        fitness = np.array((DeepMDProblem.BAD_FITNESS, DeepMDProblem.BAD_FITNESS))
 
         if hasattr(completed_process, 'stdout'):
-            print(completed_process.stdout, file=sys.stdout, flush=True)
-            print(completed_process.stderr, file=sys.stderr, flush=True)
+            if self.output_streaming is None:
+                # Otherwise the full output is already in dp_stdout.log and
+                # dp_stderr.log, and we only have the tail anyway.
+                print(completed_process.stdout, file=sys.stdout, flush=True)
+                print(completed_process.stderr, file=sys.stderr, flush=True)
 
             worker.logger.info(completed_process.stdout)
             worker.logger.info(completed_process.stderr)
 
-        if hasattr(completed_process, 'returncode') and \
+        reading = time()
+
+        if individual is not None and individual.stop_reason is not None:
+            # We killed the training ourselves, so use the last validation
+            # errors we saw as the fitness.
+            fitness = individual.learning_curve[-1, 1:]
+            worker.logger.info(f'fitness at early stop is {fitness!s}')
+
+            if self.learning_curve_store is not None:
+                self.learning_curve_store.put(subdir.name,
+                                              read_lcurve(lcurve_file))
+        elif hasattr(completed_process, 'returncode') and \
                 completed_process.returncode != 0:
             worker.logger.warning(f'Training failed.  Return '
                                   f'code {completed_process.returncode}')
@@ -212,24 +819,36 @@ class DeepMDProblem(MultiObjectiveProblem):
 
             # If all ran ok, then deepmd-kit should have written all the data
             # to lcurve.out.
-            if not Path('lcurve.out').exists():
+            if not lcurve_file.exists():
                 # Sadly, for some reason, deepmd will just wedge and not run at all
                 # on Summit, thus producing no lcurve.out.
                 worker.logger.error('No lcurve file.')
-                print(f'lcurve.out does not exist. cwd: {os.getcwd()}',
+                print(f'lcurve.out does not exist in {subdir}',
                       file=sys.stderr, flush=True)
+            elif self.stopping_rule is None and \
+                    self.learning_curve_store is None:
+                # Nobody needs the full learning curve, so just return the
+                # last validation data point for the energy and force errors
+                # as the fitness
+                last = read_last_row(lcurve_file)
+                if last is not None:
+                    fitness = np.array((last['rmse_e_val'], last['rmse_f_val']))
+                worker.logger.info(f'fitness is {fitness!s}')
             else:
-                data = np.genfromtxt("lcurve.out", names=True)
+                data = read_lcurve(lcurve_file)
 
-                # return the last validation data point for the force error as the
-                # fitness
-                last_rmse_e_val = data['rmse_e_val'][-1]
-                last_rmse_f_val = data['rmse_f_val'][-1]
-                fitness = np.array((last_rmse_e_val, last_rmse_f_val))
+                if len(data) > 0:
+                    fitness = np.array((data['rmse_e_val'][-1],
+                                        data['rmse_f_val'][-1]))
                 worker.logger.info(f'fitness is {fitness!s}')
 
-        os.chdir(cwd)  # change back to rundir
-        worker.logger.debug(f"Now cwd back to: {os.getcwd()}")
+                if individual is not None and len(data) > 0:
+                    individual.learning_curve = learning_curve(data)
+
+                if self.learning_curve_store is not None:
+                    self.learning_curve_store.put(subdir.name, data)
+
+        record(individual, 'results', reading, time())
 
         if np.isnan(fitness).any() or np.equal(fitness, DeepMDProblem.BAD_FITNESS).any():
             # Raise an exception so that LEAP can make this individual
@@ -237,4 +856,12 @@ class DeepMDProblem(MultiObjectiveProblem):
             # place.
             raise ValueError(f'Unable to evaluate individual {uuid} with fitness {fitness}')
 
+        if self.fitness_cache is not None and \
+                (individual is None or (individual.stop_reason is None and
+                                        individual.init_model is None)):
+            # Fitnesses of early stopped trainings are just for the partial
+            # training, and those of warm-started trainings also depend on
+            # the parent's weights, so neither are cached.
+            self.fitness_cache.put(phenome, numb_steps, fitness, uuid, subdir)
+
         return fitness
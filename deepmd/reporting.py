@@ -1,100 +1,137 @@
 #!/usr/bin/env python3
 """
     Functions for reporting evaluating individuals and populations
+
+    The probes write rows to a results_sink.ResultsSink, which batches the
+    writes; if only given a stream, they write CSV to it as they always have.
 """
-import csv
 import sys
 import traceback
-import traceback
 
 from leap_ec.global_vars import context
 
 from representation import DeepMDRepresentation
 from phenotype import PhenotypeBounds
 from individual import DeepMDIndividual
+from results_sink import CSVSink
+
+# Decoded categorical hyperparameters are strings, the rest are floats.
+CATEGORICAL_GENES = ('scale_by_worker', 'desc_activ_func', 'fitting_activ_func')
+
+# We just want to splice in the phenotypic fields in the middle of the rows.
+# Doing it this way allows us to gradually add new phenotypic fields in one
+# place and have them automatically show up elsewhere.
+PHENOTYPE_COLUMNS = [(name, str if name in CATEGORICAL_GENES else float)
+                     for name in PhenotypeBounds._fields]
+
+# Columns of the population snapshots written by log_pop()
+POP_COLUMNS = [('job', int), ('generation', int), ('uuid', str),
+               ('birth_id', int)] + \
+              PHENOTYPE_COLUMNS + \
+              [('start_eval_time', float), ('stop_eval_time', float),
+               ('energy_fitness', float), ('force_fitness', float),
+               ('hostname', str), ('numb_steps', int), ('is_viable', bool),
+               ('exception', str)]
+
+# Columns of the evaluated individuals written by log_worker_location()
+INDIVIDUAL_COLUMNS = [('job', int), ('hostname', str), ('pid', int),
+                      ('slot', int), ('uuid', str), ('birth_id', int)] + \
+                     PHENOTYPE_COLUMNS + \
+                     [('start_eval_time', float), ('stop_eval_time', float),
+                      ('energy_fitness', float), ('force_fitness', float),
+                      ('stop_reason', str), ('numb_steps', int),
+                      ('cached_uuid', str), ('parent_uuid', str),
+                      ('init_model', str), ('is_viable', bool),
+                      ('exception', str)]
+
+
+def exception_text(individual):
+    """ :returns: the type and message of the exception raised while
+        evaluating the individual, or None if there wasn't one """
+    exception = getattr(individual, 'exception', None)
+
+    if exception is None:
+        return None
+
+    return f'{type(exception).__name__}: {exception!s}'
+
+
+def individual_fields(individual):
+    """ The fields common to all rows about an individual
+
+    :param individual: to be reported on
+    :returns: dict of column name -> value
+    """
+    try:
+        phenome = individual.decoder.decode(individual.genome)._asdict()
+    except Exception as e:
+        traceback.print_exc()
+        phenome = {}
+
+    if type(individual.fitness) == float:
+        # Even though the individuals *should* be a tuple of floats, it
+        # may end up just being a float, likely a NaN if an exception
+        # was thrown during evaluation.  If this is the case, we then
+        # correct the error here by reassigning that single value to
+        # a tuple as originally intended.
+        individual.fitness = (individual.fitness, individual.fitness)
+
+    fields = {'uuid'           : individual.uuid,
+              'birth_id'       : individual.birth_id,
+              'start_eval_time': individual.start_eval_time,
+              'stop_eval_time' : individual.stop_eval_time,
+              'energy_fitness' : individual.fitness[0],
+              'force_fitness'  : individual.fitness[1],
+              'hostname'       : getattr(individual, 'hostname', None),
+              'numb_steps'     : getattr(individual, 'numb_steps', None),
+              'is_viable'      : individual.is_viable,
+              'exception'      : exception_text(individual)}
+
+    for name, _ in PHENOTYPE_COLUMNS:
+        fields[name] = phenome.get(name)
+
+    return fields
 
 
 # TODO convert to by-generation
-def log_pop(job, context, stream=sys.stdout, header=True):
+def log_pop(job, context, stream=sys.stdout, header=True, sink=None):
     """ Log the population to a CSV file for a given interval.
 
     (Lifted from leap_ec.distributed.log and hacked to add scenario column.)
 
     :param job: which job is this in a set of jobs?
     :param context: from which to get the current generation
-    :param stream: open stream to which to write rows
+    :param stream: open stream to which to write rows, if no sink is given
     :param header: True if we want a header for the CSV file
+    :param sink: optional results_sink.ResultsSink to write rows to instead
+        of the stream
     :return: a function for saving regular population snapshots
     """
-    job = job
-    stream = stream
-
-    # We just want to splice in the phenotypic file names in the middle of the
-    # CSV file.  Doing it this way allows us to gradually add new phenotypic
-    # fields in one place and have them automatically show up elsewhere.
-    fieldnames = ['job', 'generation', 'uuid', 'birth_id']
-    fieldnames.extend(PhenotypeBounds._fields)
-    fieldnames.extend(['start_eval_time', 'stop_eval_time', 'energy_fitness',
-                       'force_fitness'])
-
-    writer = csv.DictWriter(stream, fieldnames=fieldnames)
-
-    if header:
-        writer.writeheader()
-        stream.flush()
+    if sink is None:
+        sink = CSVSink(stream, POP_COLUMNS, header=header, flush_rows=1)
 
     def write_pop_update(population):
         """
 
-        :param population: to be written to stream
+        :param population: to be written to the sink
         :return: None
         """
-        nonlocal stream
-        nonlocal writer
+        rows = []
 
         for individual in population:
+            row = individual_fields(individual)
+            row.update(job=job,
+                       generation=context['leap']['generation'])
+            rows.append(row)
 
-            try:
-                phenome = individual.decoder.decode(individual.genome)
-            except Exception as e:
-                traceback.print_exc()
-
-            if type(individual.fitness) == float:
-                # Even though the individuals *should* be a tuple of floats, it
-                # may end up just being a float, likely a NaN if an exception
-                # was thrown during evaluation.  If this is the case, we then
-                # correct the error here by reassigning that single value to
-                # a tuple as originally intended.
-                individual.fitness = (individual.fitness, individual.fitness)
-
-            writer.writerow({'job'                  : job,
-                             'generation'           : context['leap']
-                                                             ['generation'],
-                             'uuid'                 : individual.uuid,
-                             'birth_id'             : individual.birth_id,
-                             'start_lr'             : phenome.start_lr,
-                             'stop_lr'              : phenome.stop_lr,
-                             'rcut'                 : phenome.rcut,
-                             'rcut_smth'            : phenome.rcut_smth,
-                             'scale_by_worker'      : phenome.scale_by_worker,
-                             'desc_activ_func'      : phenome.desc_activ_func,
-                             'fitting_activ_func'   : phenome.fitting_activ_func,
-                             'start_eval_time'      : individual.start_eval_time,
-                             'stop_eval_time'       : individual.stop_eval_time,
-                             'energy_fitness'       : individual.fitness[0],
-                             'force_fitness'        : individual.fitness[1]
-                             })
-
-        # On some systems, such as Summit, we need to force a flush else there
-        # will be no output until the very end of the job.
-        stream.flush()
+        sink.write(rows)
 
         return population
 
     return write_pop_update
 
 
-def log_worker_location(job, stream=sys.stdout, header=True):
+def log_worker_location(job, stream=sys.stdout, header=True, sink=None):
     """
     When debugging dask distribution configurations, this function can be used
     to track what machine and process was used to evaluate a given
@@ -104,76 +141,40 @@ def log_worker_location(job, stream=sys.stdout, header=True):
     leap_ec.distributed.asynchronous.steady_state().
 
     :param job: which job is this in a set of jobs?
-    :param stream: to which we want to write the machine details
+    :param stream: to which we want to write the machine details, if no sink
+        is given
     :param header: True if we want a header for the CSV file
+    :param sink: optional results_sink.ResultsSink to write rows to instead
+        of the stream
     :return: a function for recording where individuals are evaluated
     """
-    job = job
-    stream = stream
-    # We just want to splice in the phenotypic file names in the middle of the
-    # CSV file.  Doing it this way allows us to gradually add new phenotypic
-    # fields in one place and have them automatically show up elsewhere.
-    fieldnames = ['job', 'hostname', 'pid', 'uuid', 'birth_id']
-    fieldnames.extend(PhenotypeBounds._fields)
-    fieldnames.extend(['start_eval_time', 'stop_eval_time', 'energy_fitness',
-                       'force_fitness'])
-
-    writer = csv.DictWriter(stream, fieldnames=fieldnames)
-
-    if header:
-        writer.writeheader()
-        stream.flush()
+    if sink is None:
+        sink = CSVSink(stream, INDIVIDUAL_COLUMNS, header=header,
+                       flush_rows=1)
 
     def write_records(population):
-        """ This writes a row to the CSV for the given individual
+        """ This writes a row for each of the given individuals
 
         evaluate() will tack on the hostname and pid for the individual.  The
         uuid should also be part of the distributed.Individual, too.
 
-        :param population: to be written to stream
+        :param population: to be written to the sink
         :return: None
         """
-        nonlocal stream
-        nonlocal writer
+        rows = []
 
         for individual in population:
-
-            # The first element of the returned phenome after decoding is the
-            # scenario number for the corresponding scenario dictionary stored
-            # in the dask-worker that was initially read from a scenario YAML
-            # configuration file.
-            try:
-                phenome = individual.decoder.decode(individual.genome)
-            except Exception as e:
-                traceback.print_exc()
-
-            if type(individual.fitness) == float:
-                # Even though the individuals *should* be a tuple of floats, it
-                # may end up just being a float, likely a NaN if an exception
-                # was thrown during evaluation.  If this is the case, we then
-                # correct the error here by reassigning that single value to
-                # a tuple as originally intended.
-                individual.fitness = (individual.fitness, individual.fitness)
-
-            writer.writerow({'job'                  : job,
-                             'hostname'             : individual.hostname,
-                             'pid'                  : individual.pid,
-                             'uuid'                 : individual.uuid,
-                             'birth_id'             : individual.birth_id,
-                             'start_eval_time'      : individual.start_eval_time,
-                             'stop_eval_time'       : individual.stop_eval_time,
-                             'start_lr'             : phenome.start_lr,
-                             'stop_lr'              : phenome.stop_lr,
-                             'rcut'                 : phenome.rcut,
-                             'rcut_smth'            : phenome.rcut_smth,
-                             'scale_by_worker'      : phenome.scale_by_worker,
-                             'desc_activ_func'      : phenome.desc_activ_func,
-                             'fitting_activ_func'   : phenome.fitting_activ_func,
-                             'energy_fitness'       : individual.fitness[0],
-                             'force_fitness'        : individual.fitness[1]})
-            # On some systems, such as Summit, we need to force a flush else there
-            # will be no output until the very end of the job.
-            stream.flush()
+            row = individual_fields(individual)
+            row.update(job=job,
+                       pid=getattr(individual, 'pid', None),
+                       slot=getattr(individual, 'slot', None),
+                       stop_reason=getattr(individual, 'stop_reason', None),
+                       cached_uuid=getattr(individual, 'cached_uuid', None),
+                       parent_uuid=getattr(individual, 'parent_uuid', None),
+                       init_model=getattr(individual, 'init_model', None))
+            rows.append(row)
+
+        sink.write(rows)
 
         return population
 
@@ -10,6 +10,17 @@ from individual import DeepMDIndividual
 from phenotype import PhenotypeBounds
 
 
+def create_repaired_vector(bounds):
+    """ Like create_real_vector(), but the genomes are repaired so that they
+    satisfy the constraints between hyperparameters """
+    create = create_real_vector(bounds)
+
+    def create_repaired():
+        return DeepMDDecoder.repair(create())
+
+    return create_repaired
+
+
 class DeepMDRepresentation(Representation):
     """ Encapsulates deepmd-kit internals
     """
@@ -18,6 +29,6 @@ class DeepMDRepresentation(Representation):
 
     def __init__(self):
         super().__init__(
-            initialize=create_real_vector(DeepMDRepresentation.bounds),
+            initialize=create_repaired_vector(DeepMDRepresentation.bounds),
             decoder=DeepMDDecoder(),
             individual_cls=DeepMDIndividual)
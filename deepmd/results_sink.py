@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+    Buffered sinks for the rows written by the reporting probes
+
+    Writing and flushing every row as it's produced means lots of tiny
+    synchronous writes, which are slow on GPFS.  Instead, sinks buffer rows
+    and write them in batches once `flush_rows` rows are buffered or
+    `flush_interval` seconds have passed since the last write, whichever
+    comes first, as well as whenever flush() is called, such as before
+    checkpointing.
+
+    There are two backends:
+
+    - CSVSink -- appends to a CSV file, as the probes always have
+    - SQLiteSink -- appends to a table in an SQLite database, with typed
+      columns, so numbers come back as numbers and missing values as NULL
+
+    Both only ever append, so a crash loses at most the rows that were still
+    buffered, plus for CSV whatever part of the batch being written hadn't
+    reached the file; the last line may then be partial.  SQLiteSink writes
+    each batch in a single transaction, so never leaves a partial batch
+    behind.
+"""
+import csv
+import sqlite3
+from abc import ABC, abstractmethod
+from time import time
+from uuid import UUID
+
+import numpy as np
+
+# SQLite types for the Python column types
+SQLITE_TYPES = {int: 'INTEGER', float: 'REAL', str: 'TEXT', bool: 'INTEGER'}
+
+
+def convert(value, column_type):
+    """ Convert a value to the type of its column, keeping None as None """
+    if value is None:
+        return None
+
+    if isinstance(value, np.generic):
+        value = value.item()
+
+    if isinstance(value, UUID) or column_type is str:
+        return str(value)
+
+    return column_type(value)
+
+
+class ResultsSink(ABC):
+    """ Buffers rows and writes them in batches; backends implement
+    write_rows() and read() """
+
+    def __init__(self, columns, flush_interval=60, flush_rows=100):
+        """
+        :param columns: list of (name, type) for the columns of the rows,
+            where type is int, float, str or bool
+        :param flush_interval: write buffered rows once this many seconds have
+            passed since the last write
+        :param flush_rows: write buffered rows once there are this many
+        """
+        self.columns = list(columns)
+        self.fieldnames = [name for name, _ in self.columns]
+        self.flush_interval = flush_interval
+        self.flush_rows = flush_rows
+        self.buffer = []
+        self.last_flush = time()
+
+    def write(self, rows):
+        """ Buffer rows, writing them if the flush policy says so
+
+        :param rows: iterable of dicts keyed by column name; any other keys
+            are ignored
+        """
+        self.buffer.extend(rows)
+
+        if len(self.buffer) >= self.flush_rows or \
+                time() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """ Write any buffered rows """
+        if self.buffer:
+            self.write_rows(self.buffer)
+            self.buffer = []
+
+        self.last_flush = time()
+
+    @abstractmethod
+    def write_rows(self, rows):
+        """ Actually write the rows """
+
+    @abstractmethod
+    def read(self):
+        """ :returns: list of dicts of all the rows written so far, including
+            any still buffered """
+
+    def close(self):
+        """ Write any buffered rows and release the backend """
+        self.flush()
+
+
+class CSVSink(ResultsSink):
+    """ Append rows to a CSV file """
+
+    def __init__(self, stream, columns, header=True, **kwargs):
+        """
+        :param stream: open text stream to which to write rows
+        :param columns: list of (name, type) for the columns
+        :param header: True if we want a header for the CSV file
+        :param kwargs: flush policy for ResultsSink
+        """
+        super().__init__(columns, **kwargs)
+        self.stream = stream
+        self.writer = csv.writer(stream)
+
+        if header:
+            self.writer.writerow(self.fieldnames)
+            self.stream.flush()
+
+    def write_rows(self, rows):
+        self.writer.writerows([row.get(name) for name in self.fieldnames]
+                              for row in rows)
+
+        # On some systems, such as Summit, we need to force a flush else there
+        # will be no output until the very end of the job.
+        self.stream.flush()
+
+    def read(self):
+        self.flush()
+
+        with open(self.stream.name, 'r', newline='') as csv_file:
+            return list(csv.DictReader(csv_file))
+
+    def close(self):
+        super().close()
+        self.stream.close()
+
+
+class SQLiteSink(ResultsSink):
+    """ Append rows to a table in an SQLite database """
+
+    def __init__(self, path, table, columns, resume=False, timeout=600,
+                 **kwargs):
+        """
+        :param path: to the SQLite database file, which is created if it
+            doesn't exist; it can be shared by several sinks with different
+            tables
+        :param table: name of the table, which is created if it doesn't exist
+        :param columns: list of (name, type) for the columns
+        :param resume: if True, append to an existing table rather than
+            emptying it first
+        :param timeout: how long, in seconds, to wait on a locked database
+        :param kwargs: flush policy for ResultsSink
+        """
+        super().__init__(columns, **kwargs)
+        self.path = str(path)
+        self.table = table
+        self.timeout = timeout
+
+        schema = ', '.join(f'{name} {SQLITE_TYPES[column_type]}'
+                           for name, column_type in self.columns)
+        self.insert = f'INSERT INTO {table} ({", ".join(self.fieldnames)}) ' \
+                      f'VALUES ({", ".join("?" * len(self.fieldnames))})'
+
+        self.execute(f'CREATE TABLE IF NOT EXISTS {table} ({schema})')
+        if not resume:
+            self.execute(f'DELETE FROM {table}')
+
+    def execute(self, sql, parameters=()):
+        """ Execute SQL statements in their own transaction
+
+        Like cache.FitnessCache, we connect every time rather than holding on
+        to a connection so that we don't hold locks between batches.
+
+        :param sql: statement
+        :param parameters: for the statement, or a list of them in which case
+            the statement is executed once for each
+        :returns: all the rows of the result, as dicts
+        """
+        connection = sqlite3.connect(self.path, timeout=self.timeout)
+        connection.row_factory = sqlite3.Row
+        try:
+            with connection:
+                if isinstance(parameters, list):
+                    connection.executemany(sql, parameters)
+                    return []
+                return [dict(row) for row
+                        in connection.execute(sql, parameters).fetchall()]
+        finally:
+            connection.close()
+
+    def write_rows(self, rows):
+        self.execute(self.insert,
+                     [tuple(convert(row.get(name), column_type)
+                            for name, column_type in self.columns)
+                      for row in rows])
+
+    def read(self):
+        self.flush()
+
+        return self.execute(f'SELECT * FROM {self.table} ORDER BY rowid')
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+    Retention of the training directories of a run
+
+    Every evaluation leaves a directory in the run directory with its
+    input.json, lcurve.out, logs, and model.ckpt* files, which over a run is
+    tens of thousands of files on GPFS, and the metadata load slows down
+    every worker's file operations.  Only the directories of the current
+    population, whose offspring may be warm-started from their models, and
+    of the Pareto archive, whose models are what a run is for, need to stay
+    as they are.
+
+    Retention is a probe for newly evaluated individuals that records their
+    directories.  At the end of every generation, compact() packs those that
+    were evaluated at least `grace` generations ago and are neither in the
+    population nor the archive into `compacted/generation_NNNNN.tar.gz`,
+    leaving out their model checkpoints unless `keep_checkpoints`, and then
+    removes them.  The packing is done by a background thread, so the EA
+    doesn't wait on it.  Directories that are still kept are checked again
+    every generation, so archive members are compacted once they're
+    dominated.
+
+    The directories still to be compacted are saved to a small JSON file
+    whenever they change, so a resumed run carries on with them; any that
+    were being packed when the run was killed are packed again.
+
+    DeepMDProblem can also spread the training directories over `16^fanout`
+    subdirectories named after the first hex digits of a hash of their UUIDs,
+    so that no directory holds more than a few hundred entries.
+"""
+import fnmatch
+import json
+import logging
+import os
+import shutil
+import tarfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from leap_ec.global_vars import context
+
+logger = logging.getLogger(__name__)
+
+# Files of a training directory that make up its model checkpoint
+CHECKPOINT_FILES = ('model.ckpt*', 'checkpoint')
+
+
+class Retention:
+    """ Packs away the training directories that are no longer needed """
+
+    def __init__(self, directory, state_file, problem, archive=None, grace=1,
+                 keep_checkpoints=False, resume=False, context=context):
+        """
+        :param directory: in which to write the tarballs
+        :param state_file: JSON file of the directories still to be compacted
+        :param problem: being solved, which knows where individuals are
+            trained
+        :param archive: optional archive.ParetoArchive whose members'
+            directories are kept
+        :param grace: minimum number of generations after being evaluated
+            before a directory is compacted, so that offspring already bred
+            from an individual can still be warm-started from its model
+        :param keep_checkpoints: if True, the model checkpoints are packed
+            too, rather than deleted
+        :param resume: if True, carry on with the directories in the state
+            file, if any
+        :param context: for the current generation
+        """
+        self.directory = Path(directory)
+        self.state_file = Path(state_file)
+        self.problem = problem
+        self.archive = archive
+        self.grace = grace
+        self.keep_checkpoints = keep_checkpoints
+        self.context = context
+
+        # Directory name, relative to the run directory -> generation it was
+        # evaluated in
+        self.pending = {}
+        # Those being packed
+        self.compacting = {}
+
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1,
+                                           thread_name_prefix='retention')
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        if resume and self.state_file.exists():
+            self.load()
+
+    def generation(self):
+        """ :returns: the current generation """
+        return self.context['leap'].get('generation', 0)
+
+    def names(self, individual):
+        """ :returns: names of the directories the individual may have been
+            trained in, relative to the run directory """
+        if getattr(individual, 'cached_uuid', None) or \
+                getattr(individual, 'numb_steps', None) is None:
+            # Nothing was trained
+            return []
+
+        attempt = getattr(individual, 'attempt', 0)
+        names = [self.problem.subdir_name(individual.uuid,
+                                          individual.numb_steps, attempt)]
+
+        # A speculative re-execution leaves the losing attempt's directory
+        other = self.problem.subdir_name(individual.uuid,
+                                         individual.numb_steps, 1 - attempt)
+        if (Path(self.problem.run_dir) / other).exists():
+            names.append(other)
+
+        return names
+
+    def kept(self, population):
+        """ :returns: paths of the directories of the population and archive
+        """
+        kept = set()
+
+        for individual in population:
+            numb_steps = getattr(individual, 'numb_steps', None)
+            if numb_steps is None:
+                continue
+
+            # Individuals with cached fitnesses use the model they were
+            # cached from, as their offspring do
+            kept.add(self.problem.model_dir(individual).absolute())
+
+        if self.archive is not None:
+            kept.update(Path(model_dir).absolute()
+                        for model_dir in self.archive.model_dirs())
+
+        return kept
+
+    def __call__(self, population):
+        """ Record the directories of newly evaluated individuals
+
+        :param population: newly evaluated individuals
+        :returns: the same population
+        """
+        generation = self.generation()
+
+        with self.lock:
+            for individual in population:
+                for name in self.names(individual):
+                    self.pending.setdefault(name, generation)
+
+            self.save()
+
+        return population
+
+    def compact(self, population):
+        """ Start packing the directories that are no longer needed
+
+        :param population: current population, whose directories are kept
+        :returns: the same population
+        """
+        generation = self.generation()
+        kept = self.kept(population)
+
+        with self.lock:
+            names = [name for name, evaluated in self.pending.items()
+                     if evaluated <= generation - self.grace and
+                     (Path(self.problem.run_dir) / name).absolute()
+                     not in kept]
+
+            if not names:
+                return population
+
+            for name in names:
+                self.compacting[name] = self.pending.pop(name)
+
+            self.save()
+
+        self.executor.submit(self.pack, names, generation)
+
+        return population
+
+    def tarball(self, generation):
+        """ :returns: a path for the tarball of the generation that isn't
+            taken yet """
+        path = self.directory / f'generation_{generation:05d}.tar.gz'
+
+        i = 0
+        while path.exists():
+            i += 1
+            path = self.directory / f'generation_{generation:05d}_{i}.tar.gz'
+
+        return path
+
+    def exclude(self, tar_info):
+        """ tarfile filter that leaves out model checkpoints """
+        if not self.keep_checkpoints and \
+                any(fnmatch.fnmatch(Path(tar_info.name).name, pattern)
+                    for pattern in CHECKPOINT_FILES):
+            return None
+
+        return tar_info
+
+    def pack(self, names, generation):
+        """ Pack directories into a tarball and remove them; run in the
+        background
+
+        :param names: of the directories, relative to the run directory
+        :param generation: in which they were compacted
+        """
+        try:
+            directories = [Path(self.problem.run_dir) / name for name in names]
+            directories = [directory for directory in directories
+                           if directory.is_dir() and
+                           not directory.is_symlink()]
+
+            if directories:
+                path = self.tarball(generation)
+                tmp_path = path.with_name(f'.{path.name}.tmp')
+
+                with tarfile.open(tmp_path, 'w:gz') as tarball:
+                    for directory in directories:
+                        tarball.add(directory, arcname=directory.name,
+                                    filter=self.exclude)
+
+                os.replace(tmp_path, path)
+
+                for directory in directories:
+                    shutil.rmtree(directory, ignore_errors=True)
+
+                logger.info(f'Compacted {len(directories)} training '
+                            f'directories into {path}')
+        except Exception:
+            logger.exception(f'Failed to compact {len(names)} training '
+                             f'directories')
+
+            # Try them again next generation
+            with self.lock:
+                for name in names:
+                    self.pending[name] = self.compacting.pop(name)
+                self.save()
+        else:
+            with self.lock:
+                for name in names:
+                    del self.compacting[name]
+                self.save()
+
+    def close(self):
+        """ Wait for the packing still going on """
+        self.executor.shutdown(wait=True)
+
+    def save(self):
+        """ Atomically save the directories still to be compacted; the lock
+        should be held """
+        tmp_file = self.state_file.with_name(f'.{self.state_file.name}.tmp')
+
+        with open(tmp_file, 'w') as state_file:
+            json.dump(dict(self.pending, **self.compacting), state_file)
+
+        os.replace(tmp_file, self.state_file)
+
+    def load(self):
+        """ Carry on with the saved directories """
+        with open(self.state_file, 'r') as state_file:
+            self.pending = json.load(state_file)
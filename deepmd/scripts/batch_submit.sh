@@ -8,7 +8,7 @@
 #BSUB -J bif135-1-issue-18
 #BSUB -o out.deepmd.%J
 #BSUB -e err.deepmd.%J
-#BSUB -alloc_flags "gpumps"
+#BSUB -alloc_flags "gpumps nvme"
 #BSUB -B
 #BSUB -N
 
@@ -46,7 +46,8 @@ PYTHONPATH=${SRC_DIR}:$PYTHONPATH
 
 # Copy over the hosts allocated for this job so that we can later verify
 # that all the allocated nodes were busy with the correct worker allocation.
-# Catches both the batch and compute nodes.
+# Catches both the batch and compute nodes.  utilization.py --hosts reports
+# on any that were never used.
 cat $LSB_DJOB_HOSTFILE | sort | uniq > $LSB_JOBID.hosts
 
 # We need to figure out the number of nodes to later spawn the workers
@@ -59,6 +60,41 @@ export NUM_NODES=$(expr $NUM_NODES - 1)
 #let "nWORKERS=NUM_NODES*6"
 #export nWORKERS=$nWORKERS
 export nWORKERS=$NUM_NODES
+
+# Uncomment to pack TRAININGS_PER_GPU single-GPU trainings onto each GPU
+# instead of giving each training a whole node; see gpu_slots in
+# config/general.yaml.  More than one training per GPU relies on gpumps above.
+#export GPU_SLOTS_ENABLED=True
+#export TRAININGS_PER_GPU=1
+# Uncomment to have each worker process run TRAININGS_PER_WORKER of those
+# trainings at once, which should divide 6 * TRAININGS_PER_GPU; see
+# evaluation in config/general.yaml.
+#export TRAININGS_PER_WORKER=1
+# Uncomment to also keep dp warm between trainings on each GPU; see
+# warm_trainer.py.
+#export WARM_TRAINERS=True
+if [ "${GPU_SLOTS_ENABLED:-False}" = "True" ]
+then
+	export nWORKERS=$(expr $NUM_NODES \* 6 \* ${TRAININGS_PER_GPU:-1})
+	export LAUNCHER=local
+	if [ "${WARM_TRAINERS:-False}" = "True" ]
+	then
+		export LAUNCHER=warm
+	fi
+fi
+
+# Uncomment to split the nodes between ISLANDS independent populations, each
+# with its own scheduler, workers and client, that exchange migrants; see
+# islands in config/general.yaml.
+#export ISLANDS=4
+export ISLANDS=${ISLANDS:-1}
+if [ $ISLANDS -gt 1 ]
+then
+	export ISLANDS_ENABLED=True
+fi
+export NODES_PER_ISLAND=$(expr $NUM_NODES / $ISLANDS)
+export nWORKERS=$(expr $nWORKERS / $ISLANDS)
+
 export CUDA_VISIBLE_DEVICES=0,1,2,3,4,5
 export OMP_NUM_THREADS=1
 export NUMEXPR_MAX_THREADS=16
@@ -77,6 +113,7 @@ echo "OMP_NUM_THREADS: $OMP_NUM_THREADS"
 echo "NUMEXPR_MAX_THREADS: $NUMEXPR_MAX_THREADS"
 echo "Number of nodes: $NUM_NODES"
 echo "Number of workers: $nWORKERS"
+echo "Number of islands: $ISLANDS"
 echo "##########################################################################"
 
 # gathering process ids for each step of the workflow.
@@ -84,25 +121,55 @@ echo "##########################################################################
 # jskillall won't work
 dask_pids=""
 
-# Yes, running the scheduler on the batch node and not on some arbitrary compute
-# node CPU. This allows for a homogenous compute node CPU allocation.  I.e.,
-# if we did run the scheduler on a compute node, that's *one* node that will
-# have so many cores running the scheduler, which means that the same number of
-# cores on other nodes will be idle.
-jsrun  --smpiargs="off" --gpu_per_rs 0 --nrs 1 --tasks_per_rs 1 --cpu_per_rs 2 --rs_per_host 1 dask scheduler --interface ib0 --no-dashboard --idle-timeout 600 --no-jupyter --no-show --scheduler-file $SCHEDULER_FILE > dask-scheduler.out 2>&1 &
-dask_pids="$dask_pids $!"
-
-# Give the scheduler a chance to spin up.
-sleep 5
-
-# Now launch ALL the dask workers simultaneously.  They won't come up at the
-# same time, though.  jsrun will be subprocess calls in Problem.evaluate() to
-# get around stupid Summit/horovod MPI reset problem.
-for ((i = 0; i < $NUM_NODES; i++)); do
-  dask worker --nthreads 1 --nworkers 1 --interface ib0 \
-  --no-dashboard --reconnect --scheduler-file $SCHEDULER_FILE &
+# Start a scheduler and NODES_PER_ISLAND nodes of workers using the given
+# scheduler file
+start_dask() {
+  scheduler_file=$1
+
+  # Yes, running the scheduler on the batch node and not on some arbitrary
+  # compute node CPU. This allows for a homogenous compute node CPU
+  # allocation.  I.e., if we did run the scheduler on a compute node, that's
+  # *one* node that will have so many cores running the scheduler, which
+  # means that the same number of cores on other nodes will be idle.
+  jsrun  --smpiargs="off" --gpu_per_rs 0 --nrs 1 --tasks_per_rs 1 --cpu_per_rs 2 --rs_per_host 1 dask scheduler --interface ib0 --no-dashboard --idle-timeout 600 --no-jupyter --no-show --scheduler-file $scheduler_file > $(dirname $scheduler_file)/dask-scheduler.out 2>&1 &
   dask_pids="$dask_pids $!"
-done
+
+  # Give the scheduler a chance to spin up.
+  sleep 5
+
+  # Now launch ALL the dask workers simultaneously.  They won't come up at the
+  # same time, though.  jsrun will be subprocess calls in Problem.evaluate() to
+  # get around stupid Summit/horovod MPI reset problem.
+  if [ "${GPU_SLOTS_ENABLED:-False}" = "True" ]
+  then
+    # With GPU slots, the workers run on the compute nodes, a thread per slot,
+    # and launch their trainings directly.
+    jsrun --smpiargs="off" --nrs $NODES_PER_ISLAND --rs_per_host 1 --tasks_per_rs 1 \
+    --cpu_per_rs 42 --gpu_per_rs 6 --bind none \
+    dask worker --nthreads ${TRAININGS_PER_WORKER:-1} \
+    --nworkers $(expr 6 \* ${TRAININGS_PER_GPU:-1} / ${TRAININGS_PER_WORKER:-1}) \
+    --resources "GPU_SLOT=${TRAININGS_PER_WORKER:-1}" --interface ib0 \
+    --no-dashboard --reconnect --scheduler-file $scheduler_file &
+    dask_pids="$dask_pids $!"
+  else
+    for ((i = 0; i < $NODES_PER_ISLAND; i++)); do
+      dask worker --nthreads 1 --nworkers 1 --interface ib0 \
+      --no-dashboard --reconnect --scheduler-file $scheduler_file &
+      dask_pids="$dask_pids $!"
+    done
+  fi
+}
+
+if [ $ISLANDS -gt 1 ]
+then
+  # Each island has its own scheduler in its own subdirectory
+  for ((island = 0; island < $ISLANDS; island++)); do
+    mkdir -p ${RUN_DIR}/island_${island}
+    start_dask ${RUN_DIR}/island_${island}/scheduler_file.json
+  done
+else
+  start_dask $SCHEDULER_FILE
+fi
 
 # Hopefully long enough for some workers to spin up and wait for work
 echo Waiting for workers
@@ -111,8 +178,26 @@ sleep 5
 # TODO Do we still need this nonsense?
 export BIND="${SRC_DIR}/scripts/bind.sh --cpu=${SRC_DIR}/scripts/summit_map.sh --mem=${SRC_DIR}/scripts/summit_map.sh --"
 
+# To resume a run that was killed by the walltime limit, point RESUME_FROM at
+# the checkpoint in the killed job's run directory.
+#export RESUME_FROM=/gpfs/alpine/proj-shared/chm187/runs/18-new-runs-with-repaired-training-data/<old job ID>/checkpoint.pkl
+# With islands, point it at the killed job's run directory instead.
+#export RESUME_FROM=/gpfs/alpine/proj-shared/chm187/runs/18-new-runs-with-repaired-training-data/<old job ID>
+
 # Run the dask client task manager on the launch/batch node with a single core.
-python3 ${SRC_DIR}/deepmd-tuner.py ${SRC_DIR}/config/general.yaml ${SRC_DIR}/config/summit.yaml # ${SRC_DIR}/config/debug.yaml
+if [ $ISLANDS -gt 1 ]
+then
+  # One client per island, each resuming from its own checkpoint, if any
+  client_pids=""
+  for ((island = 0; island < $ISLANDS; island++)); do
+    SCHEDULER_FILE=${RUN_DIR}/island_${island}/scheduler_file.json \
+    python3 ${SRC_DIR}/deepmd-tuner.py --island $island ${RESUME_FROM:+--resume $RESUME_FROM/island_${island}/checkpoint.pkl} ${SRC_DIR}/config/general.yaml ${SRC_DIR}/config/summit.yaml > island_${island}/client.out 2>&1 &
+    client_pids="$client_pids $!"
+  done
+  wait $client_pids
+else
+  python3 ${SRC_DIR}/deepmd-tuner.py ${RESUME_FROM:+--resume $RESUME_FROM} ${SRC_DIR}/config/general.yaml ${SRC_DIR}/config/summit.yaml # ${SRC_DIR}/config/debug.yaml
+fi
 
 # shutting down dask scheduler and worker commands
 # needed because these are running on the launch/batch nodes rather than through jsrun
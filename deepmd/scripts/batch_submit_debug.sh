@@ -47,7 +47,8 @@ PYTHONPATH=${SRC_DIR}:$PYTHONPATH
 
 # Copy over the hosts allocated for this job so that we can later verify
 # that all the allocated nodes were busy with the correct worker allocation.
-# Catches both the batch and compute nodes.
+# Catches both the batch and compute nodes.  utilization.py --hosts reports
+# on any that were never used.
 cat $LSB_DJOB_HOSTFILE | sort | uniq > $LSB_JOBID.hosts
 
 # We need to figure out the number of nodes to later spawn the workers
@@ -24,6 +24,10 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 import pandas as pd
 
+# For lcurve.py
+sys.path.append(str(Path(__file__).parent.parent))
+from lcurve import read_lcurve
+
 
 def usage():
     usage_text = """
@@ -46,7 +50,7 @@ if __name__ == '__main__':
 
     # matplotlib.use('pdf', force=True)
 
-    lcurve = np.genfromtxt("lcurve.out", names=True)
+    lcurve = read_lcurve('lcurve.out')
 
     rmse_e_trn_df = \
         pd.DataFrame({'value': lcurve['rmse_e_trn'],
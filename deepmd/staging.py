@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+    Staging the training and validation systems to node-local storage
+
+    The template's `training_data.systems` and `validation_data.systems` are
+    on GPFS, so without staging every concurrent training reads the same
+    files from the shared filesystem, all at once at every generation
+    boundary.  DataStaging is a dask worker plugin that copies each system to
+    a node-local directory, such as NVMe or /tmp, once per node, and
+    DeepMDProblem then points the trainings at the local copies.
+
+    - The first worker on a node to need a system copies it while holding
+      a lock on a node-local file, so the other workers on the node wait for
+      it rather than copying it again.
+    - Files are copied to a temporary directory and then checksummed against
+      the SHA-256 of what was read from the source.  A manifest of the
+      checksums is written last, and the directory is then renamed into
+      place, so a copy is either complete and verified or ignored.
+    - Each worker using a node's copies holds a reference, a file named for
+      its host and pid.  The copies are deleted when the last worker tears
+      down, and references of workers that died are ignored.
+
+    Staging only helps if trainings run on the worker's node, such as with
+    GPU slots; with jsrun, trainings run on other nodes than the workers.
+"""
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import platform
+import shutil
+from contextlib import contextmanager
+from pathlib import Path
+from string import Template
+
+from distributed import WorkerPlugin
+
+logger = logging.getLogger(__name__)
+
+# The data sections of the deepmd-kit input with systems to stage
+DATA_SECTIONS = ('training_data', 'validation_data')
+
+# Read and write files in chunks of this many bytes
+CHUNK_SIZE = 1 << 24
+
+
+def template_systems(template):
+    """ Find the systems in a deepmd-kit input template
+
+    :param template: path to the input JSON template
+    :returns: list of the system paths
+    """
+    with open(template, 'r') as template_file:
+        # Values don't matter, but the template has to be valid JSON
+        params = json.loads(Template(template_file.read()).substitute(
+            DefaultValues()))
+
+    return [system for _, system in input_systems(params)]
+
+
+class DefaultValues(dict):
+    """ Substitute 0 for every template placeholder """
+
+    def __missing__(self, key):
+        return 0
+
+
+def input_systems(params):
+    """ :returns: list of (data section, system) for every system in the
+        deepmd-kit input """
+    training = params.get('training', {})
+    systems = []
+
+    for section in DATA_SECTIONS:
+        section_systems = training.get(section, {}).get('systems', [])
+        if isinstance(section_systems, str):
+            section_systems = [section_systems]
+        systems.extend((section, system) for system in section_systems)
+
+    return systems
+
+
+def copy_file(source, destination):
+    """ Copy a file
+
+    :returns: SHA-256 of what was read from the source
+    """
+    digest = hashlib.sha256()
+
+    with open(source, 'rb') as source_file, \
+            open(destination, 'wb') as destination_file:
+        while chunk := source_file.read(CHUNK_SIZE):
+            digest.update(chunk)
+            destination_file.write(chunk)
+
+    return digest.hexdigest()
+
+
+def checksum(path):
+    """ :returns: SHA-256 of the file """
+    digest = hashlib.sha256()
+
+    with open(path, 'rb') as file:
+        while chunk := file.read(CHUNK_SIZE):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+class DataStaging(WorkerPlugin):
+    """ Stage systems to node-local storage once per node """
+
+    name = 'deepmd-data-staging'
+
+    MANIFEST = 'MANIFEST.json'
+
+    def __init__(self, local_dir, systems=(), cleanup=True):
+        """
+        :param local_dir: node-local directory for the copies
+        :param systems: paths of the systems to stage as soon as a worker
+            starts; any other systems are staged the first time they're used
+        :param cleanup: if True, the copies are deleted when the last worker
+            on the node using them tears down
+        """
+        self.local_dir = Path(local_dir)
+        self.systems = list(systems)
+        self.cleanup = cleanup
+
+    def setup(self, worker):
+        """ Take a reference to this node's copies, and stage the systems """
+        self.reference().parent.mkdir(parents=True, exist_ok=True)
+        self.reference().touch()
+
+        for system in self.systems:
+            try:
+                self.stage(system, verify=True)
+            except Exception as e:
+                # Trainings can still read the originals
+                logger.warning(f'Could not stage {system}: {e!s}')
+
+    def teardown(self, worker):
+        """ Drop our reference, and delete the copies if it was the last """
+        with self.lock():
+            self.reference().unlink(missing_ok=True)
+
+            if self.cleanup and not self.live_references():
+                logger.info(f'Deleting staged systems in {self.local_dir}')
+                for copy in self.local_dir.glob('[!.]*'):
+                    if copy.is_dir() and copy.name != 'references':
+                        shutil.rmtree(copy, ignore_errors=True)
+
+    def reference(self):
+        """ :returns: the reference file for this worker process """
+        return self.local_dir / 'references' / \
+            f'{platform.node()}.{os.getpid()}'
+
+    def live_references(self):
+        """ :returns: references of workers on this node that are alive """
+        live = []
+
+        for reference in (self.local_dir / 'references').glob('*'):
+            host, _, pid = reference.name.rpartition('.')
+            try:
+                if host == platform.node():
+                    os.kill(int(pid), 0)
+                live.append(reference)
+            except (ProcessLookupError, ValueError):
+                reference.unlink(missing_ok=True)
+            except PermissionError:
+                live.append(reference)
+
+        return live
+
+    @contextmanager
+    def lock(self):
+        """ Hold the node-wide staging lock for the context """
+        self.local_dir.mkdir(parents=True, exist_ok=True)
+
+        with open(self.local_dir / '.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def local_copy(self, system):
+        """ :returns: where the given system is copied to """
+        source = Path(system).absolute()
+        key = hashlib.sha1(str(source).encode()).hexdigest()[:12]
+
+        return self.local_dir / key / source.name
+
+    def verify(self, copy):
+        """ :returns: True if the copy matches its manifest """
+        manifest_file = copy.parent / DataStaging.MANIFEST
+
+        if not manifest_file.exists():
+            return False
+
+        with open(manifest_file, 'r') as manifest:
+            checksums = json.load(manifest)['checksums']
+
+        return all((copy / name).exists() and checksum(copy / name) == digest
+                   for name, digest in checksums.items())
+
+    def stage(self, system, verify=False):
+        """ Copy a system to node-local storage, if it isn't already
+
+        :param system: path to the system directory
+        :param verify: if True, check any existing copy against its manifest's
+            checksums, and copy it again if it doesn't match
+        :returns: path of the local copy
+        """
+        copy = self.local_copy(system)
+
+        with self.lock():
+            if (copy.parent / DataStaging.MANIFEST).exists():
+                if not verify or self.verify(copy):
+                    return copy
+
+                logger.warning(f'Staged copy {copy} is corrupted, so copying '
+                               f'{system} again')
+                shutil.rmtree(copy.parent)
+
+            if not Path(system).is_dir():
+                raise FileNotFoundError(f'No system directory {system}')
+
+            logger.info(f'Staging {system} to {copy}')
+            tmp_dir = copy.parent.with_name(f'.{copy.parent.name}.tmp')
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+            checksums = {}
+            for source in Path(system).rglob('*'):
+                if source.is_dir():
+                    continue
+
+                name = str(source.relative_to(system))
+                destination = tmp_dir / copy.name / name
+                destination.parent.mkdir(parents=True, exist_ok=True)
+                checksums[name] = copy_file(source, destination)
+
+            staged = tmp_dir / copy.name
+            for name, digest in checksums.items():
+                if checksum(staged / name) != digest:
+                    shutil.rmtree(tmp_dir)
+                    raise IOError(f'Checksum mismatch for {name} of {system}')
+
+            with open(tmp_dir / DataStaging.MANIFEST, 'w') as manifest:
+                json.dump({'source': str(Path(system).absolute()),
+                           'checksums': checksums}, manifest)
+
+            tmp_dir.rename(copy.parent)
+
+        return copy
+
+    def localize(self, params):
+        """ Point the systems of a deepmd-kit input at their local copies
+
+        Systems that can't be staged are left pointing at the originals.
+
+        :param params: deepmd-kit input, which is modified in place
+        :returns: the same params
+        """
+        training = params.get('training', {})
+
+        for section in DATA_SECTIONS:
+            data = training.get(section, {})
+            systems = data.get('systems')
+            if systems is None:
+                continue
+
+            local_systems = []
+            for system in ([systems] if isinstance(systems, str) else systems):
+                try:
+                    local_systems.append(str(self.stage(system)))
+                except Exception as e:
+                    logger.warning(f'Could not stage {system}: {e!s}')
+                    local_systems.append(system)
+
+            data['systems'] = local_systems[0] \
+                if isinstance(systems, str) else local_systems
+
+        return params
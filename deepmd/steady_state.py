@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+    Asynchronous steady-state NSGA-II for deepmd-tuner.py
+
+    The generational EA in deepmd-tuner.py waits for the slowest `dp train`
+    of each generation before any new offspring are created, which leaves
+    most of the GPUs idle when training times vary across hyperparameter
+    settings.  Here, instead, each newly evaluated individual is inserted into
+    the population as soon as it is done, and a new offspring is immediately
+    dispatched to the freed worker.
+
+    This is built on leap_ec.distrib.asynchronous.  Since re-sorting the
+    whole population on every insertion is wasteful, NSGA2Inserter keeps the
+    population partitioned into non-dominated layers and only updates the
+    ranks and crowding distances of the layers affected by an insertion.
+"""
+import logging
+
+import toolz
+
+from leap_ec import util
+from leap_ec.global_vars import context
+
+from evaluation import as_completed, create_evaluator
+from phases import submitted
+from selection import crowding_distance
+
+logger = logging.getLogger(__name__)
+
+
+class NSGA2Inserter:
+    """ Incrementally maintains NSGA-II ranks and crowding distances
+
+    The population is kept as a list of non-dominated layers, or fronts,
+    where layer i holds the individuals of rank i + 1.  An inserted individual
+    is placed in the first layer in which nothing dominates it, and the
+    members of that layer it dominates are pushed down a layer, possibly
+    cascading further down.  This is a simplification of the ENLU approach:
+
+    - K. Li, K. Deb, Q. Zhang and Q. Zhang, "Efficient Nondomination Level
+      Update Method for Steady-State Evolutionary Multiobjective
+      Optimization," in IEEE Transactions on Cybernetics, vol. 47, no. 9,
+      pp. 2838-2849, Sept. 2017, doi: 10.1109/TCYB.2016.2621008.
+
+    If the population is over capacity, the most crowded individual in the
+    last layer is dropped, which is the same individual NSGA-II truncation
+    selection would have dropped.
+
+    Instances are suitable as the `inserter` for
+    leap_ec.distrib.asynchronous.steady_state().
+    """
+
+    def __init__(self):
+        # The "real" population, by layer; the flat population handed to us
+        # is rewritten from this after every insertion.
+        self.layers = []
+
+    def _find_start_layer(self, individual):
+        """ Binary search for the first layer not dominating `individual`
+
+        This works because if a layer dominates `individual`, so does every
+        layer before it.
+        """
+        lo, hi = 0, len(self.layers)
+
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if any(other > individual for other in self.layers[mid]):
+                lo = mid + 1
+            else:
+                hi = mid
+
+        return lo
+
+    def insert(self, individual):
+        """ Insert `individual`, updating ranks and crowding distances
+
+        :param individual: newly evaluated individual
+        :returns: None
+        """
+        start = self._find_start_layer(individual)
+        moving = [individual]
+        depth = start
+
+        while moving and depth < len(self.layers):
+            dominated = [other for other in self.layers[depth]
+                         if any(m > other for m in moving)]
+            self.layers[depth] = [other for other in self.layers[depth]
+                                  if not any(m > other for m in moving)] \
+                                 + moving
+            moving = dominated
+            depth += 1
+
+        if moving:
+            self.layers.append(moving)
+            depth = len(self.layers)
+
+        # Everything from the start layer down may have changed ranks, but
+        # only the layers we touched need their crowding distances redone.
+        for i, layer in enumerate(self.layers[start:], start=start):
+            for member in layer:
+                member.rank = i + 1
+
+        for layer in self.layers[start:depth]:
+            crowding_distance(layer)
+
+    def truncate(self, max_size):
+        """ Drop the most crowded individuals of the worst rank until we are
+        down to `max_size` individuals
+
+        :param max_size: of the population
+        :returns: None
+        """
+        while sum(len(layer) for layer in self.layers) > max_size:
+            last = self.layers[-1]
+            last.remove(min(last, key=lambda x: x.distance))
+
+            if last:
+                crowding_distance(last)
+            else:
+                del self.layers[-1]
+
+    def __call__(self, individual, pop, max_size):
+        """ Insert `individual` into `pop`
+
+        :param individual: that was just evaluated
+        :param pop: of already evaluated individuals; this is updated in place
+        :param max_size: of the pop
+        :returns: None
+        """
+        self.insert(individual)
+        self.truncate(max_size)
+
+        pop.clear()
+        for layer in self.layers:
+            pop.extend(layer)
+
+
+def steady_state_nsga_2(client, max_births, init_pop_size, pop_size,
+                        representation, problem, offspring_pipeline,
+                        evaluated_probe=None, pop_probe=None,
+                        insertion_callback=None, generation_callback=None,
+                        checkpoint_callback=None, checkpoint_interval=None,
+                        resume_state=None, evaluator=None,
+                        context=context):
+    """ Asynchronous steady-state NSGA-II
+
+    This mirrors leap_ec.distrib.asynchronous.steady_state(), but also keeps
+    a "virtual" generation counter that is bumped every `pop_size` insertions
+    so that the population snapshots and mutation step size adaptation remain
+    comparable with the generational EA.
+
+    Non-viable individuals *are* counted towards the birth budget, just as
+    they are for the generational EA, so that both modes have the same
+    evaluation budget.
+
+    :param client: Dask client that should already be set-up
+    :param max_births: how many offspring are we allowing, not counting the
+        initial population?
+    :param init_pop_size: size of initial population sent directly to workers
+        at start
+    :param pop_size: how large should the population be?
+    :param representation: of the individuals
+    :param problem: to be solved
+    :param offspring_pipeline: for creating new offspring from the pop
+    :param evaluated_probe: optional function that accepts a list of newly
+        evaluated individuals, such as the one from log_worker_location()
+    :param pop_probe: optional function that accepts the population, such as
+        the one from log_pop(); called at the end of each virtual generation
+    :param insertion_callback: optional function called with a list of each
+        newly evaluated offspring, not counting the initial population, and
+        the population after it was inserted, such as an engine's update()
+    :param generation_callback: optional function called with the new
+        virtual generation number at the end of each virtual generation
+    :param checkpoint_callback: optional function called with the population
+        and keyword arguments `births`, `generation`, and `inserted` every
+        `checkpoint_interval` evaluations; the keyword arguments are what's
+        needed in `resume_state` to resume the run
+    :param checkpoint_interval: how many evaluations between checkpoints
+    :param resume_state: optional dict with `population`, `births`,
+        `generation`, and `inserted` from which to resume the run
+    :param evaluator: for the workers to evaluate individuals with, from
+        evaluation.create_evaluator(); defaults to the threads one
+    :param context: for tracking births and generations
+    :return: the population containing the final individuals
+    """
+    inserter = NSGA2Inserter()
+
+    if evaluator is None:
+        evaluator = create_evaluator(context=context)
+
+    # This is where we'll be putting evaluated individuals
+    pop = []
+
+    if resume_state is None:
+        initial_population = representation.create_population(init_pop_size,
+                                                              problem=problem)
+
+        # fan out the entire initial population to dask workers
+        as_completed_iter = as_completed(submitted(initial_population),
+                                         client, evaluator)
+
+        initial_uuids = {individual.uuid for individual in initial_population}
+        birth_counter = util.inc_births(context, start=0)
+        generation_counter = util.inc_generation(context=context)
+
+        # How many individuals have been inserted since the last virtual
+        # generation
+        inserted = 0
+
+        # Offspring whose evaluations are done, which is all a checkpoint can
+        # account for
+        completed_births = 0
+    else:
+        for individual in resume_state['population']:
+            inserter(individual, pop, pop_size)
+
+        initial_uuids = set()
+        birth_counter = util.inc_births(context, start=resume_state['births'])
+        generation_counter = util.inc_generation(
+            start_generation=resume_state['generation'], context=context)
+        inserted = resume_state['inserted']
+        completed_births = resume_state['births']
+
+        # Offspring that were in flight when the checkpoint was written were
+        # lost, so we refill the workers with new ones.
+        num_offspring = min(init_pop_size,
+                            max_births - birth_counter.births())
+        offspring = []
+        while len(offspring) < num_offspring:
+            offspring.extend(toolz.pipe(pop, *offspring_pipeline))
+
+        as_completed_iter = as_completed(submitted(offspring), client,
+                                         evaluator)
+        birth_counter.do_increment(len(offspring))
+
+    evaluations = 0
+
+    for evaluated_future in as_completed_iter:
+        evaluated = evaluated_future.result()
+
+        if evaluated.uuid not in initial_uuids:
+            completed_births += 1
+
+        if evaluated_probe is not None:
+            evaluated_probe([evaluated])
+
+        logger.debug(f'Evaluated {evaluated.uuid} with fitness '
+                     f'{evaluated.fitness!s}')
+
+        inserter(evaluated, pop, pop_size)
+        inserted += 1
+
+        if insertion_callback is not None and \
+                evaluated.uuid not in initial_uuids:
+            insertion_callback([evaluated], pop)
+
+        if inserted >= pop_size:
+            inserted = 0
+            generation_counter()
+
+            if pop_probe is not None:
+                pop_probe(pop)
+
+            if generation_callback is not None:
+                generation_callback(generation_counter.generation())
+
+        evaluations += 1
+        if checkpoint_callback is not None and \
+                evaluations % checkpoint_interval == 0:
+            checkpoint_callback(pop, births=completed_births,
+                                generation=generation_counter.generation(),
+                                inserted=inserted)
+
+        if birth_counter.births() < max_births:
+            # Only create an offspring if we have the budget for one; we just
+            # freed a worker, so we only need one to keep it busy.
+            offspring = toolz.pipe(pop, *offspring_pipeline)
+
+            for child in submitted(offspring):
+                future = client.submit(evaluator, child, pure=False)
+                as_completed_iter.add(future)
+
+            birth_counter.do_increment(len(offspring))
+
+    return pop
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+    Adaptive timeouts and speculative re-execution of straggling trainings
+
+    The fixed training timeout has to be generous enough for the slowest
+    legitimate training, so a training where `dp` has wedged, which on Summit
+    sometimes happens without it ever writing lcurve.out, holds on to its
+    worker for hours; in the generational EA, it also holds up the whole
+    generation.  StragglerPolicy learns how long trainings actually take:
+
+    - On the client it is a probe that records the runtimes of completed
+      trainings, and publishes a deadline per number of training steps of
+      `slack` times the `quantile` of the runtimes, to a small JSON file in
+      the run directory, as MedianStoppingRule does its thresholds.
+    - On the workers, DeepMDProblem kills trainings that run past the
+      published deadline, or whose lcurve.out hasn't changed for
+      `stall_timeout` seconds.  A wedged `dp` may well ignore SIGTERM, so
+      whatever is left of the training `kill_grace` seconds later is
+      SIGKILLed.
+
+    With `speculate`, speculative_eval_pool() replaces eval_pool() in the
+    generational EA, and when an evaluation has used up `speculate_fraction`
+    of either its deadline or the stall timeout while some workers are idle,
+    it's launched again on another worker.  Whichever attempt finishes first
+    with a viable result is kept, and the other is told to stop through a
+    `.cancel` file in its training directory.
+"""
+import copy
+import json
+import logging
+import os
+from pathlib import Path
+from time import time
+
+import numpy as np
+from distributed import wait
+from toolz import curry
+
+from leap_ec import ops
+from leap_ec.global_vars import context
+
+from evaluation import create_evaluator, total_threads
+
+logger = logging.getLogger(__name__)
+
+# Written in a training's directory to tell its worker to stop it
+CANCEL_FILE = '.cancel'
+
+
+class StragglerPolicy:
+    """ Kill trainings that take far longer than completed ones """
+
+    def __init__(self, deadlines_file, timeout, min_samples=10, quantile=0.95,
+                 slack=1.5, stall_timeout=1800, poll_interval=60,
+                 kill_grace=10, speculate=False, speculate_fraction=0.5):
+        """
+        :param deadlines_file: where the client publishes the deadlines for
+            the workers; should be on a filesystem shared by both
+        :param timeout: the fixed training timeout, in seconds, which
+            deadlines never exceed
+        :param min_samples: minimum number of completed trainings with the
+            same number of steps before we have an adaptive deadline for them
+        :param quantile: of the runtimes of completed trainings
+        :param slack: multiple of the quantile after which trainings are
+            killed
+        :param stall_timeout: kill trainings whose lcurve.out hasn't changed,
+            or hasn't been written, for this many seconds
+        :param poll_interval: how often, in seconds, to check on trainings
+        :param kill_grace: how long, in seconds, a killed training has to
+            exit after SIGTERM before it's SIGKILLed
+        :param speculate: if True, speculative_eval_pool() launches suspected
+            stragglers again on another worker
+        :param speculate_fraction: of the deadline or stall timeout after
+            which a training is suspected of straggling
+        """
+        self.deadlines_file = Path(deadlines_file)
+        self.timeout = timeout
+        self.min_samples = min_samples
+        self.quantile = quantile
+        self.slack = slack
+        self.stall_timeout = stall_timeout
+        self.poll_interval = poll_interval
+        self.kill_grace = kill_grace
+        self.speculate = speculate
+        self.speculate_fraction = speculate_fraction
+
+        # Only kept on the client; numb_steps -> list of runtimes in seconds
+        self.runtimes = {}
+
+    def __getstate__(self):
+        # Workers only need the published deadlines
+        state = self.__dict__.copy()
+        state['runtimes'] = {}
+        return state
+
+    def record(self, individual):
+        """ Record the runtime of a completed training
+
+        :param individual: evaluated individual
+        """
+        if not individual.is_viable or individual.numb_steps is None or \
+                getattr(individual, 'cached_uuid', None) or \
+                getattr(individual, 'stop_reason', None) or \
+                getattr(individual, 'init_model', None):
+            # Cached fitnesses took no time, and early stopped and
+            # warm-started trainings are shorter than a full training
+            return
+
+        self.runtimes.setdefault(int(individual.numb_steps), []).append(
+            individual.stop_eval_time - individual.start_eval_time)
+
+    def deadline(self, numb_steps):
+        """ :returns: how long, in seconds, a training of `numb_steps` steps
+            may run """
+        runtimes = self.runtimes.get(int(numb_steps), [])
+
+        if len(runtimes) < self.min_samples:
+            return self.timeout
+
+        return min(self.timeout,
+                   self.slack * float(np.quantile(runtimes, self.quantile)))
+
+    def publish(self):
+        """ Atomically write the current deadlines for the workers """
+        tmp_file = self.deadlines_file.with_suffix('.tmp')
+
+        with open(tmp_file, 'w') as out:
+            json.dump({str(numb_steps): self.deadline(numb_steps)
+                       for numb_steps in self.runtimes}, out)
+
+        os.replace(tmp_file, self.deadlines_file)
+
+    def __call__(self, population):
+        """ Pipeline probe for recording newly evaluated individuals
+
+        :param population: newly evaluated individuals
+        :returns: the same population
+        """
+        for individual in population:
+            self.record(individual)
+
+        self.publish()
+
+        return population
+
+    def load(self, numb_steps):
+        """ Read the deadline published by the client
+
+        :param numb_steps: total number of steps of the training
+        :returns: the deadline in seconds
+        """
+        if not self.deadlines_file.exists():
+            return self.timeout
+
+        with open(self.deadlines_file, 'r') as deadlines_file:
+            deadlines = json.load(deadlines_file)
+
+        return deadlines.get(str(int(numb_steps)), self.timeout)
+
+    def check(self, directory, started, deadline):
+        """ Should the training in `directory` be stopped?
+
+        :param directory: in which the training is running
+        :param started: time() when the training started
+        :param deadline: as returned by load()
+        :returns: the reason for stopping, or None if it should continue
+        """
+        directory = Path(directory)
+        now = time()
+
+        if (directory / CANCEL_FILE).exists():
+            return 'cancelled since another attempt finished first'
+
+        if now - started > deadline:
+            return f'still running after {deadline:.0f} s, the deadline ' \
+                   f'from completed trainings'
+
+        stalled = now - last_progress(directory, started)
+        if stalled > self.stall_timeout:
+            return f'no lcurve.out progress for {stalled:.0f} s'
+
+        return None
+
+    def suspect(self, directory, numb_steps):
+        """ Is the training in `directory` suspected of straggling?
+
+        This is checked by the client, from the training directory on the
+        shared filesystem.
+
+        :param directory: of the training
+        :param numb_steps: of the training
+        :returns: True if it has used up `speculate_fraction` of its deadline
+            or of the stall timeout
+        """
+        input_json = Path(directory) / 'input.json'
+
+        try:
+            started = input_json.stat().st_mtime
+        except FileNotFoundError:
+            # Not started yet
+            return False
+
+        now = time()
+
+        return now - started > self.speculate_fraction * \
+            self.deadline(numb_steps) or \
+            now - last_progress(directory, started) > \
+            self.speculate_fraction * self.stall_timeout
+
+
+def last_progress(directory, started):
+    """ :returns: when lcurve.out in `directory` was last written, or
+        `started` if it hasn't been yet """
+    try:
+        return max(started, (Path(directory) / 'lcurve.out').stat().st_mtime)
+    except FileNotFoundError:
+        return started
+
+
+def training_dir(individual, attempt=None):
+    """ :returns: the directory in which the individual is trained """
+    problem = individual.problem
+    numb_steps = individual.fidelity or problem.numb_steps
+
+    return Path(problem.run_dir) / problem.subdir_name(
+        individual.uuid, numb_steps,
+        individual.attempt if attempt is None else attempt)
+
+
+@curry
+@ops.iterlist_op
+def speculative_eval_pool(next_individual, client, size, stragglers,
+                          evaluator=None, context=context):
+    """ Concurrently evaluate `size` individuals, speculatively launching
+    suspected stragglers again
+
+    This is a stand-in for leap_ec.distrib.synchronous.eval_pool() that
+    keeps only the first viable result of the attempts of each individual.
+
+    :param next_individual: iterator/generator for individual provider
+    :param client: dask client through which we submit individuals to be
+        evaluated
+    :param size: how many individuals to evaluate simultaneously
+    :param stragglers: StragglerPolicy that says which evaluations are
+        suspected of straggling
+    :param evaluator: for the workers to evaluate individuals with, from
+        evaluation.create_evaluator(); defaults to the threads one
+    :param context: for storing count of non-viable individuals
+    :return: the pool of evaluated individuals
+    """
+    if evaluator is None:
+        evaluator = create_evaluator(context=context)
+
+    offspring = [next(next_individual) for _ in range(size)]
+    evaluated = [None] * size
+
+    futures = client.map(evaluator, offspring, pure=False)
+    # future -> index of its individual
+    pending = {future: i for i, future in enumerate(futures)}
+    speculated = set()
+
+    while pending:
+        try:
+            done, _ = wait(list(pending), timeout=stragglers.poll_interval,
+                           return_when='FIRST_COMPLETED')
+        except TimeoutError:
+            done = set()
+
+        for future in done:
+            i = pending.pop(future)
+            individual = future.result()
+            others = [other for other, j in pending.items() if j == i]
+
+            evaluated[i] = individual
+
+            if not individual.is_viable and others:
+                # Give the other attempt a chance
+                continue
+
+            for other in others:
+                del pending[other]
+                other.cancel()
+                cancel(offspring[i], 1 - individual.attempt)
+
+            if individual.attempt > 0:
+                logger.info(f'Speculative attempt at {individual.uuid} '
+                            f'finished first')
+
+        idle = total_threads(client) - len(pending)
+
+        for i in list(pending.values()):
+            if idle <= 0:
+                break
+
+            if i in speculated or \
+                    not stragglers.suspect(training_dir(offspring[i]),
+                                           offspring[i].fidelity or
+                                           offspring[i].problem.numb_steps):
+                continue
+
+            logger.info(f'Speculatively evaluating {offspring[i].uuid} '
+                        f'again')
+            attempt = copy.copy(offspring[i])
+            attempt.attempt = 1
+            pending[client.submit(evaluator, attempt, pure=False)] = i
+            speculated.add(i)
+            idle -= 1
+
+    return evaluated
+
+
+def cancel(individual, attempt):
+    """ Tell the worker running an attempt at the individual to stop it """
+    directory = training_dir(individual, attempt)
+
+    if directory.exists():
+        (directory / CANCEL_FILE).touch()
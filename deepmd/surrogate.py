@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+    Surrogate-model prescreening of offspring
+
+    Creating offspring is essentially free, but evaluating one ties up a node
+    for up to the training timeout.  So we oversample offspring, predict
+    their fitnesses with a Gaussian process fit to every evaluation, and
+    only send those with the best predicted hypervolume improvement to the
+    dask workers.
+
+    The evaluations written to the results by log_worker_location() before
+    the surrogate was created, such as those of a resumed run, are read once;
+    after that, the surrogate is a probe for newly evaluated individuals, so
+    that prescreening every birth of the steady-state EA doesn't re-read all
+    the results.  The GPs are only refit once per (virtual) generation.
+
+    - Emmerich, Michael T. M., Kyriakos C. Giannakoglou, and Boris Naujoks.
+      "Single- and multiobjective evolutionary optimization assisted by
+      Gaussian random field metamodels." IEEE Transactions on Evolutionary
+      Computation 10.4 (2006): 421-439.
+
+    The GP is implemented directly in numpy since the training sets are only
+    as large as the number of evaluations, which is at most a few thousand.
+"""
+import logging
+
+import numpy as np
+
+from leap_ec.global_vars import context
+
+from decoder import DeepMDDecoder
+from problem import DeepMDProblem
+from reporting import individual_fields
+
+logger = logging.getLogger(__name__)
+
+
+def features(phenome):
+    """ Encode a phenome as a real-valued feature vector for the surrogate
+
+    Learning rates are on a log scale, and categorical hyperparameters are
+    one-hot encoded.
+
+    :param phenome: dict-like of hyperparameters, such as a row of the
+        evaluated individuals or phenome._asdict()
+    :returns: numpy array of features
+    """
+    encoded = [np.log10(float(phenome['start_lr'])),
+               np.log10(float(phenome['stop_lr'])),
+               float(phenome['rcut_smth']),
+               float(phenome['rcut'])]
+
+    for name, values in (('scale_by_worker',
+                          DeepMDDecoder.SCALE_BY_WORKER_VALUES),
+                         ('desc_activ_func', DeepMDDecoder.ACTIV_FUNC_VALUES),
+                         ('fitting_activ_func',
+                          DeepMDDecoder.ACTIV_FUNC_VALUES)):
+        encoded.extend(float(phenome[name] == value) for value in values)
+
+    return np.array(encoded)
+
+
+def non_dominated(points):
+    """ :returns: the points not dominated by any other, for minimization """
+    dominated = [np.any(np.all(points <= point, axis=1) &
+                        np.any(points < point, axis=1))
+                 for point in points]
+    return points[~np.array(dominated, dtype=bool)]
+
+
+def hypervolume_2d(points, reference):
+    """ Hypervolume dominated by the given points, for minimization
+
+    :param points: (n, 2) array of objective values
+    :param reference: point that bounds the hypervolume
+    :returns: the hypervolume
+    """
+    points = points[np.all(points < reference, axis=1)]
+    points = points[np.argsort(points[:, 0])]
+
+    volume = 0.0
+    best = reference[1]
+
+    for x, y in points:
+        if y < best:
+            volume += (reference[0] - x) * (best - y)
+            best = y
+
+    return volume
+
+
+class GaussianProcess:
+    """ Gaussian process regression with an RBF kernel
+
+    Inputs and outputs are standardized, and the length scale is picked from
+    a small grid by maximizing the log marginal likelihood.
+    """
+
+    def __init__(self, length_scales=(0.25, 0.5, 1.0, 2.0), noise=1e-2):
+        """
+        :param length_scales: candidates, relative to the square root of the
+            number of features
+        :param noise: variance of the observation noise, relative to that of
+            the standardized outputs
+        """
+        self.length_scales = length_scales
+        self.noise = noise
+
+    def kernel(self, a, b):
+        squared = np.sum(a ** 2, axis=1)[:, None] + \
+                  np.sum(b ** 2, axis=1)[None, :] - 2 * a @ b.T
+        return np.exp(-0.5 * np.maximum(squared, 0) / self.length_scale ** 2)
+
+    def fit(self, x, y):
+        """
+        :param x: (n, d) array of inputs
+        :param y: (n,) array of outputs
+        :returns: self
+        """
+        self.x_mean = x.mean(axis=0)
+        self.x_std = x.std(axis=0)
+        self.x_std[self.x_std == 0] = 1.0
+        self.y_mean = y.mean()
+        self.y_std = y.std() or 1.0
+
+        self.x = (x - self.x_mean) / self.x_std
+        y = (y - self.y_mean) / self.y_std
+
+        best_likelihood = -np.inf
+
+        for length_scale in self.length_scales:
+            self.length_scale = length_scale * np.sqrt(x.shape[1])
+            k = self.kernel(self.x, self.x) + self.noise * np.eye(len(y))
+            cholesky = np.linalg.cholesky(k)
+            alpha = np.linalg.solve(cholesky.T, np.linalg.solve(cholesky, y))
+            likelihood = -0.5 * y @ alpha - np.sum(np.log(np.diag(cholesky)))
+
+            if likelihood > best_likelihood:
+                best_likelihood = likelihood
+                best = self.length_scale, cholesky, alpha
+
+        self.length_scale, self.cholesky, self.alpha = best
+
+        return self
+
+    def predict(self, x):
+        """
+        :param x: (m, d) array of inputs
+        :returns: predicted means and standard deviations
+        """
+        k = self.kernel((x - self.x_mean) / self.x_std, self.x)
+        mean = k @ self.alpha
+        v = np.linalg.solve(self.cholesky, k.T)
+        variance = np.maximum(1.0 - np.sum(v ** 2, axis=0), 1e-12)
+
+        return mean * self.y_std + self.y_mean, np.sqrt(variance) * self.y_std
+
+
+class Surrogate:
+    """ Prescreen oversampled offspring by predicted hypervolume improvement
+
+    A GP per objective is fit to the log10 of the RMSEs of the completed, full
+    length trainings in the evaluated individuals.  Candidates are then
+    greedily picked by the hypervolume improvement of their optimistic
+    predictions, mean - kappa * standard deviation, over the observed Pareto
+    front plus the candidates already picked.
+    """
+
+    def __init__(self, results, numb_steps, oversampling=5, min_training=20,
+                 max_training=1000, kappa=1.0, context=context):
+        """
+        :param results: results_sink.ResultsSink to which
+            log_worker_location() writes the evaluated individuals, whose
+            rows so far are read once
+        :param numb_steps: training steps of a full evaluation; only those
+            evaluations are used for training
+        :param oversampling: how many candidates to create per offspring
+        :param min_training: minimum number of evaluations before we start
+            prescreening
+        :param max_training: only the most recent evaluations are used to
+            bound the cost of fitting
+        :param kappa: how optimistic to be about uncertain predictions
+        :param context: for the current generation
+        """
+        self.numb_steps = numb_steps
+        self.oversampling = oversampling
+        self.min_training = min_training
+        self.max_training = max_training
+        self.kappa = kappa
+        self.context = context
+
+        # Features and log10 fitnesses of the usable evaluated individuals
+        self.x, self.y = [], []
+        # The GPs per objective and the log10 fitnesses they were fit to, and
+        # the generation they were fit in
+        self.fitted = None
+        self.fit_generation = None
+
+        for row in results.read():
+            self.add(row)
+
+    def add(self, row):
+        """ Add an evaluated individual to the training data, if it's usable
+
+        :param row: of the evaluated individual, as log_worker_location()
+            writes it
+        """
+        try:
+            fitness = np.array((float(row['energy_fitness']),
+                                float(row['force_fitness'])))
+            numb_steps = int(row['numb_steps'])
+        except (KeyError, TypeError, ValueError):
+            return
+
+        # Skip non-viable individuals, and those only partially
+        # trained since they're not comparable
+        if not np.all(np.isfinite(fitness)) or \
+                np.any(fitness <= 0) or \
+                np.any(fitness == DeepMDProblem.BAD_FITNESS) or \
+                numb_steps != self.numb_steps or \
+                row.get('stop_reason'):
+            return
+
+        self.x.append(features(row))
+        self.y.append(np.log10(fitness))
+
+    def __call__(self, population):
+        """ Pipeline probe for adding newly evaluated individuals to the
+        training data
+
+        :param population: newly evaluated individuals
+        :returns: the same population
+        """
+        for individual in population:
+            row = individual_fields(individual)
+            row.update(stop_reason=getattr(individual, 'stop_reason', None))
+            self.add(row)
+
+        return population
+
+    def training_data(self):
+        """ :returns: features and log10 fitnesses of the most recent usable
+            evaluated individuals """
+        return np.array(self.x[-self.max_training:]), \
+            np.array(self.y[-self.max_training:])
+
+    def fit(self):
+        """ Fit the GPs, unless they already were this generation
+
+        :returns: the GPs per objective and the log10 fitnesses they were fit
+            to, or None if there are too few evaluations to fit to
+        """
+        generation = self.context['leap'].get('generation', 0)
+
+        if self.fitted is not None and self.fit_generation == generation:
+            return self.fitted
+
+        x, y = self.training_data()
+
+        if len(y) < self.min_training:
+            logger.info(f'Only {len(y)} evaluations to train the surrogate '
+                        f'on, so not prescreening')
+            return None
+
+        self.fitted = [GaussianProcess().fit(x, y[:, objective])
+                       for objective in range(y.shape[1])], y
+        self.fit_generation = generation
+
+        return self.fitted
+
+    def select(self, candidates, size):
+        """ Pick the candidates with the best predicted hypervolume
+        improvement
+
+        :param candidates: unevaluated individuals
+        :param size: how many to pick
+        :returns: list of picked individuals
+        """
+        fitted = self.fit()
+
+        if fitted is None:
+            return candidates[:size]
+
+        gps, y = fitted
+
+        phenomes = [candidate.decode() for candidate in candidates]
+        candidate_x = np.array([features(phenome._asdict())
+                                for phenome in phenomes])
+
+        predicted = []
+        for gp in gps:
+            mean, std = gp.predict(candidate_x)
+            predicted.append(mean - self.kappa * std)
+        predicted = np.column_stack(predicted)
+
+        front = non_dominated(y)
+        reference = y.max(axis=0) + 0.1 * (y.max(axis=0) - y.min(axis=0)) + \
+                    1e-6
+
+        picked = []
+        remaining = list(range(len(candidates)))
+
+        while len(picked) < size and remaining:
+            volume = hypervolume_2d(front, reference)
+            improvements = [hypervolume_2d(np.vstack((front, predicted[i])),
+                                           reference) - volume
+                            for i in remaining]
+
+            # Break ties, usually among candidates that don't improve on the
+            # front, by how good the prediction is overall
+            best = max(range(len(remaining)),
+                       key=lambda j: (improvements[j],
+                                      -predicted[remaining[j]].sum()))
+            i = remaining.pop(best)
+
+            picked.append(i)
+            front = non_dominated(np.vstack((front, predicted[i])))
+
+        logger.info(f'Surrogate trained on {len(y)} evaluations picked '
+                    f'{len(picked)} of {len(candidates)} candidates')
+
+        return [candidates[i] for i in picked]
+
+    def prescreen(self, size):
+        """ Pipeline operator that picks `size` of the candidates it's given
+
+        This should follow ops.pool(size=oversampling * size), and returns an
+        iterator so it can be followed by another pool or eval_pool().
+        """
+        def prescreen(candidates):
+            return iter(self.select(list(candidates), size))
+
+        return prescreen
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+    Checks that selection's vectorized NSGA-II operators agree with LEAP's
+
+    rank_sort and crowding_distance have to give the same ranks and
+    distances, in the same order, as rank_ordinal_sort and
+    crowding_distance_calc for runs to be unaffected by which is used.  The
+    populations are random, with fitnesses drawn from a few values so that
+    there are plenty of ties and duplicates.
+
+    usage: python -m pytest test_selection.py
+"""
+import numpy as np
+import pytest
+
+from leap_ec.individual import Individual
+from leap_ec.multiobjective.ops import rank_ordinal_sort, \
+    crowding_distance_calc
+from leap_ec.multiobjective.problems import MultiObjectiveProblem
+
+from selection import rank_sort, crowding_distance
+
+POPULATIONS = 250
+
+
+class RandomProblem(MultiObjectiveProblem):
+    """ A problem whose individuals are given their fitnesses directly """
+
+    def evaluate(self, phenome):
+        raise NotImplementedError
+
+
+def random_problem(rng, objectives):
+    """ :returns: a problem with a random mix of objectives to minimize and
+        maximize """
+    return RandomProblem(
+        maximize=list(rng.choice([True, False], size=objectives)))
+
+
+def random_population(rng, size, problem):
+    """ :returns: individuals with random fitnesses """
+    population = []
+
+    for _ in range(size):
+        individual = Individual(np.zeros(1), problem=problem)
+        individual.fitness = rng.integers(
+            0, 4, size=len(problem.maximize)).astype(float)
+        population.append(individual)
+
+    return population
+
+
+def copies(population):
+    """ :returns: clones of the individuals with the same fitnesses """
+    cloned = []
+
+    for individual in population:
+        clone = individual.clone()
+        clone.fitness = individual.fitness
+        cloned.append(clone)
+
+    return cloned
+
+
+@pytest.mark.parametrize('objectives', [1, 2, 3, 4])
+def test_matches_leap(objectives):
+    rng = np.random.default_rng(objectives)
+
+    for _ in range(POPULATIONS):
+        problem = random_problem(rng, objectives)
+        offspring = random_population(rng, rng.integers(1, 30), problem)
+        parents = random_population(rng, rng.integers(0, 30), problem)
+
+        expected = crowding_distance_calc(
+            rank_ordinal_sort(copies(offspring), parents=copies(parents)))
+        actual = crowding_distance(rank_sort(offspring, parents=parents))
+
+        assert [list(x.fitness) for x in actual] == \
+            [list(x.fitness) for x in expected]
+        assert [x.rank for x in actual] == [x.rank for x in expected]
+        # Selection negates ranks, which would wrap around if unsigned
+        assert all(type(x.rank) is int for x in actual)
+        np.testing.assert_array_equal([x.distance for x in actual],
+                                      [x.distance for x in expected])
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+    Handling the stdout and stderr of trainings
+
+    With `disp_training` on, `dp train` writes tens of MB of output, which we
+    used to hold in memory until the training was done, and then print and
+    log in full on the worker.  Instead, OutputStreaming pipes the output
+    straight to rotating files in the individual's directory, and only keeps
+    the last few lines in memory for the worker log, so memory use per
+    evaluation is constant.
+"""
+import logging
+import threading
+from collections import deque
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from time import time
+
+
+class TrainingOutput:
+    """ Drain a training process's stdout and stderr
+
+    Each stream is read by its own thread so that the process never blocks on
+    a full pipe, regardless of how we wait on it.
+    """
+
+    def __init__(self, process, max_bytes=None, backup_count=3,
+                 tail_lines=50, markers=(), directory='.'):
+        """
+        :param process: subprocess.Popen with text stdout and stderr pipes,
+            or anything else with `stdout` and `stderr` text streams
+        :param max_bytes: if given, each stream is written to dp_stdout.log
+            or dp_stderr.log in `directory`, rotated after this many bytes,
+            and only the last `tail_lines` lines are kept in memory;
+            otherwise, all the output is kept in memory
+        :param backup_count: how many rotated files to keep per stream
+        :param tail_lines: how many lines of each stream to keep in memory
+            when streaming to files
+        :param markers: (name, text) pairs; the time of the first line of
+            either stream containing each text is kept in `marks` by name
+        :param directory: for the log files
+        """
+        self.lines = {}
+        self.threads = []
+        self.markers = markers
+        self.marks = {}
+
+        for name, stream in (('stdout', process.stdout),
+                             ('stderr', process.stderr)):
+            handler = None
+            if max_bytes is not None:
+                handler = RotatingFileHandler(Path(directory) /
+                                              f'dp_{name}.log',
+                                              maxBytes=max_bytes,
+                                              backupCount=backup_count)
+                handler.terminator = ''
+
+            self.lines[name] = deque(maxlen=tail_lines if handler else None)
+
+            thread = threading.Thread(target=self.pump,
+                                      args=(stream, handler, self.lines[name],
+                                            self.markers, self.marks),
+                                      daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    @staticmethod
+    def pump(stream, handler, lines, markers=(), marks=None):
+        """ Copy lines from the stream to the handler and the in-memory lines
+        until the stream is closed, noting when markers first show up """
+        try:
+            for line in stream:
+                for name, text in markers:
+                    if name not in marks and text in line:
+                        marks.setdefault(name, time())
+
+                if handler is not None:
+                    handler.emit(logging.makeLogRecord({'msg': line}))
+                lines.append(line)
+        finally:
+            stream.close()
+            if handler is not None:
+                handler.close()
+
+    def join(self):
+        """ Wait until both streams have been drained """
+        for thread in self.threads:
+            thread.join()
+
+    @property
+    def stdout(self):
+        """ :returns: what we kept of stdout """
+        return ''.join(self.lines['stdout'])
+
+    @property
+    def stderr(self):
+        """ :returns: what we kept of stderr """
+        return ''.join(self.lines['stderr'])
+
+
+class OutputStreaming:
+    """ Stream training output to rotating files in the training's directory
+    """
+
+    def __init__(self, max_bytes=10_000_000, backup_count=3, tail_lines=50):
+        """
+        :param max_bytes: size at which dp_stdout.log and dp_stderr.log are
+            rotated
+        :param backup_count: how many rotated files to keep per stream
+        :param tail_lines: how many of the last lines of each stream are
+            kept for the worker log
+        """
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.tail_lines = tail_lines
+
+    def __call__(self, process, markers=(), directory='.'):
+        """
+        :param process: as for TrainingOutput
+        :param markers: as for TrainingOutput
+        :param directory: in which the training is running
+        :returns: TrainingOutput streaming to files
+        """
+        return TrainingOutput(process, max_bytes=self.max_bytes,
+                              backup_count=self.backup_count,
+                              tail_lines=self.tail_lines, markers=markers,
+                              directory=directory)
@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+"""
+    Worker utilization report for a run
+
+    log_worker_location() records the hostname, pid, evaluation slot, and
+    start and stop times of every evaluation, and this turns them into where the
+    allocation's hours went, without the notebook work it used to take.
+
+    Evaluations are split into rounds at the moments when no worker was
+    busy; in the generational EA, each round is a generation, or a rung of
+    successive halving, while a steady-state run is mostly one long round.
+    Every worker's share of the run is then either:
+
+    - busy -- evaluating
+    - barrier -- idle at the end of a round, after its last evaluation in
+      it, waiting on the rest of the workers to finish theirs
+    - starved -- idle during a round in which it had nothing to evaluate at
+      all, or before its first evaluation in it, or between its evaluations
+    - client -- idle between rounds, while the client selects and breeds
+
+    Workers are the distinct (hostname, pid, slot) of the evaluations, so
+    a worker process that runs several evaluations at once counts as that
+    many workers, one per slot, and workers that never evaluated anything go
+    unnoticed; the `$LSB_JOBID.hosts` file
+    that batch_submit.sh writes lists every node of the allocation, and
+    compute nodes in it that no evaluation ran on are reported as unused.
+    When the workers run on the launch node and start their trainings with
+    jsrun, the evaluations' hostnames are all the launch node's, so all
+    that can be told is how many workers there were for how many nodes.
+
+    It also prints the distribution of evaluation times per number of
+    training steps, and can render a Gantt chart of every worker's
+    evaluations, which needs matplotlib.
+
+    usage: utilization.py [--hosts JOBID.hosts] [--gantt FILE] results
+                          [results ...]
+
+    where each results is an individuals CSV file or a results SQLite
+    database; give all of the islands' to report on an island run.
+"""
+import argparse
+import fnmatch
+import sys
+
+import numpy as np
+
+from engines import read_results
+
+# Nodes in the hosts file that run the client and scheduler, not trainings
+LAUNCH_HOSTS = ('batch*', 'login*')
+
+# Shares of the workers' time, in the order they're reported
+SHARES = ('busy', 'barrier', 'starved', 'client')
+
+
+def worker_id(row):
+    """ :returns: the worker of the row's evaluation on its host: the pid,
+        and the evaluation slot if the row has one """
+    slot = row.get('slot')
+
+    if slot is None or slot == '':
+        return str(row.get('pid'))
+
+    return f"{row.get('pid')}/{int(float(slot))}"
+
+
+def evaluations(rows):
+    """ :returns: list of (hostname, worker, start, stop, row) of the rows
+        with valid times, sorted by start """
+    result = []
+
+    for row in rows:
+        try:
+            start = float(row['start_eval_time'])
+            stop = float(row['stop_eval_time'])
+        except (KeyError, TypeError, ValueError):
+            continue
+
+        if not np.isfinite(start) or not np.isfinite(stop) or stop < start:
+            continue
+
+        result.append((str(row.get('hostname')), worker_id(row), start, stop,
+                       row))
+
+    return sorted(result, key=lambda x: x[2])
+
+
+def rounds(evaluations):
+    """ Split evaluations into rounds at the moments no worker was busy
+
+    :param evaluations: as returned by evaluations()
+    :returns: list of (start, stop, evaluations) of each round
+    """
+    result = []
+
+    for evaluation in evaluations:
+        start, stop = evaluation[2], evaluation[3]
+
+        if result and start < result[-1][1]:
+            result[-1][1] = max(result[-1][1], stop)
+            result[-1][2].append(evaluation)
+        else:
+            result.append([start, stop, [evaluation]])
+
+    return [tuple(round_) for round_ in result]
+
+
+def worker_shares(evaluations):
+    """ Account for every worker's time from the first evaluation's start to
+    the last one's stop
+
+    :param evaluations: as returned by evaluations()
+    :returns: the rounds, and dict of (hostname, worker) -> dict of share ->
+        seconds
+    """
+    split = rounds(evaluations)
+    workers = sorted({(hostname, worker)
+                      for hostname, worker, *_ in evaluations})
+    shares = {worker: dict.fromkeys(SHARES, 0.0) for worker in workers}
+
+    if not split:
+        return split, shares
+
+    window = split[-1][1] - split[0][0]
+    spanned = sum(stop - start for start, stop, _ in split)
+
+    for start, stop, round_evaluations in split:
+        # worker -> [busy seconds, last stop]
+        seen = {}
+
+        for hostname, worker, eval_start, eval_stop, _ in round_evaluations:
+            busy = seen.setdefault((hostname, worker), [0.0, eval_start])
+            busy[0] += eval_stop - eval_start
+            busy[1] = max(busy[1], eval_stop)
+
+        for key in workers:
+            busy, last_stop = seen.get(key, (0.0, start))
+            shares[key]['busy'] += busy
+            shares[key]['barrier'] += stop - last_stop if busy else 0.0
+            shares[key]['starved'] += (last_stop - start) - busy if busy \
+                else stop - start
+
+    for key in workers:
+        shares[key]['client'] = window - spanned
+
+    return split, shares
+
+
+def read_hosts(path, launch_hosts=LAUNCH_HOSTS):
+    """ :returns: the sorted short names of the compute nodes in a hosts
+        file, leaving out the launch nodes """
+    with open(path, 'r') as hosts_file:
+        hosts = {line.strip().split('.')[0] for line in hosts_file
+                 if line.strip()}
+
+    return sorted(host for host in hosts
+                  if not any(fnmatch.fnmatch(host, pattern)
+                             for pattern in launch_hosts))
+
+
+def unused_hosts(hosts, evaluations):
+    """ Cross-reference the allocated compute nodes with those evaluations
+    ran on
+
+    :param hosts: as returned by read_hosts()
+    :param evaluations: as returned by evaluations()
+    :returns: list of the unused nodes, or None if no evaluation ran on any
+        of them, as when the workers run on the launch node
+    """
+    used = {hostname.split('.')[0] for hostname, *_ in evaluations}
+
+    if not used & set(hosts):
+        return None
+
+    return [host for host in hosts if host not in used]
+
+
+def evaluation_times(evaluations):
+    """ :returns: dict of numb_steps -> array of the evaluation times of the
+        trainings with that many steps, with cached fitnesses as their own
+        'cached' group """
+    times = {}
+
+    for _, _, start, stop, row in evaluations:
+        if row.get('cached_uuid'):
+            key = 'cached'
+        else:
+            try:
+                key = int(float(row['numb_steps']))
+            except (KeyError, TypeError, ValueError):
+                key = '?'
+
+        times.setdefault(key, []).append(stop - start)
+
+    return {key: np.array(value) for key, value in times.items()}
+
+
+def gantt(path, evaluations, split, hosts=()):
+    """ Render every worker's evaluations as a Gantt chart
+
+    :param path: of the image file to write
+    :param evaluations: as returned by evaluations()
+    :param split: rounds as returned by rounds()
+    :param hosts: compute nodes to show empty rows for if nothing ran on them
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from matplotlib.patches import Patch
+
+    origin = split[0][0]
+    workers = sorted({(hostname, worker)
+                      for hostname, worker, *_ in evaluations})
+    used = {hostname.split('.')[0] for hostname, _ in workers}
+    rows = [f'{hostname} {worker}' for hostname, worker in workers] + \
+        [f'{host} (unused)' for host in hosts if host not in used]
+    index = {key: i for i, key in enumerate(workers)}
+    colors = {'full': 'tab:blue', 'stopped': 'tab:orange',
+              'failed': 'tab:red', 'cached': 'tab:gray'}
+
+    figure, axes = plt.subplots(figsize=(12, max(2, 0.25 * len(rows) + 1)))
+
+    for hostname, worker, start, stop, row in evaluations:
+        if row.get('cached_uuid'):
+            kind = 'cached'
+        elif str(row.get('is_viable')) not in ('True', '1'):
+            kind = 'failed'
+        elif row.get('stop_reason'):
+            kind = 'stopped'
+        else:
+            kind = 'full'
+
+        axes.broken_barh([((start - origin) / 3600, (stop - start) / 3600)],
+                         (index[(hostname, worker)] - 0.4, 0.8),
+                         facecolors=colors[kind])
+
+    for start, _, _ in split[1:]:
+        axes.axvline((start - origin) / 3600, color='black', linewidth=0.5,
+                     alpha=0.3)
+
+    axes.set_yticks(range(len(rows)))
+    axes.set_yticklabels(rows, fontsize='small')
+    axes.set_ylim(len(rows) - 0.5, -0.5)
+    axes.set_xlabel('Hours since the first evaluation')
+    axes.legend(handles=[Patch(color=color, label=kind)
+                         for kind, color in colors.items()],
+                loc='upper right', fontsize='small')
+    figure.tight_layout()
+    figure.savefig(path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Report on how busy the workers of a run were')
+    parser.add_argument('results', nargs='+',
+                        help='Individuals CSV files or results databases')
+    parser.add_argument('--hosts',
+                        help='$LSB_JOBID.hosts file of the allocated nodes')
+    parser.add_argument('--launch-hosts', nargs='+', default=LAUNCH_HOSTS,
+                        help='Patterns of the nodes in the hosts file that '
+                             'run the client and scheduler')
+    parser.add_argument('--gantt',
+                        help='Image file to render a Gantt chart of the '
+                             'evaluations to')
+    args = parser.parse_args()
+
+    from rich.console import Console
+    from rich.table import Table
+
+    console = Console()
+
+    evaluated = evaluations([row for path in args.results
+                             for row in read_results(path)])
+
+    if not evaluated:
+        sys.exit('No evaluations with valid times in the results')
+
+    split, shares = worker_shares(evaluated)
+    window = split[-1][1] - split[0][0]
+
+    # Per node, and over the run
+    nodes = {}
+    for (hostname, _), seconds in shares.items():
+        node = nodes.setdefault(hostname, dict.fromkeys(SHARES, 0.0))
+        node['workers'] = node.get('workers', 0) + 1
+        for share in SHARES:
+            node[share] += seconds[share]
+
+    table = Table(title=f'Worker time over {window / 3600:.2f} hours and '
+                        f'{len(split)} rounds')
+    for column in ('node', 'workers', 'worker-hours') + SHARES:
+        table.add_column(column)
+
+    total = dict.fromkeys(SHARES, 0.0)
+    for hostname, node in sorted(nodes.items()):
+        worker_hours = node['workers'] * window / 3600
+        table.add_row(hostname, str(node['workers']), f'{worker_hours:.2f}',
+                      *(f'{node[share] / (node["workers"] * window):.1%}'
+                        if window else '-' for share in SHARES))
+        for share in SHARES:
+            total[share] += node[share]
+
+    table.add_row('all', str(len(shares)),
+                  f'{len(shares) * window / 3600:.2f}',
+                  *(f'{total[share] / (len(shares) * window):.1%}'
+                    if window else '-' for share in SHARES),
+                  style='bold')
+    console.print(table)
+
+    # The rounds that lost the most to their barriers
+    table = Table(title='Rounds with the most barrier loss')
+    for column in ('round', 'evaluations', 'hours', 'barrier worker-hours',
+                   'slowest evaluation hours'):
+        table.add_column(column)
+
+    losses = []
+    for i, (start, stop, round_evaluations) in enumerate(split):
+        last_stops = {}
+        for hostname, worker, _, eval_stop, _ in round_evaluations:
+            last_stops[(hostname, worker)] = max(
+                last_stops.get((hostname, worker), 0.0), eval_stop)
+        losses.append((sum(stop - last_stop
+                           for last_stop in last_stops.values()), i))
+
+    for loss, i in sorted(losses, key=lambda x: (-x[0], x[1]))[:10]:
+        start, stop, round_evaluations = split[i]
+        table.add_row(str(i), str(len(round_evaluations)),
+                      f'{(stop - start) / 3600:.2f}', f'{loss / 3600:.2f}',
+                      f'{max(e[3] - e[2] for e in round_evaluations) / 3600:.2f}')
+    console.print(table)
+
+    # Evaluation time distributions
+    table = Table(title='Evaluation minutes per number of training steps')
+    for column in ('numb_steps', 'evaluations', 'mean', 'p10', 'p50', 'p90',
+                   'p99', 'max'):
+        table.add_column(column)
+
+    for key, times in sorted(evaluation_times(evaluated).items(),
+                             key=lambda x: (isinstance(x[0], str),
+                                            str(x[0]).zfill(20))):
+        minutes = times / 60
+        table.add_row(str(key), str(len(times)), f'{minutes.mean():.2f}',
+                      *(f'{value:.2f}' for value in
+                        np.quantile(minutes, (0.1, 0.5, 0.9, 0.99))),
+                      f'{minutes.max():.2f}')
+    console.print(table)
+
+    hosts = []
+    if args.hosts:
+        hosts = read_hosts(args.hosts, args.launch_hosts)
+        unused = unused_hosts(hosts, evaluated)
+
+        if unused is None:
+            console.print(f'No evaluation ran on any of the {len(hosts)} '
+                          f'allocated compute nodes, so the workers ran on '
+                          f'the launch node; there were {len(shares)} '
+                          f'workers for them')
+            hosts = []
+        else:
+            console.print(f'{len(unused)} of the {len(hosts)} allocated '
+                          f'compute nodes were never used, for '
+                          f'{len(unused) * window / 3600:.2f} node-hours'
+                          + (f': {", ".join(unused)}' if unused else ''))
+            hosts = unused
+
+    if args.gantt:
+        gantt(args.gantt, evaluated, split, hosts)
+        console.print(f'Wrote the Gantt chart to {args.gantt}')
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+    Checking offspring on the client before they're queued for training
+
+    Offspring whose hyperparameters violate the constraints between them,
+    such as a starting learning rate no higher than the stopping one, would
+    otherwise take a worker just to fail DeepMDProblem.check_phenome().
+    Instead, the `repair` pipeline operator fixes them right after mutation
+    with DeepMDDecoder.repair(), as DeepMDRepresentation does the initial
+    population.
+
+    Some configurations that do satisfy the constraints still crash
+    TensorFlow, which we otherwise only find out after a worker has waited
+    on `dp` to start up.  SmokeTest optionally trains every offspring for
+    just a handful of steps on the workers, and only those that survive go
+    on to the full training queue.
+"""
+import logging
+
+from leap_ec import ops
+
+logger = logging.getLogger(__name__)
+
+
+@ops.iteriter_op
+def repair(next_individual):
+    """ Pipeline operator that repairs the genomes of offspring in place so
+    that they satisfy the constraints between hyperparameters
+
+    :param next_individual: iterator of individuals
+    :returns: iterator of the repaired individuals
+    """
+    for individual in next_individual:
+        individual.decoder.repair(individual.genome)
+
+        yield individual
+
+
+def smoke_test(individual, numb_steps, timeout):
+    """ What the workers do for each smoke test
+
+    :returns: None if the individual's configuration trained, else why not
+    """
+    return individual.problem.smoke_test(individual.decode(), individual.uuid,
+                                         numb_steps=numb_steps,
+                                         timeout=timeout)
+
+
+class SmokeTest:
+    """ Only pass on offspring whose configurations survive a few steps of
+    training """
+
+    def __init__(self, client, numb_steps=10, timeout=10, max_failed_rounds=3):
+        """
+        :param client: dask client through which we run the smoke tests
+        :param numb_steps: how many steps to train for
+        :param timeout: how long, in minutes, to allow each smoke test
+        :param max_failed_rounds: give up if this many rounds of smoke tests
+            in a row all fail, since `dp` itself is likely broken
+        """
+        self.client = client
+        self.numb_steps = numb_steps
+        self.timeout = timeout
+        self.max_failed_rounds = max_failed_rounds
+
+    def run(self, candidates):
+        """ Smoke test candidates concurrently
+
+        :param candidates: list of individuals
+        :returns: list of those that passed
+        """
+        futures = self.client.map(smoke_test, candidates,
+                                  numb_steps=self.numb_steps,
+                                  timeout=self.timeout, pure=False)
+        passed = []
+
+        for candidate, failure in zip(candidates, self.client.gather(futures)):
+            if failure is None:
+                passed.append(candidate)
+            else:
+                logger.info(f'Discarding {candidate.uuid}, which failed its '
+                            f'smoke test: {failure}')
+
+        return passed
+
+    def screen(self, size):
+        """ Pipeline operator that smoke tests candidates `size` at a time,
+        and then as many more as failed, passing on those that survive
+
+        This needs an endless supply of candidates, so it should come
+        straight after mutation and repair, and before any prescreening.  It
+        returns an iterator so it can be followed by a pool or eval_pool().
+        """
+        def screen(next_individual):
+            needed, failed_rounds = size, 0
+
+            while True:
+                candidates = [next(next_individual) for _ in range(needed)]
+                passed = self.run(candidates)
+
+                if passed:
+                    failed_rounds = 0
+                else:
+                    failed_rounds += 1
+                    if failed_rounds >= self.max_failed_rounds:
+                        raise RuntimeError(f'{failed_rounds} rounds of smoke '
+                                           f'tests all failed; is dp broken?')
+
+                yield from passed
+                needed = len(candidates) - len(passed) or size
+
+        return screen
@@ -0,0 +1,446 @@
+#!/usr/bin/env python3
+"""
+    Warm trainer processes that keep deepmd-kit loaded between trainings
+
+    Every `dp train` starts Python, imports TensorFlow and deepmd-kit, and
+    reads the training and validation systems before it takes its first
+    step.  With the `warm` launcher, trainings go through a long-lived
+    trainer server on the worker's node instead:
+
+    - The server imports the trainer once, and keeps the .npy files of every
+      system it has been asked to train on in memory.
+    - Each training runs in a child forked from the server, so it inherits
+      all of that, and its np.load() of those files is served from memory.
+    - `warm_trainer.py run` is a small client that stands in for `dp` in the
+      training command.  It starts the server if need be and sends it the
+      job along with its own stdout and stderr, which the child writes to
+      directly.  It exits with the child's return code.  If the client is
+      killed, such as by a timeout or the stopping rule, the server kills
+      the child.
+
+    So as far as DeepMDProblem is concerned, the client is just another
+    `dp`.
+
+    The server is started with the environment of the client that needed it,
+    including the CUDA_VISIBLE_DEVICES and CPU binding of its GPU slot, and
+    there is one server per set of visible GPUs, so trainings sharing a GPU
+    share a server.  It exits once it has been idle for `idle_timeout`
+    seconds.  Since the children are forked, the server itself must never
+    initialize CUDA, which importing TensorFlow doesn't.
+
+    usage: warm_trainer.py serve --trainer {dp,fake} --socket PATH
+                                 [--idle-timeout SECONDS]
+           warm_trainer.py run --trainer {dp,fake} [--socket-dir DIR]
+                               [--idle-timeout SECONDS] -- ARG...
+"""
+import argparse
+import fcntl
+import importlib
+import json
+import os
+import select
+import signal
+import socket
+import subprocess
+import sys
+import traceback
+from pathlib import Path
+from time import sleep, time
+
+import numpy as np
+
+# This script, for starting servers
+WARM_TRAINER = Path(__file__).absolute()
+
+# How long, in seconds, to wait for a new server to import its trainer
+STARTUP_TIMEOUT = 600
+
+# How long, in seconds, a killed training has to exit before it's SIGKILLed
+KILL_GRACE = 10
+
+
+def load_trainer(name):
+    """ Import a trainer
+
+    :param name: `dp` for deepmd-kit, or `fake` for fake_dp.py
+    :returns: its main(), which takes the command line arguments without the
+        program name
+    """
+    if name == 'dp':
+        return importlib.import_module('deepmd.entrypoints.main').main
+    elif name == 'fake':
+        return importlib.import_module('fake_dp').main
+
+    raise ValueError(f'Unknown trainer {name}; should be dp or fake')
+
+
+def socket_path(socket_dir, trainer):
+    """ :returns: path of the socket of the server for the given trainer and
+        the GPUs visible to this process """
+    user = os.environ.get('USER', 'deepmd')
+    gpus = os.environ.get('CUDA_VISIBLE_DEVICES', 'all').replace(',', '-')
+
+    return Path(socket_dir) / f'deepmd_trainer_{user}_{trainer}_{gpus}.sock'
+
+
+def send_message(connection, message, fds=()):
+    """ Send a JSON message, and optionally file descriptors, as one line """
+    data = (json.dumps(message) + '\n').encode()
+
+    if fds:
+        sent = socket.send_fds(connection, [data], list(fds))
+        data = data[sent:]
+
+    connection.sendall(data)
+
+
+def receive_request(connection):
+    """ Receive a job request along with the client's stdout and stderr
+
+    :returns: the request, and the list of received file descriptors
+    """
+    data, fds, _, _ = socket.recv_fds(connection, 65536, 2)
+
+    while data and not data.endswith(b'\n'):
+        chunk = connection.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+
+    return json.loads(data), fds
+
+
+def cached_load(arrays):
+    """ :returns: np.load() that returns copies of the given arrays, keyed by
+        absolute path, instead of reading them """
+    load = np.load
+
+    def load_cached(file, *args, **kwargs):
+        if isinstance(file, (str, os.PathLike)):
+            array = arrays.get(os.path.abspath(file))
+            if array is not None:
+                return array.copy()
+
+        return load(file, *args, **kwargs)
+
+    return load_cached
+
+
+class TrainerServer:
+    """ Fork trainings from a process with the trainer already loaded """
+
+    def __init__(self, trainer, path, idle_timeout=3600):
+        """
+        :param trainer: name of the trainer to load; see load_trainer()
+        :param path: of the Unix socket on which to listen
+        :param idle_timeout: exit after this many seconds without trainings
+        """
+        self.trainer = trainer
+        self.main = load_trainer(trainer)
+        self.path = Path(path)
+        self.idle_timeout = idle_timeout
+
+        # Absolute path -> array for the .npy files of the systems
+        self.arrays = {}
+        self.preloaded = set()
+
+        # Connection -> pid of the child running its training
+        self.jobs = {}
+        self.listener = None
+
+    def preload(self, input_json):
+        """ Read the .npy files of any systems in input.json that we haven't
+        seen yet """
+        with open(input_json, 'r') as input_file:
+            training = json.load(input_file).get('training', {})
+
+        for data in ('training_data', 'validation_data'):
+            systems = training.get(data, {}).get('systems', [])
+            if isinstance(systems, str):
+                systems = [systems]
+
+            for system in systems:
+                system = os.path.abspath(
+                    os.path.join(os.path.dirname(input_json), system))
+                if system in self.preloaded or not os.path.isdir(system):
+                    continue
+
+                for npy_file in Path(system).rglob('*.npy'):
+                    self.arrays[str(npy_file)] = np.load(npy_file)
+
+                self.preloaded.add(system)
+                print(f'Preloaded {system}', flush=True)
+
+    def start(self, connection):
+        """ Fork a child to run the training requested on the connection """
+        request, fds = receive_request(connection)
+
+        for arg in request['argv']:
+            if arg.endswith('.json'):
+                try:
+                    self.preload(os.path.join(request['cwd'], arg))
+                except Exception:
+                    # The training will report any problem with its input
+                    traceback.print_exc()
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+        pid = os.fork()
+        if pid == 0:
+            self.run_child(connection, request, fds)
+
+        # Put the child in its own process group here as well as in the
+        # child, so that it's in it before anyone can try to kill it.
+        try:
+            os.setpgid(pid, pid)
+        except OSError:
+            pass
+
+        for fd in fds:
+            os.close(fd)
+
+        self.jobs[connection] = pid
+        print(f'Started training {pid} in {request["cwd"]}', flush=True)
+        send_message(connection, {'pid': pid})
+
+    def run_child(self, connection, request, fds):
+        """ Run the training in the forked child; never returns """
+        returncode = 1
+
+        try:
+            os.setpgid(0, 0)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+            self.listener.close()
+            for other in self.jobs:
+                other.close()
+            connection.close()
+
+            os.dup2(fds[0], sys.stdout.fileno())
+            os.dup2(fds[1], sys.stderr.fileno())
+            for fd in fds:
+                os.close(fd)
+
+            os.chdir(request['cwd'])
+            os.environ.clear()
+            os.environ.update(request['env'])
+
+            np.load = cached_load(self.arrays)
+            sys.argv = [self.trainer] + request['argv']
+
+            self.main(request['argv'])
+            returncode = 0
+        except SystemExit as e:
+            if isinstance(e.code, int) or e.code is None:
+                returncode = e.code or 0
+            else:
+                print(e.code, file=sys.stderr)
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(returncode)
+
+    def reap(self):
+        """ Report the return codes of finished trainings to their clients """
+        for connection, pid in list(self.jobs.items()):
+            done, status = os.waitpid(pid, os.WNOHANG)
+
+            if done:
+                returncode = os.waitstatus_to_exitcode(status)
+                print(f'Training {pid} exited with {returncode}', flush=True)
+                try:
+                    send_message(connection, {'returncode': returncode})
+                except OSError:
+                    pass
+                connection.close()
+                del self.jobs[connection]
+
+    def kill(self, connection):
+        """ Kill the training of a client that went away """
+        pid = self.jobs.pop(connection)
+        connection.close()
+        print(f'Killing training {pid}', flush=True)
+
+        try:
+            os.killpg(pid, signal.SIGTERM)
+            deadline = time() + KILL_GRACE
+            while not os.waitpid(pid, os.WNOHANG)[0]:
+                if time() > deadline:
+                    os.killpg(pid, signal.SIGKILL)
+                    os.waitpid(pid, 0)
+                    break
+                sleep(0.1)
+        except (ProcessLookupError, ChildProcessError):
+            pass
+
+    def serve(self):
+        """ Serve trainings until we've been idle for too long """
+        # Exit cleanly, killing any trainings, if we're terminated
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+        if self.path.exists():
+            self.path.unlink()
+
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(str(self.path))
+        self.listener.listen(16)
+        print(f'Serving {self.trainer} trainings on {self.path}', flush=True)
+
+        last_active = time()
+
+        try:
+            while self.jobs or time() - last_active < self.idle_timeout:
+                readable, _, _ = select.select([self.listener, *self.jobs],
+                                               [], [], 1)
+
+                for connection in readable:
+                    if connection is self.listener:
+                        client, _ = self.listener.accept()
+                        try:
+                            self.start(client)
+                        except Exception:
+                            traceback.print_exc()
+                            client.close()
+                    elif connection in self.jobs and \
+                            not connection.recv(1024):
+                        # Clients only send their request, so this is the
+                        # client going away before its training finished.
+                        self.kill(connection)
+
+                self.reap()
+
+                if self.jobs:
+                    last_active = time()
+        finally:
+            self.listener.close()
+            self.path.unlink(missing_ok=True)
+
+            for connection in list(self.jobs):
+                self.kill(connection)
+
+        print(f'Idle for {self.idle_timeout} s, so exiting', flush=True)
+
+
+def connect(path, trainer, idle_timeout):
+    """ Connect to the server, starting it if it isn't running
+
+    :param path: of the server's socket
+    :param trainer: for the server to load, if it needs starting
+    :param idle_timeout: for the server, if it needs starting
+    :returns: connected socket
+    """
+    def open_connection():
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            connection.connect(str(path))
+        except OSError:
+            connection.close()
+            raise
+        return connection
+
+    # Only one client gets to start the server
+    with open(f'{path}.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        try:
+            return open_connection()
+        except (FileNotFoundError, ConnectionRefusedError):
+            pass
+
+        log_file = path.with_suffix('.log')
+        with open(log_file, 'a') as log:
+            server = subprocess.Popen([sys.executable, str(WARM_TRAINER),
+                                       'serve', f'--trainer={trainer}',
+                                       f'--socket={path}',
+                                       f'--idle-timeout={idle_timeout}'],
+                                      stdin=subprocess.DEVNULL, stdout=log,
+                                      stderr=subprocess.STDOUT,
+                                      start_new_session=True)
+
+        deadline = time() + STARTUP_TIMEOUT
+
+        while True:
+            sleep(0.1)
+            try:
+                return open_connection()
+            except (FileNotFoundError, ConnectionRefusedError):
+                if server.poll() is not None:
+                    raise RuntimeError(f'The {trainer} trainer server '
+                                       f'exited; see {log_file}')
+                if time() > deadline:
+                    raise
+
+
+def run(trainer, argv, socket_dir='/tmp', idle_timeout=3600):
+    """ Run a training in the warm trainer server
+
+    :param trainer: name of the trainer; see load_trainer()
+    :param argv: trainer command line arguments, without the program name
+    :param socket_dir: node-local directory for the server's socket
+    :param idle_timeout: for the server, if it needs starting
+    :returns: the training's return code
+    """
+    path = socket_path(socket_dir, trainer)
+
+    # The server may exit for being idle just as we connect, in which case
+    # we never hear back and try again with a new server.
+    for _ in range(2):
+        connection = connect(path, trainer, idle_timeout)
+
+        with connection, connection.makefile('r') as replies:
+            send_message(connection,
+                         {'cwd': os.getcwd(), 'argv': argv,
+                          'env': dict(os.environ)},
+                         fds=[sys.stdout.fileno(), sys.stderr.fileno()])
+
+            if not replies.readline():
+                continue
+
+            reply = replies.readline()
+            if not reply:
+                print(f'The {trainer} trainer server went away',
+                      file=sys.stderr)
+                return 1
+
+            return json.loads(reply)['returncode']
+
+    print(f'Could not start the training on the {trainer} trainer server',
+          file=sys.stderr)
+    return 1
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = subparsers.add_parser('serve')
+    serve_parser.add_argument('--trainer', choices=['dp', 'fake'],
+                              required=True)
+    serve_parser.add_argument('--socket', required=True)
+    serve_parser.add_argument('--idle-timeout', type=float, default=3600)
+
+    run_parser = subparsers.add_parser('run')
+    run_parser.add_argument('--trainer', choices=['dp', 'fake'],
+                            required=True)
+    run_parser.add_argument('--socket-dir', default='/tmp')
+    run_parser.add_argument('--idle-timeout', type=float, default=3600)
+    run_parser.add_argument('args', nargs=argparse.REMAINDER,
+                            help='trainer arguments, after a --')
+
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        TrainerServer(args.trainer, args.socket, args.idle_timeout).serve()
+    else:
+        trainer_args = args.args
+        if trainer_args[:1] == ['--']:
+            trainer_args = trainer_args[1:]
+
+        returncode = run(args.trainer, trainer_args, args.socket_dir,
+                         args.idle_timeout)
+        sys.exit(returncode if returncode >= 0 else 128 - returncode)